@@ -6,15 +6,70 @@
 """
 
 import logging
+import html
+import io
 import json
+import mmap
 import random
+import secrets
+import sqlite3
 import asyncio
+import argparse
+import bisect
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import importlib.util
+import math
 import os
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+import time
+import abc
+import tracemalloc
+from array import array
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Iterator, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+from telegram import InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from telegram.error import TelegramError, Forbidden, BadRequest
+from telegram.ext import TypeHandler, ApplicationHandlerStop, InlineQueryHandler
+from telegram.error import TelegramError, Forbidden, BadRequest, RetryAfter
+
+# مرمزات اختيارية أسرع من json القياسية
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# مكتبات اختيارية للتحليلات والرسوم البيانية
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
 
 # إعدادات التسجيل المتقدمة
 logging.basicConfig(
@@ -34,8 +89,57 @@ BOT_VERSION = "2.0"
 
 # ملفات البيانات
 DATA_FILE = "users_data.json"
+USERS_COLD_FILE = "users_cold.db"
 MESSAGES_FILE = "messages_log.json"
 SETTINGS_FILE = "bot_settings.json"
+SCHEDULE_FILE = "schedule.json"
+ACHIEVEMENTS_FILE = "achievements.json"  # اختياري: قواعد إنجازات مخصصة
+LEDGER_FILE = "ledger.jsonl"
+LEDGER_CHECKPOINT_FILE = "ledger_checkpoint.json"
+LOTTERY_FOLDER = "lottery"
+INVESTMENTS_FILE = "investments.json"
+TOURNAMENTS_FILE = "tournaments.json"
+SEARCH_INDEX_FILE = "messages_search.db"
+DIRECTORY_FILE = "user_directory.json"
+ANALYTICS_FOLDER = "analytics"
+
+# ألعاب إضافية: games/<الاسم>.py تُكتشف بأسمائها عند الإقلاع وتُستورد عند أول جولة
+GAME_PLUGINS_FOLDER = "games"
+USERS_SAVE_SECONDS = 2  # جولات الألعاب تُحفظ مجمعة بهذه الفترة بدلاً من حفظ كامل لكل جولة
+
+# سجل تدقيق الجولات: مقطع ثنائي لكل يوم مسلسل بالتجزئة مع فهرس للمستخدمين يُبنى عند إغلاق اليوم
+AUDIT_FOLDER = "audit"
+AUDIT_PLAIN_DAYS = 7               # المقاطع الأحدث تبقى غير مضغوطة للبحث عبر mmap
+AUDIT_MAINTENANCE_SECONDS = 3600
+AUDIT_MAX_ROUNDS_SHOWN = 50
+
+# بوتات إضافية في نفس العملية: كل بوت في مجلد فرعي باسمه داخل TENANTS_FOLDER
+TENANTS_FILE = "tenants.json"
+TENANTS_FOLDER = "tenants"
+
+# وضع الإقلاع السريع: فتح لقطة مفهرسة عبر mmap بدلاً من json.load للملف كاملاً
+FAST_STARTUP_MODE = False
+USERS_SNAPSHOT_FILE = "users_data.snap"
+MESSAGES_SNAPSHOT_FILE = "messages_log.snap"
+
+# تخزين المستخدمين على طبقتين: الخاملون ينتقلون من الذاكرة إلى أرشيف مضغوط
+USER_TIERING = True
+USER_HOT_MAX = 50000               # أقصى عدد مستخدمين في الذاكرة
+USER_COLD_AFTER_DAYS = 14          # الخامل أكثر من ذلك ينتقل إلى الأرشيف
+USER_EVICT_PROTECT_SECONDS = 300   # لا يُنقل من استُخدم مؤخراً حتى عند امتلاء الذاكرة
+USER_EVICT_BATCH = 20000
+USER_TIERING_SECONDS = 600
+
+# صيغة حفظ الحالة: json | orjson | msgpack
+STATE_CODEC = "json"
+
+# النسخ الاحتياطية: رابط صلب للملف السابق قبل كل استبدال (بحد أقصى مرة كل فترة)
+BACKUP_FOLDER = "backups"
+USERS_BACKUP_PREFIX = os.path.join(BACKUP_FOLDER, "users_backup_")
+MESSAGES_BACKUP_PREFIX = os.path.join(BACKUP_FOLDER, "messages_backup_")
+BACKUP_INTERVAL_SECONDS = 300
+BACKUP_KEEP = 48
+RECOVERY_BUDGET_SECONDS = 60  # زمن الاستعادة المقبول عند الإقلاع (معيار bench-recovery)
 
 # الإعدادات الافتراضية
 DEFAULT_SETTINGS = {
@@ -47,85 +151,2393 @@ DEFAULT_SETTINGS = {
     "daily_reward_max": 200,
     "starting_balance": 1000,
     "level_up_bonus": 100,
+    "level_curve": {"linear": 150, "quadratic": 10, "max_level": 1000},  # نقاط المستوى = خطي×م + تربيعي×م²
     "transfer_fee": 0.02,  # 2% رسوم التحويل
-    "welcome_bonus": 500
+    "min_transfer": 10,
+    "welcome_bonus": 500,
+    "referral_rewards": [100, 25, 10],  # مكافأة الداعي المباشر ثم المستويات الأعلى
+    "daily_reminders": True,  # تذكير المستخدم عند جاهزية المكافأة اليومية
+    "lottery_ticket_price": 50,
+    "lottery_max_tickets": 1000,  # الحد الأقصى لتذاكر المستخدم في السحب الواحد
+    "lottery_house_cut": 0.1,  # 10% من الجائزة للكازينو
+    "lottery_prize_shares": [0.6, 0.3, 0.1],  # نصيب المركز الأول والثاني والثالث
+    "lottery_draw_hour": 20,
+    "investment_plans": {
+        "short": {"days": 1, "daily_rate": 0.01},
+        "medium": {"days": 7, "daily_rate": 0.015},
+        "long": {"days": 30, "daily_rate": 0.02}
+    },
+    "min_investment": 100,
+    "max_investments": 5,  # عدد الاستثمارات النشطة لكل مستخدم
+    "tournament_house_cut": 0.1,
+    "tournament_prize_shares": [0.5, 0.3, 0.2]
 }
 
-class EnhancedGameBot:
+# ===== لقطة الإعدادات =====
+
+SETTINGS_POLL_SECONDS = 5  # فترة فحص ملف الإعدادات لالتقاط تعديلات العمليات الأخرى
+
+# مخطط الإعدادات: المفتاح -> النوع المطلوب
+SETTINGS_SCHEMA = {
+    "maintenance_mode": bool,
+    "maintenance_message": str,
+    "min_bet": int,
+    "max_bet": int,
+    "daily_reward_min": int,
+    "daily_reward_max": int,
+    "starting_balance": int,
+    "level_up_bonus": int,
+    "level_curve": dict,
+    "transfer_fee": float,
+    "min_transfer": int,
+    "welcome_bonus": int,
+    "referral_rewards": list,
+    "daily_reminders": bool,
+    "lottery_ticket_price": int,
+    "lottery_max_tickets": int,
+    "lottery_house_cut": float,
+    "lottery_prize_shares": list,
+    "lottery_draw_hour": int,
+    "investment_plans": dict,
+    "min_investment": int,
+    "max_investments": int,
+    "tournament_house_cut": float,
+    "tournament_prize_shares": list,
+}
+
+def valid_prize_shares(shares) -> bool:
+    return bool(shares) and all(type(share) in (int, float) and share > 0 for share in shares) and sum(shares) <= 1 + 1e-9
+
+# قيود القيم: (وصف الخطأ، شرط الصحة)
+SETTINGS_RULES = [
+    ("min_bet يجب أن يكون أكبر من صفر", lambda s: s['min_bet'] > 0),
+    ("max_bet يجب أن يكون أكبر من min_bet", lambda s: s['max_bet'] > s['min_bet']),
+    ("المكافأة اليومية: 0 ≤ daily_reward_min ≤ daily_reward_max",
+     lambda s: 0 <= s['daily_reward_min'] <= s['daily_reward_max']),
+    ("القيم المالية لا تكون سالبة", lambda s: min(s['starting_balance'], s['level_up_bonus'], s['welcome_bonus'],
+                                                  s['min_transfer'], s['min_investment']) >= 0),
+    ("transfer_fee بين 0 و 1", lambda s: 0 <= s['transfer_fee'] < 1),
+    ("lottery_house_cut بين 0 و 1", lambda s: 0 <= s['lottery_house_cut'] < 1),
+    ("lottery_draw_hour بين 0 و 23", lambda s: 0 <= s['lottery_draw_hour'] <= 23),
+    ("سعر التذكرة وحد التذاكر أكبر من صفر", lambda s: s['lottery_ticket_price'] > 0 and s['lottery_max_tickets'] > 0),
+    ("lottery_prize_shares: أنصبة موجبة مجموعها ≤ 1", lambda s: valid_prize_shares(s['lottery_prize_shares'])),
+    ("tournament_house_cut بين 0 و 1", lambda s: 0 <= s['tournament_house_cut'] < 1),
+    ("tournament_prize_shares: أنصبة موجبة مجموعها ≤ 1", lambda s: valid_prize_shares(s['tournament_prize_shares'])),
+    ("referral_rewards: أعداد صحيحة غير سالبة",
+     lambda s: all(type(reward) is int and reward >= 0 for reward in s['referral_rewards'])),
+    ("level_curve: linear وquadratic وmax_level أعداد صحيحة موجبة",
+     lambda s: all(type(s['level_curve'].get(key)) is int and s['level_curve'][key] > 0
+                   for key in ('linear', 'quadratic', 'max_level'))),
+    ("investment_plans: لكل خطة days > 0 وdaily_rate ≥ 0",
+     lambda s: s['investment_plans'] and all(type(plan.get('days')) is int and plan['days'] > 0
+                                             and isinstance(plan.get('daily_rate'), (int, float)) and plan['daily_rate'] >= 0
+                                             for plan in s['investment_plans'].values())),
+    ("max_investments أكبر من صفر", lambda s: s['max_investments'] > 0),
+]
+
+def validate_settings(settings: Dict[str, Any]) -> list:
+    """التحقق من الإعدادات مقابل المخطط والقيود - تُرجع قائمة الأخطاء (فارغة إذا كانت صحيحة)"""
+    errors = []
+    for key, expected in SETTINGS_SCHEMA.items():
+        if key not in settings:
+            errors.append(f"{key}: مفقود")
+            continue
+        value = settings[key]
+        # bool فرع من int في بايثون فلا يُقبل مكان الأعداد، والعدد الصحيح مقبول مكان العشري
+        if expected is bool:
+            valid = type(value) is bool
+        elif expected is int:
+            valid = type(value) is int
+        elif expected is float:
+            valid = type(value) in (int, float)
+        else:
+            valid = isinstance(value, expected)
+        if not valid:
+            errors.append(f"{key}: يجب أن يكون من النوع {expected.__name__}")
+    if errors:
+        return errors
+    for message, rule in SETTINGS_RULES:
+        try:
+            if not rule(settings):
+                errors.append(message)
+        except (TypeError, AttributeError, KeyError):
+            errors.append(message)
+    return errors
+
+def freeze_value(value):
+    """نسخة غير قابلة للتعديل: القواميس تصبح MappingProxyType والقوائم tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_value(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_value(item) for item in value)
+    return value
+
+def thaw_value(value):
+    """عكس freeze_value لإعادة الكتابة بصيغة JSON"""
+    if isinstance(value, Mapping):
+        return {key: thaw_value(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw_value(item) for item in value]
+    return value
+
+class SettingsSnapshot(Mapping):
+    """لقطة إعدادات مجمدة ومرقمة - لا تتغير بعد إنشائها، وأي تعديل ينتج لقطة جديدة"""
+
+    __slots__ = ('_data', 'version')
+
+    def __init__(self, data: Dict[str, Any], version: int):
+        self._data = freeze_value(data)
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return thaw_value(self._data)
+
+class SettingsStore:
+    """مصدر الإعدادات: لقطة حالية تُستبدل مرجعياً دفعة واحدة، مع إعادة تحميل عند تغيّر الملف من عملية أخرى"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.current = SettingsSnapshot(DEFAULT_SETTINGS, 0)
+        self._stat: Optional[Tuple[int, int]] = None
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> SettingsSnapshot:
+        """قراءة الملف والتحقق منه - ValueError إذا كان غير صالح"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        if not isinstance(raw, dict):
+            raise ValueError("ملف الإعدادات ليس كائن JSON")
+        version = raw.pop('_version', 0)
+        # المفاتيح الجديدة في DEFAULT_SETTINGS تأخذ قيمتها الافتراضية
+        settings = {**DEFAULT_SETTINGS, **raw}
+        errors = validate_settings(settings)
+        if errors:
+            raise ValueError("؛ ".join(errors))
+        return SettingsSnapshot(settings, version if type(version) is int else 0)
+
+    def load(self) -> SettingsSnapshot:
+        """التحميل عند الإقلاع - ملف غير صالح يُسجَّل ويُستخدم الافتراضي بدلاً منه"""
+        self._stat = self._file_stat()
+        try:
+            self.current = self._read()
+        except FileNotFoundError:
+            pass
+        except (ValueError, json.JSONDecodeError) as e:
+            logger.error(f"ملف الإعدادات غير صالح، استخدام الإعدادات الافتراضية: {e}")
+        return self.current
+
+    def reload_if_changed(self) -> bool:
+        """فحص الملف وتبديل اللقطة إذا عدّلته عملية أخرى - الملف غير الصالح يُتجاهل وتبقى اللقطة الحالية"""
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        self._stat = stat
+        try:
+            snapshot = self._read()
+        except (OSError, ValueError) as e:
+            logger.error(f"تجاهل ملف إعدادات غير صالح: {e}")
+            return False
+        # مقارنة المحتوى لا رقم الإصدار وحده: كاتب آخر قد يحفظ الرقم نفسه بقيم مختلفة
+        if snapshot.version == self.current.version and snapshot.to_dict() == self.current.to_dict():
+            return False
+        self.current = snapshot
+        logger.info(f"تم تحميل إعدادات الإصدار {snapshot.version}")
+        return True
+
+    def update(self, changes: Dict[str, Any]) -> SettingsSnapshot:
+        """تطبيق تعديلات على أحدث لقطة وحفظها ذرياً ثم استبدال المرجع - ValueError عند فشل التحقق"""
+        unknown = [key for key in changes if key not in SETTINGS_SCHEMA]
+        if unknown:
+            raise ValueError(f"إعدادات غير معروفة: {', '.join(unknown)}")
+        # البناء فوق آخر نسخة على القرص حتى لا تضيع تعديلات عملية أخرى
+        self.reload_if_changed()
+        settings = self.current.to_dict()
+        settings.update(changes)
+        errors = validate_settings(settings)
+        if errors:
+            raise ValueError("؛ ".join(errors))
+        snapshot = SettingsSnapshot(settings, self.current.version + 1)
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({**settings, '_version': snapshot.version}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self._stat = self._file_stat()
+        self.current = snapshot
+        return snapshot
+
+# ===== أدوات تشخيص الأداء =====
+
+PROFILES_FOLDER = "profiles"
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL = 0.005  # 200 عينة في الثانية
+PROFILE_TOP_ENTRIES = 15
+
+# المهام المجدولة
+SCHEDULER_TICK_SECONDS = 60
+SCHEDULER_BATCH_SIZE = 500
+SCHEDULER_TICK_BUDGET = 2.0  # أقصى زمن معالجة لكل نبضة بالثواني
+OUTBOX_RATE_PER_SECOND = 25  # أقل من حد تيليجرام (30 رسالة/ثانية)
+OUTBOX_MAX_SIZE = 100000
+VIP_MAX_DAYS = 3650  # حد مدة VIP التي يمنحها المشرف دفعة واحدة
+
+# الحماية من الإغراق: الفئة -> (سعة الدلو، معدل إعادة التعبئة بالثانية)
+RATE_LIMITS = {
+    "games": (5, 0.5),
+    "commands": (8, 1.0),
+    "callbacks": (12, 2.0),
+    "messages": (10, 0.5),
+    "inline": (15, 3.0),
+}
+GAME_COMMANDS = {"roulette", "slots", "dice", "coinflip", "blackjack", "lottery"}
+FLOOD_STRIKES_TO_BAN = 20      # عدد التجاوزات خلال النافذة قبل الحظر المؤقت
+FLOOD_STRIKE_WINDOW = 60
+FLOOD_BAN_MINUTES = 30
+FLOOD_MAX_TRACKED = 100000     # أقصى عدد دلاء/مخالفين في الذاكرة
+FLOOD_SHED_LATENCY = 3.0       # فوقها: تجاهل تسجيل الرسائل العادية
+FLOOD_CRITICAL_LATENCY = 10.0  # فوقها: تجاهل كل التحديثات عدا المشرفين
+
+# دفتر القيود
+LEDGER_KEY_TTL = 7 * 86400         # مدة الاحتفاظ بمفاتيح منع التكرار
+LEDGER_OPENING_BATCH = 1000        # عدد المستخدمين في كل قيد افتتاحي
+RECONCILE_INTERVAL_SECONDS = 3600
+
+# اليانصيب
+LOTTERY_CHECK_SECONDS = 60
+LOTTERY_PAYOUT_BATCH = 500         # عدد المشاركين المُبلَّغين قبل إفساح المجال لحلقة الأحداث
+
+# البلاك جاك
+BLACKJACK_DECKS = 6
+BLACKJACK_PENETRATION = 0.75       # إعادة الخلط بعد استهلاك 75% من الصندوق
+BLACKJACK_SESSION_TTL = 300        # الجولة المتروكة تُحسم تلقائياً بعد 5 دقائق خمول
+BLACKJACK_MAX_SESSIONS = 50000
+BLACKJACK_SWEEP_SECONDS = 60
+
+# طاولات الروليت في المجموعات
+ROULETTE_TABLE_WINDOW = 30         # ثواني استقبال الرهانات قبل الدوران
+ROULETTE_TABLE_REFRESH = 5         # أقل فترة بين تحديثين لرسالة الطاولة
+ROULETTE_TABLE_MAX_BETS = 10       # رهانات اللاعب الواحد في الدورة
+ROULETTE_TABLE_MAX_PLAYERS = 200
+ROULETTE_TABLE_SHOWN_BETS = 40     # أسطر الرهانات المعروضة في رسالة الطاولة
+
+# الوضع المضمّن: النوع -> (صلاحية النتيجة في الخادم، cache_time لتيليجرام، is_personal)
+INLINE_CACHE_POLICY = {
+    "balance": (15, 10, True),
+    "top": (60, 60, False),
+    "roulette": (3600, 3600, False),
+}
+INLINE_CACHE_MAX_ENTRIES = 50000
+LEADERBOARD_SIZE = 10
+
+# البحث في الرسائل
+SEARCH_FLUSH_BATCH = 200           # عدد الرسائل في كل دفعة كتابة للفهرس
+SEARCH_FLUSH_SECONDS = 5           # أقصى تأخير قبل ظهور الرسالة في البحث
+SEARCH_COUNT_CAP = 1000            # العد يتوقف هنا بدلاً من مسح كل النتائج
+SEARCH_PAGE_SIZE = 10
+SEARCH_RETENTION_DAYS = 180
+
+# دليل المستخدمين
+DIRECTORY_HISTORY_LIMIT = 20       # عدد الأسماء السابقة المحفوظة لكل مستخدم
+DIRECTORY_SAVE_SECONDS = 60
+FIND_RESULTS_LIMIT = 20
+
+# التحليلات
+ANALYTICS_FLUSH_SECONDS = 30
+ANALYTICS_MIN_ROUNDS = 10          # أقل عدد جولات لإدخال المستخدم في توزيع نسب الفوز
+
+# الإحالات
+REFERRAL_ANALYSIS_SECONDS = 6 * 3600
+
+# البطولات
+TOURNAMENT_GAMES = ("roulette", "slots", "dice", "coinflip", "blackjack", "all")
+TOURNAMENT_TICK_SECONDS = 10       # فترة تفريغ طابور النتائج وإغلاق البطولات المنتهية
+TOURNAMENT_DRAIN_BATCH = 50000     # أقصى عدد نتائج في كل تفريغ
+TOURNAMENT_RESORT_RATIO = 40       # تغيّر لأكثر من مشترك من كل 40: إعادة فرز بدلاً من الإدراج الموضعي
+TOURNAMENT_SAVE_SECONDS = 60
+TOURNAMENT_MAX_HOURS = 24 * 7
+TOURNAMENT_HISTORY = 20            # عدد البطولات المنتهية المحفوظة
+TOURNAMENT_STANDINGS_SHOWN = 10
+REFERRAL_FARM_MIN_REFEREES = 5     # أقل عدد مدعوين لتقييم الداعي
+REFERRAL_INACTIVE_RATIO = 0.8      # نسبة المدعوين بلا أي لعب التي تجعل الداعي مشبوهاً
+REFERRAL_BURST_WINDOW = 600        # انضمام عدد كبير من المدعوين خلال 10 دقائق
+
+# العمليات الجماعية والتصدير
+BULK_ACTIONS = ("ban", "unban", "credit", "debit", "vip")
+BULK_BATCH_SIZE = 5000             # مستخدمون في كل قيد دفتر وكل دفعة قبل إفساح المجال لحلقة الأحداث
+BULK_PROGRESS_SECONDS = 3          # أقل فترة بين تحديثين لرسالة التقدم
+EXPORT_BATCH_ROWS = 5000
+EXPORT_PART_BYTES = 45 * 1024 * 1024  # حد تيليجرام لرفع الملفات 50MB
+
+# وسوم المسارات الساخنة: كائن الكود -> اسم الوسم
+HOT_PATH_TAGS: Dict[Any, str] = {}
+
+def hot_path(tag: str):
+    """وسم دالة كمسار ساخن لتظهر بوضوح في تقارير المحلل (بدون أي تكلفة أثناء التشغيل)"""
+    def decorator(func):
+        HOT_PATH_TAGS[func.__code__] = tag
+        return func
+    return decorator
+
+class Metrics:
+    """سجل بسيط للعدادات والمقاييس اللحظية"""
+
+    def __init__(self):
+        self.counters: Counter = Counter()
+        self.gauges: Dict[str, float] = {}
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def render(self) -> str:
+        """تمثيل نصي للعرض على المشرفين"""
+        lines = [f"{name} = {value:,}" for name, value in sorted(self.counters.items())]
+        lines += [f"{name} = {value:,.3f}" for name, value in sorted(self.gauges.items())]
+        return "\n".join(lines)
+
+class SamplingProfiler:
+    """محلل أداء بالعينات يعمل على حلقة الأحداث الحية دون إعادة تشغيل البوت"""
+
     def __init__(self):
-        self.users_data = self.load_data()
-        self.messages_log = self.load_messages()
-        self.settings = self.load_settings()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started_at = 0.0
+        self._deadline = 0.0
+        self._interval = PROFILE_SAMPLE_INTERVAL
+        self._target_thread_id: Optional[int] = None
+        self._trace_memory = False
+        self.session_id = 0
+
+    @property
+    def is_running(self) -> bool:
+        """هل المحلل يجمع العينات حالياً"""
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def has_session(self) -> bool:
+        """هل توجد جلسة لم يُستخرج تقريرها بعد"""
+        return self._thread is not None
+
+    def start(self, duration: int, interval: float = PROFILE_SAMPLE_INTERVAL, trace_memory: bool = True) -> int:
+        """بدء جلسة تحليل محدودة المدة على الخيط الحالي (خيط حلقة الأحداث)"""
+        if self.is_running:
+            return 0
+
+        duration = max(1, min(duration, PROFILE_MAX_SECONDS))
+        self._stacks = Counter()
+        self._samples = 0
+        self._interval = interval
+        self._target_thread_id = threading.get_ident()
+        self._started_at = time.monotonic()
+        self._deadline = self._started_at + duration
+        self._stop_event.clear()
+
+        # لا نلمس tracemalloc إذا كان مفعلاً من جهة أخرى
+        self._trace_memory = trace_memory and not tracemalloc.is_tracing()
+        if self._trace_memory:
+            tracemalloc.start(25)
+
+        self.session_id += 1
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return duration
+
+    def _run(self):
+        """حلقة أخذ العينات - تتوقف عند انتهاء المدة أو عند طلب الإيقاف"""
+        while not self._stop_event.is_set() and time.monotonic() < self._deadline:
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                self._stacks[self._collapse(frame)] += 1
+                self._samples += 1
+            self._stop_event.wait(self._interval)
+
+    @staticmethod
+    def _frame_label(code) -> str:
+        """اسم الإطار في المكدس المطوي مع وسم المسار الساخن إن وجد"""
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        tag = HOT_PATH_TAGS.get(code)
+        return f"[{tag}] {label}" if tag else label
+
+    @classmethod
+    def _collapse(cls, frame) -> str:
+        """تحويل المكدس إلى صيغة collapsed المتوافقة مع flamegraph"""
+        parts = []
+        while frame is not None:
+            parts.append(cls._frame_label(frame.f_code))
+            frame = frame.f_back
+        parts.reverse()
+        return ";".join(parts)
+
+    def stop(self) -> Optional[Dict[str, Any]]:
+        """إيقاف الجلسة وكتابة التقارير على القرص"""
+        if self._thread is None:
+            return None
+
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        elapsed = min(time.monotonic(), self._deadline) - self._started_at
+
+        allocations = []
+        if self._trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            allocations = snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]
+
+        return self._write_report(elapsed, allocations)
+
+    def _write_report(self, elapsed: float, allocations) -> Dict[str, Any]:
+        """كتابة ملف المكدسات المطوية وتقرير الذاكرة وإرجاع ملخص"""
+        if not os.path.exists(PROFILES_FOLDER):
+            os.makedirs(PROFILES_FOLDER)
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        stacks_file = f"{PROFILES_FOLDER}/profile_{stamp}.folded"
+        with open(stacks_file, 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        # الوقت الذاتي (آخر إطار) والوقت الشامل للمسارات الساخنة
+        self_time: Counter = Counter()
+        hot_paths: Counter = Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            self_time[frames[-1]] += count
+            for tag in {frame[1:frame.index("]")] for frame in frames if frame.startswith("[")}:
+                hot_paths[tag] += count
+
+        allocations_file = None
+        if allocations:
+            allocations_file = f"{PROFILES_FOLDER}/allocations_{stamp}.txt"
+            with open(allocations_file, 'w', encoding='utf-8') as f:
+                for stat in allocations:
+                    f.write(f"{stat}\n")
+
+        return {
+            'elapsed': elapsed,
+            'samples': self._samples,
+            'stacks_file': stacks_file,
+            'allocations_file': allocations_file,
+            'top_self': self_time.most_common(PROFILE_TOP_ENTRIES),
+            'hot_paths': hot_paths.most_common(),
+            'top_allocations': [(str(stat.traceback[0]), stat.size) for stat in allocations[:5]],
+        }
+
+# ===== طبقة الترميز وإصدارات المخطط =====
+
+STATE_HEADER_MAGIC = b"GBSTATE"
+STATE_SCHEMA_VERSION = 2
+
+class JsonCodec:
+    """ترميز JSON القياسي (مضغوط بدون مسافات بادئة)"""
+    name = "json"
+    is_json = True
+
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+class OrjsonCodec:
+    """ترميز JSON سريع عبر orjson"""
+    name = "orjson"
+    is_json = True
+
+    def encode(self, data: Any) -> bytes:
+        return orjson.dumps(data)
+
+    def decode(self, payload: bytes) -> Any:
+        return orjson.loads(payload)
+
+class MsgpackCodec:
+    """ترميز ثنائي مضغوط عبر msgpack"""
+    name = "msgpack"
+    is_json = False
+
+    def encode(self, data: Any) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+STATE_CODECS = {"json": JsonCodec()}
+if orjson is not None:
+    STATE_CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    STATE_CODECS["msgpack"] = MsgpackCodec()
+
+def get_codec(name: str):
+    """الحصول على المرمز المطلوب مع الرجوع إلى json إذا لم تكن مكتبته مثبتة"""
+    codec = STATE_CODECS.get(name)
+    if codec is None:
+        logger.warning(f"المرمز {name} غير متوفر، سيتم استخدام json")
+        codec = STATE_CODECS["json"]
+    return codec
+
+def state_checksum(payload: bytes, crc: int = 0) -> str:
+    return f"{zlib.crc32(payload, crc) & 0xffffffff:08x}"
+
+def state_header(codec_name: str, schema: int = STATE_SCHEMA_VERSION, checksum: str = "00000000") -> bytes:
+    """سطر الترويسة الذي يسبق محتوى ملف الحالة - المجموع الاختباري CRC32 للمحتوى بطول ثابت"""
+    return STATE_HEADER_MAGIC + f" {codec_name} {schema} {checksum}\n".encode('ascii')
+
+def dump_state(data: Any, codec_name: str = STATE_CODEC, schema: int = STATE_SCHEMA_VERSION) -> bytes:
+    """ترميز الحالة مع ترويسة تحدد المرمز وإصدار المخطط والمجموع الاختباري"""
+    codec = get_codec(codec_name)
+    payload = codec.encode(data)
+    return state_header(codec.name, schema, state_checksum(payload)) + payload
+
+def load_state(raw: bytes) -> Tuple[Any, int]:
+    """فك ترميز ملف حالة - الملفات القديمة بدون ترويسة تُعامل كـ JSON بإصدار 0"""
+    if not raw.startswith(STATE_HEADER_MAGIC):
+        return json.loads(raw), 0
+
+    header, _, payload = raw.partition(b"\n")
+    fields = header.decode('ascii').split()
+    if len(fields) < 3 or fields[1] not in STATE_CODECS:
+        raise ValueError(f"ترويسة حالة غير مدعومة: {header[:64]!r}")
+    # الترويسات السابقة لإضافة المجموع الاختباري تحوي ثلاثة حقول فقط
+    if len(fields) > 3 and state_checksum(payload) != fields[3]:
+        raise ValueError(f"المجموع الاختباري غير مطابق ({len(raw):,} بايت) - الملف مقطوع أو تالف")
+    return STATE_CODECS[fields[1]].decode(payload), int(fields[2])
+
+def fsync_directory(path: str):
+    """تثبيت إدخال المجلد بعد os.replace حتى لا يضيع الاسم الجديد عند انقطاع الكهرباء"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # ويندوز لا يدعم فتح المجلدات
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_file_atomic(path: str, data: bytes):
+    """كتابة ملف مؤقت ثم fsync ثم استبدال ذري - القارئ يرى النسخة القديمة أو الجديدة كاملة فقط"""
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    fsync_directory(path)
+
+def list_backups(prefix: str) -> list:
+    """النسخ الاحتياطية لملف حالة من الأحدث إلى الأقدم (الطابع الزمني جزء من الاسم)"""
+    folder, base = os.path.split(prefix)
+    try:
+        names = [name for name in os.listdir(folder or ".") if name.startswith(base) and not name.endswith(".tmp")]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(folder, name) for name in sorted(names, reverse=True)]
+
+def backup_state_file(path: str, prefix: str, keep: int = BACKUP_KEEP) -> Optional[str]:
+    """نسخة احتياطية للملف الحالي قبل استبداله - رابط صلب بتكلفة O(1)
+
+    آمن فقط لأن كل كتابة لملفات الحالة تمر عبر ملف مؤقت وos.replace (inode جديد)؛
+    الكتابة فوق الملف مباشرة ستغير النسخة الاحتياطية معه.
+    """
+    if not os.path.exists(path):
+        return None
+    backup = f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}{os.path.splitext(path)[1]}"
+    try:
+        os.link(path, backup)
+    except FileExistsError:
+        return None
+    except OSError:
+        shutil.copyfile(path, backup)
+    for old in list_backups(prefix)[keep:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return backup
+
+class StateRecoveryError(RuntimeError):
+    """ملف الحالة تالف ولا توجد نسخة احتياطية سليمة"""
+
+def load_state_with_fallback(path: str, backup_prefix: str) -> Tuple[Any, int, str]:
+    """تحميل ملف الحالة أو أحدث نسخة احتياطية سليمة - يعيد (البيانات، الإصدار، المصدر)
+
+    FileNotFoundError إذا لم يوجد الملف ولا أي نسخة (تشغيل أول)، وStateRecoveryError إذا كان
+    كل ما وُجد تالفاً - لا تُعاد أبداً حالة فارغة بصمت بدلاً من ملف تالف.
+    """
+    failures = []
+    for candidate in [path] + list_backups(backup_prefix):
+        try:
+            with open(candidate, 'rb') as f:
+                data, version = load_state(f.read())
+        except FileNotFoundError:
+            continue
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"ملف حالة غير صالح {candidate}: {e}")
+            failures.append(candidate)
+            continue
+        if candidate != path:
+            logger.warning(f"تمت الاستعادة من النسخة الاحتياطية {candidate} بعد تلف {path}")
+        return data, version, candidate
+    if failures:
+        raise StateRecoveryError(f"لا توجد نسخة سليمة من {path} (تم فحص {len(failures)} ملف)")
+    raise FileNotFoundError(path)
+
+def new_user_record(settings) -> Dict[str, Any]:
+    """سجل مستخدم جديد بالقيم الافتراضية"""
+    now = datetime.now().isoformat()
+    return {
+        'balance': settings['starting_balance'],
+        'wins': 0,
+        'losses': 0,
+        'games_played': 0,
+        'last_daily': None,
+        'level': 1,
+        'exp': 0,
+        'achievements': [],
+        'is_banned': False,
+        'ban_reason': None,
+        'ban_date': None,
+        'join_date': now,
+        'total_wagered': 0,
+        'total_won': 0,
+        'total_lost': 0,
+        'favorite_game': None,
+        'vip_status': False,
+        'referral_count': 0,
+        'referred_by': None,
+        'daily_streak': 0,
+        'last_activity': now
+    }
+
+class LevelTable:
+    """جدول عتبات المستويات المحسوب مسبقاً - تحديد المستوى بالبحث الثنائي"""
+
+    def __init__(self, linear: int, quadratic: int, max_level: int):
+        self.curve = (linear, quadratic, max_level)
+        self.max_level = max_level
+        # العتبة [م-1] هي مجموع النقاط المطلوب لتجاوز المستوى م
+        self.thresholds = [level * linear + level * level * quadratic for level in range(1, max_level + 1)]
+
+    @classmethod
+    def from_settings(cls, settings) -> "LevelTable":
+        curve = settings.get('level_curve') or DEFAULT_SETTINGS['level_curve']
+        return cls(int(curve['linear']), int(curve['quadratic']), int(curve['max_level']))
+
+    def exp_for_next(self, level: int) -> int:
+        """النقاط المطلوبة للانتقال من المستوى الحالي إلى التالي"""
+        return self.thresholds[min(max(level, 1), self.max_level) - 1]
+
+    def level_for_exp(self, exp: int) -> int:
+        """المستوى المستحق لعدد النقاط - O(log N)"""
+        return min(bisect.bisect_right(self.thresholds, exp) + 1, self.max_level)
+
+def apply_level_ups(user_data: Dict[str, Any], table: LevelTable, level_bonus: int) -> Tuple[int, int, int]:
+    """رفع المستوى لكل المستويات المستحقة دفعة واحدة مع مكافأة مجمعة"""
+    old_level = user_data['level']
+    new_level = table.level_for_exp(user_data['exp'])
+    if new_level <= old_level:
+        return old_level, old_level, 0
+
+    bonus = (new_level - old_level) * level_bonus
+    user_data['level'] = new_level
+    user_data['balance'] += bonus
+    return old_level, new_level, bonus
+
+def _migrate_users_v0(users: Dict[str, Any], settings) -> None:
+    """الإصدار 0 → 1: إكمال الحقول التي أضيفت لاحقاً إلى سجل المستخدم"""
+    defaults = new_user_record(settings)
+    for user in users.values():
+        for key, value in defaults.items():
+            if key not in user:
+                user[key] = list(value) if isinstance(value, list) else value
+
+def _migrate_users_v1(users: Dict[str, Any], settings) -> None:
+    """الإصدار 1 → 2: إصلاح المستخدمين الذين تجاوزت نقاطهم مستواهم المسجل"""
+    table = LevelTable.from_settings(settings)
+    repaired = 0
+    for user in users.values():
+        if apply_level_ups(user, table, settings['level_up_bonus'])[2]:
+            repaired += 1
+    if repaired:
+        logger.info(f"تم إصلاح مستوى {repaired:,} مستخدم")
+
+# ترحيلات بيانات المستخدمين: الإصدار المصدر -> دالة الترحيل إلى الإصدار التالي
+USER_MIGRATIONS = {
+    0: _migrate_users_v0,
+    1: _migrate_users_v1,
+}
+
+def migrate_users(users: Dict[str, Any], version: int, settings) -> int:
+    """تطبيق الترحيلات بالتتابع حتى إصدار المخطط الحالي"""
+    while version < STATE_SCHEMA_VERSION:
+        USER_MIGRATIONS[version](users, settings)
+        version += 1
+        logger.info(f"تم ترحيل بيانات المستخدمين إلى الإصدار {version}")
+    return version
+
+# ===== اللقطات المفهرسة والتحميل الكسول =====
+
+SNAPSHOT_INDEX_MAGIC = b"GBIX"
+SNAPSHOT_INDEX_VERSION = 1
+SNAPSHOT_INDEX_HEADER = struct.Struct("<4sIIQQ")  # التوقيع، إصدار الفهرس، إصدار المخطط، عدد السجلات، حجم البيانات
+SNAPSHOT_INDEX_ENTRY = struct.Struct("<qQI")     # المعرف، الإزاحة، الطول
+
+def encode_record(value: Any) -> bytes:
+    """ترميز سجل واحد بصيغة JSON مضغوطة"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class LazySnapshotStore(MutableMapping):
+    """قاموس كسول فوق لقطة مفهرسة - السجل يُفك ترميزه عند أول وصول إليه فقط"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._loaded: Dict[str, Any] = {}
+        self._new: set = set()       # مفاتيح غير موجودة في اللقطة
+        self._deleted: set = set()   # مفاتيح محذوفة من اللقطة
+        self._data_file = None
+        self._index_file = None
+        self._data: Any = b""
+        self._index: Any = b""
+        self._count = 0
+        self._open()
+
+    def _open(self):
+        """فتح ملفي البيانات والفهرس عبر mmap والتحقق من سلامتهما"""
+        self._data_file = open(self.path, 'rb')
+        self._index_file = open(self.index_path, 'rb')
+        try:
+            data_size = os.fstat(self._data_file.fileno()).st_size
+            if data_size:
+                self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version, schema, count, expected_size = SNAPSHOT_INDEX_HEADER.unpack_from(self._index, 0)
+            expected_index_size = SNAPSHOT_INDEX_HEADER.size + count * SNAPSHOT_INDEX_ENTRY.size
+            if (magic != SNAPSHOT_INDEX_MAGIC or version != SNAPSHOT_INDEX_VERSION
+                    or schema != STATE_SCHEMA_VERSION or expected_size != data_size
+                    or len(self._index) != expected_index_size):
+                raise ValueError(f"لقطة غير صالحة: {self.path}")
+            self._count = count
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """إغلاق الملفات المفتوحة"""
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for handle in (self._data_file, self._index_file):
+            if handle:
+                handle.close()
+        self._data, self._index = b"", b""
+        self._data_file = self._index_file = None
+
+    def _entry(self, position: int) -> Tuple[int, int, int]:
+        return SNAPSHOT_INDEX_ENTRY.unpack_from(
+            self._index, SNAPSHOT_INDEX_HEADER.size + position * SNAPSHOT_INDEX_ENTRY.size
+        )
+
+    def _find(self, key: str) -> Optional[Tuple[int, int]]:
+        """بحث ثنائي في الفهرس المرتب - O(log N) دون تحميل أي سجل"""
+        try:
+            target = int(key)
+        except (TypeError, ValueError):
+            return None
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record_id, offset, length = self._entry(middle)
+            if record_id < target:
+                low = middle + 1
+            elif record_id > target:
+                high = middle
+            else:
+                return offset, length
+        return None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._loaded:
+            return self._loaded[key]
+        if key in self._deleted:
+            raise KeyError(key)
+
+        location = self._find(key)
+        if location is None:
+            raise KeyError(key)
+
+        offset, length = location
+        value = json.loads(self._data[offset:offset + length])
+        self._loaded[key] = value
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._loaded:
+            return True
+        return key not in self._deleted and self._find(key) is not None
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self._loaded:
+            if key in self._deleted:
+                self._deleted.discard(key)
+            elif self._find(key) is None:
+                self._new.add(key)
+        self._loaded[key] = value
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._loaded.pop(key, None)
+        if key in self._new:
+            self._new.discard(key)
+        else:
+            self._deleted.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self._count):
+            key = str(self._entry(position)[0])
+            if key not in self._deleted:
+                yield key
+        yield from list(self._new)
+
+    def __len__(self) -> int:
+        return self._count - len(self._deleted) + len(self._new)
+
+    def raw_items(self) -> Iterator[Tuple[str, bytes]]:
+        """السجلات بصيغتها المرمزة - غير المحمل منها يُنسخ كما هو دون فك ترميز"""
+        for position in range(self._count):
+            record_id, offset, length = self._entry(position)
+            key = str(record_id)
+            if key in self._deleted:
+                continue
+            if key in self._loaded:
+                yield key, encode_record(self._loaded[key])
+            else:
+                yield key, self._data[offset:offset + length]
+        for key in list(self._new):
+            yield key, encode_record(self._loaded[key])
+
+    @staticmethod
+    def write_snapshot(path: str, raw_items, json_path: Optional[str] = None, codec_name: str = "json"):
+        """كتابة لقطة مفهرسة (واختيارياً ملف الحالة بصيغة JSON المكافئ) في تمرير واحد"""
+        entries = []
+        offset = 0
+        crc = 0
+        json_file = open(json_path + ".tmp", 'wb') if json_path else None
+
+        def write_json(chunk: bytes):
+            nonlocal crc
+            json_file.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+
+        try:
+            with open(path + ".tmp", 'wb') as data_file:
+                if json_file:
+                    # المجموع الاختباري يُحسب أثناء الكتابة ثم يُكتب فوق الترويسة (طولها ثابت)
+                    json_file.write(state_header(codec_name))
+                    write_json(b"{")
+                for key, raw in raw_items:
+                    data_file.write(raw)
+                    entries.append((int(key), offset, len(raw)))
+                    if json_file:
+                        write_json(b"\n  " if len(entries) == 1 else b",\n  ")
+                        write_json(json.dumps(key).encode('utf-8') + b": " + raw)
+                    offset += len(raw)
+                if json_file:
+                    write_json(b"\n}")
+                    json_file.seek(0)
+                    json_file.write(state_header(codec_name, checksum=f"{crc & 0xffffffff:08x}"))
+                    json_file.flush()
+                    os.fsync(json_file.fileno())
+                data_file.flush()
+                os.fsync(data_file.fileno())
+        finally:
+            if json_file:
+                json_file.close()
+
+        entries.sort()
+        with open(path + ".idx.tmp", 'wb') as index_file:
+            index_file.write(SNAPSHOT_INDEX_HEADER.pack(
+                SNAPSHOT_INDEX_MAGIC, SNAPSHOT_INDEX_VERSION, STATE_SCHEMA_VERSION, len(entries), offset
+            ))
+            for entry in entries:
+                index_file.write(SNAPSHOT_INDEX_ENTRY.pack(*entry))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        # ملف JSON أولاً حتى تبقى اللقطة دائماً أحدث منه
+        if json_path:
+            os.replace(json_path + ".tmp", json_path)
+        os.replace(path + ".tmp", path)
+        os.replace(path + ".idx.tmp", path + ".idx")
+        fsync_directory(path)
+
+    def persist(self, state_path: str, codec_name: str = STATE_CODEC):
+        """حفظ التغييرات في اللقطة وملف الحالة ثم إعادة فتح اللقطة الجديدة"""
+        codec = get_codec(codec_name)
+        if codec.is_json:
+            # السجلات المخزنة JSON مضغوط فيمكن لصقها مباشرة في ملف الحالة
+            self.write_snapshot(self.path, self.raw_items(), state_path, codec.name)
+        else:
+            # ملف الحالة أولاً حتى تبقى اللقطة أحدث منه
+            decoded = {key: json.loads(raw) for key, raw in self.raw_items()}
+            write_file_atomic(state_path, dump_state(decoded, codec.name))
+            del decoded
+            self.write_snapshot(self.path, self.raw_items())
+        self.close()
+        self._new.clear()
+        self._deleted.clear()
+        self._open()
+
+    @classmethod
+    def open_or_build(cls, path: str, source_file: str, loader) -> "LazySnapshotStore":
+        """فتح اللقطة إن كانت صالحة وأحدث من ملف المصدر، وإلا بناؤها منه مرة واحدة"""
+        try:
+            if not os.path.exists(source_file) or os.path.getmtime(path) >= os.path.getmtime(source_file):
+                return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.info(f"إعادة بناء اللقطة {path}: {e}")
+
+        data = loader()
+        cls.write_snapshot(path, ((key, encode_record(value)) for key, value in data.items()))
+        return cls(path)
+
+# ===== تخزين المستخدمين على طبقتين =====
+
+class TieredUserStore(MutableMapping):
+    """طبقة ساخنة في الذاكرة بترتيب LRU وطبقة باردة مضغوطة في SQLite للمستخدمين الخاملين
+
+    المستخدم البارد يُستعاد إلى الذاكرة عند أول وصول إليه. صفه البارد لا يُحذف إلا بعد حفظ
+    الطبقة الساخنة، فلا يضيع إذا انقطع التشغيل بين الاستعادة والحفظ.
+    """
+
+    def __init__(self, path: str, hot: Dict[str, Any]):
+        self.path = path
+        self.hot: OrderedDict = OrderedDict(hot)
+        self._rehydrated: set = set()   # في الذاكرة ولصفها البارد نسخة قديمة تُحذف بعد الحفظ
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # أعمدة التجميع منفصلة عن السجل المضغوط حتى تُحسب الإحصائيات دون فك الضغط
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, last_activity TEXT, balance INTEGER,"
+            " games_played INTEGER, level INTEGER, banned INTEGER, data BLOB)"
+        )
+        self._cold_rows = self._db.execute("SELECT count(*) FROM users").fetchone()[0]
+        if self._cold_rows:
+            # الملف الساخن يُكتب بعد الطبقة الباردة فنسخته هي الأحدث عند التداخل
+            for user_id in self.hot:
+                if self._db.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+                    self._rehydrated.add(user_id)
+
+    @property
+    def cold_count(self) -> int:
+        return self._cold_rows - len(self._rehydrated)
+
+    def __len__(self) -> int:
+        return len(self.hot) + self.cold_count
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """السجل دون نقله إلى الذاكرة - تعديل السجل البارد يتطلب إعادة إسناده"""
+        value = self.hot.get(key)
+        return value if value is not None else self._load_cold(key)
+
+    def _load_cold(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._db.execute("SELECT data FROM users WHERE id = ?", (key,)).fetchone()
+        return None if row is None else json.loads(zlib.decompress(row[0]))
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.hot.get(key)
+        if value is not None:
+            self.hot.move_to_end(key)
+            return value
+        value = self._load_cold(key)
+        if value is None:
+            raise KeyError(key)
+        self.hot[key] = value
+        self._rehydrated.add(key)
+        metrics.inc("users.rehydrated")
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.hot:
+            return True
+        return self._db.execute("SELECT 1 FROM users WHERE id = ?", (key,)).fetchone() is not None
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.hot and key not in self._rehydrated and key in self:
+            self._rehydrated.add(key)
+        self.hot[key] = value
+        self.hot.move_to_end(key)
+
+    def __delitem__(self, key: str):
+        found = self.hot.pop(key, None) is not None
+        deleted = self._db.execute("DELETE FROM users WHERE id = ?", (key,)).rowcount
+        self._db.commit()
+        self._cold_rows -= deleted
+        self._rehydrated.discard(key)
+        if not found and not deleted:
+            raise KeyError(key)
+
+    def _iter_cold(self, column: str = "data", batch: int = 1000):
+        """صفوف الطبقة الباردة على صفحات حسب rowid - آمن مع الكتابة بين الصفحات"""
+        last = 0
+        while True:
+            rows = self._db.execute(
+                f"SELECT rowid, id, {column} FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch)
+            ).fetchall()
+            if not rows:
+                return
+            for rowid, user_id, data in rows:
+                if user_id not in self.hot:
+                    yield user_id, data
+            last = rows[-1][0]
+
+    def __iter__(self):
+        yield from list(self.hot)
+        for user_id, _ in self._iter_cold():
+            yield user_id
+
+    def items(self):
+        """كل المستخدمين دون استعادة الباردين إلى الذاكرة - تعديل سجل بارد يتطلب إعادة إسناده"""
+        yield from list(self.hot.items())
+        for user_id, data in self._iter_cold():
+            yield user_id, json.loads(zlib.decompress(data))
+
+    def values(self):
+        for _, user_data in self.items():
+            yield user_data
+
+    def balances(self):
+        """(المعرف، الرصيد) لكل المستخدمين - الباردون من عمود الرصيد دون فك السجل المضغوط"""
+        yield from [(user_id, user_data.get('balance', 0)) for user_id, user_data in self.hot.items()]
+        yield from self._iter_cold("balance")
+
+    def evict(self, idle_before: str, max_hot: int, protect_after: float, limit: int) -> int:
+        """نقل الخاملين قبل idle_before، ثم الأقدم استخداماً حتى لا تتجاوز الذاكرة max_hot
+
+        من وصلت إليه معالجة خلال آخر protect_after ثانية لا يُنقل حتى لا يُفقد تعديل جارٍ.
+        limit يحد عدد المنقولين في الاستدعاء الواحد حتى لا تُحجب حلقة الأحداث.
+        """
+        guard = (datetime.now() - timedelta(seconds=protect_after)).isoformat()
+        victims = [user_id for user_id, user_data in self.hot.items()
+                   if user_data.get('last_activity', '') < idle_before]
+        overflow = len(self.hot) - len(victims) - max_hot
+        if overflow > 0:
+            chosen = set(victims)
+            for user_id, user_data in self.hot.items():
+                if overflow <= 0:
+                    break
+                if user_id not in chosen and user_data.get('last_activity', '') < guard:
+                    victims.append(user_id)
+                    overflow -= 1
+        victims = victims[:limit]
+        if not victims:
+            return 0
+
+        rows = []
+        for user_id in victims:
+            user_data = self.hot[user_id]
+            rows.append((user_id, user_data.get('last_activity'), user_data.get('balance', 0),
+                         user_data.get('games_played', 0), user_data.get('level', 1),
+                         int(bool(user_data.get('is_banned'))), zlib.compress(encode_record(user_data), 6)))
+        new_rows = sum(1 for user_id in victims if user_id not in self._rehydrated)
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._cold_rows += new_rows
+        for user_id in victims:
+            del self.hot[user_id]
+            self._rehydrated.discard(user_id)
+        return len(victims)
+
+    def persist(self, state_path: str):
+        """حفظ الطبقة الساخنة ذرياً ثم حذف النسخ الباردة القديمة للمستخدمين المستعادين"""
+        write_file_atomic(state_path, dump_state(dict(self.hot)))
+        if self._rehydrated:
+            stale = [(user_id,) for user_id in self._rehydrated]
+            with self._db:
+                self._db.executemany("DELETE FROM users WHERE id = ?", stale)
+            self._cold_rows -= len(stale)
+            self._rehydrated.clear()
+
+    def aggregates(self) -> Dict[str, int]:
+        """إجماليات كل المستخدمين: الساخنون من الذاكرة والباردون من أعمدة SQLite"""
+        totals = {'users': len(self.hot), 'banned': 0, 'balance': 0, 'games': 0}
+        for user_data in self.hot.values():
+            totals['banned'] += bool(user_data.get('is_banned'))
+            totals['balance'] += user_data.get('balance', 0)
+            totals['games'] += user_data.get('games_played', 0)
+        count, banned, balance, games = self._db.execute(
+            "SELECT count(*), total(banned), total(balance), total(games_played) FROM users"
+        ).fetchone()
+        # الصفوف القديمة للمستخدمين المستعادين محسوبة في الذاكرة بالفعل
+        for user_id in self._rehydrated:
+            row = self._db.execute("SELECT banned, balance, games_played FROM users WHERE id = ?", (user_id,)).fetchone()
+            if row:
+                count, banned, balance, games = count - 1, banned - row[0], balance - row[1], games - row[2]
+        totals['users'] += count
+        totals['banned'] += int(banned)
+        totals['balance'] += int(balance)
+        totals['games'] += int(games)
+        return totals
+
+    def top_balances(self, limit: int) -> list:
+        """أعلى الأرصدة (المعرف، الرصيد، المستوى) - الطبقة الباردة عبر ORDER BY دون فك الضغط"""
+        hot = [(user_id, data.get('balance', 0), data.get('level', 1))
+               for user_id, data in self.hot.items() if not data.get('is_banned')]
+        cold = [row for row in self._db.execute(
+            "SELECT id, balance, level FROM users WHERE banned = 0 ORDER BY balance DESC LIMIT ?",
+            (limit + len(self._rehydrated),)
+        ) if row[0] not in self.hot]
+        return heapq.nlargest(limit, hot + cold, key=lambda row: row[1])
+
+    def close(self):
+        self._db.close()
+
+# ===== محرك الإنجازات =====
+
+# القواعد: إنجاز يُمنح عندما تبلغ قيمة الحقل العتبة (الحقول المتداخلة بالنقطة)
+DEFAULT_ACHIEVEMENT_RULES = [
+    {"id": "games_100", "name": "🎮 لاعب محترف - 100 لعبة", "field": "games_played", "threshold": 100},
+    {"id": "wins_50", "name": "🏆 المنتصر - 50 انتصار", "field": "wins", "threshold": 50},
+    {"id": "rich_10k", "name": "💰 الثري - 10,000 كوين", "field": "balance", "threshold": 10000},
+    {"id": "level_10", "name": "⭐ الخبير - المستوى 10", "field": "level", "threshold": 10},
+    {"id": "streak_7", "name": "🔥 المواظب - 7 أيام متتالية", "field": "daily_streak", "threshold": 7},
+    {"id": "referrals_10", "name": "👥 السفير - 10 إحالات", "field": "referral_count", "threshold": 10},
+    {"id": "roulette_50", "name": "🎲 سيد الروليت - 50 جولة", "field": "games_by_type.roulette", "threshold": 50},
+    {"id": "slots_50", "name": "🎰 ملك البكرات - 50 جولة", "field": "games_by_type.slots", "threshold": 50},
+]
+
+# الحقول التي تتغير في كل جولة لعب
+GAME_ROUND_FIELDS = ('games_played', 'wins', 'balance', 'level')
+
+def count_game_round(user_data: Dict[str, Any], game: str) -> str:
+    """زيادة عداد اللعبة وإرجاع اسم الحقل لتمريره إلى محرك الإنجازات"""
+    per_game = user_data.setdefault('games_by_type', {})
+    per_game[game] = per_game.get(game, 0) + 1
+    return f"games_by_type.{game}"
+
+class AchievementEngine:
+    """محرك إنجازات تعريفي - القواعد مفهرسة حسب الحقل الذي تعتمد عليه"""
+
+    def __init__(self, rules):
+        self.rules = {rule['id']: rule for rule in rules}
+        self.names = {rule['id']: rule.get('name', rule['id']) for rule in rules}
+
+        # لكل حقل: عتبات مرتبة وقواعد بنفس الترتيب
+        by_field: Dict[str, list] = {}
+        for rule in rules:
+            by_field.setdefault(rule['field'], []).append(rule)
+        self._by_field = {}
+        for field, field_rules in by_field.items():
+            field_rules.sort(key=lambda rule: rule['threshold'])
+            self._by_field[field] = ([rule['threshold'] for rule in field_rules], field_rules)
+
+    @classmethod
+    def load(cls, path: str) -> "AchievementEngine":
+        """تحميل القواعد من ملف JSON إن وُجد وإلا القواعد الافتراضية"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls(DEFAULT_ACHIEVEMENT_RULES)
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.error(f"ملف الإنجازات غير صالح، سيتم استخدام القواعد الافتراضية: {e}")
+            return cls(DEFAULT_ACHIEVEMENT_RULES)
+
+    @staticmethod
+    def _field_value(user_data: Dict[str, Any], field: str):
+        value: Any = user_data
+        for part in field.split('.'):
+            if not isinstance(value, dict):
+                return 0
+            value = value.get(part, 0)
+        return value or 0
+
+    def evaluate(self, user_data: Dict[str, Any], changed_fields=None) -> list:
+        """تقييم القواعد المتأثرة بالحقول المتغيرة فقط (None = كل القواعد)"""
+        if changed_fields is None:
+            fields = self._by_field.keys()
+        else:
+            fields = [field for field in changed_fields if field in self._by_field]
+
+        earned = user_data.setdefault('achievements', [])
+        new_achievements = []
+        for field in fields:
+            thresholds, rules = self._by_field[field]
+            reached = bisect.bisect_right(thresholds, self._field_value(user_data, field))
+            for rule in rules[:reached]:
+                if rule['id'] not in earned:
+                    earned.append(rule['id'])
+                    new_achievements.append(rule['id'])
+        return new_achievements
+
+    def describe(self, achievement_ids) -> str:
+        return "\n".join(self.names.get(a, a) for a in achievement_ids)
+
+# ===== الحماية من الإغراق =====
+
+class TokenBucket:
+    """دلو رموز لمستخدم واحد وفئة واحدة"""
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+class FloodController:
+    """تحديد المعدل لكل مستخدم وفئة، مع تحكم عام في القبول عند ارتفاع زمن الانتظار"""
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]] = RATE_LIMITS):
+        self.limits = limits
+        self._buckets: OrderedDict = OrderedDict()
+        self._strikes: Dict[int, list] = {}
+        self.queue_latency = 0.0
+        # التحديثات المتراكمة أثناء توقف البوت أقدم من هذا الوقت ولا تدل على ازدحام حالي
+        self.started_at = time.time()
+
+    def observe_latency(self, sent_at: float, now: float):
+        """متوسط متحرك أسي لزمن انتظار التحديثات قبل معالجتها - يتجاهل ما أُرسل قبل الإقلاع"""
+        if sent_at < self.started_at:
+            return
+        self.queue_latency = 0.9 * self.queue_latency + 0.1 * max(now - sent_at, 0.0)
+
+    @property
+    def load_level(self) -> int:
+        """0 طبيعي، 1 تجاهل الرسائل العادية، 2 تجاهل كل شيء عدا المشرفين"""
+        if self.queue_latency >= FLOOD_CRITICAL_LATENCY:
+            return 2
+        if self.queue_latency >= FLOOD_SHED_LATENCY:
+            return 1
+        return 0
+
+    def allow(self, user_id: int, category: str, now: float) -> bool:
+        """استهلاك رمز من دلو المستخدم إن توفر"""
+        capacity, rate = self.limits[category]
+        key = (user_id, category)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(capacity, now)
+            if len(self._buckets) > FLOOD_MAX_TRACKED:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+
+    def strike(self, user_id: int, now: float) -> int:
+        """تسجيل تجاوز وإرجاع عدد التجاوزات في النافذة الحالية"""
+        entry = self._strikes.get(user_id)
+        if entry is None or now - entry[1] > FLOOD_STRIKE_WINDOW:
+            if len(self._strikes) > FLOOD_MAX_TRACKED:
+                self._strikes = {uid: e for uid, e in self._strikes.items() if now - e[1] <= FLOOD_STRIKE_WINDOW}
+            entry = self._strikes[user_id] = [0, now]
+        entry[0] += 1
+        return entry[0]
+
+    def forgive(self, user_id: int):
+        self._strikes.pop(user_id, None)
+
+def classify_update(update: Update) -> Optional[str]:
+    """تحديد فئة التحديث لتطبيق حد المعدل المناسب"""
+    if update.callback_query:
+        return "callbacks"
+    if update.inline_query:
+        return "inline"
+    message = update.message
+    if message is None or not message.text:
+        return None
+    if message.text.startswith('/'):
+        command = message.text[1:].split(maxsplit=1)[0].split('@')[0].lower() if len(message.text) > 1 else ""
+        return "games" if command in GAME_COMMANDS else "commands"
+    return "messages"
+
+# ===== دفتر القيود المزدوج =====
+
+HOUSE_ACCOUNT = "house"        # أرباح وخسائر الكازينو
+FEES_ACCOUNT = "fees"          # رسوم التحويل
+REWARDS_ACCOUNT = "rewards"    # المكافآت والأرصدة الابتدائية
+ADMIN_ACCOUNT = "admin"        # تعديلات المشرفين
+OPENING_ACCOUNT = "opening"    # الأرصدة السابقة لإنشاء الدفتر
+LOTTERY_ACCOUNT = "lottery"    # جائزة اليانصيب المتراكمة
+ESCROW_ACCOUNT = "escrow"      # رهانات الجولات المفتوحة
+INVESTMENT_ACCOUNT = "investments"  # أصول الاستثمارات النشطة
+TOURNAMENT_ACCOUNT = "tournaments"  # رسوم دخول البطولات المفتوحة
+
+def user_account(user_id) -> str:
+    return f"user:{user_id}"
+
+class Ledger:
+    """دفتر قيود مزدوج - كل عملية قيد مجموعه صفر، مع مفاتيح منع التكرار وأرصدة مشتقة"""
+
+    def __init__(self, path: str, checkpoint_path: str):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.balances: Dict[str, int] = {}
+        self._keys: Dict[str, float] = {}
+        self._next_id = 1
+        self._file = None
+
+    def load(self, users):
+        """تحميل نقطة التحقق وإعادة تشغيل القيود اللاحقة، أو إنشاء الأرصدة الافتتاحية"""
+        if not os.path.exists(self.path):
+            self._file = open(self.path, 'ab')
+            self._post_opening_balances(users)
+            self.checkpoint()
+            return
+
+        offset = self._load_checkpoint()
+        position = offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._apply(json.loads(line))
+                position += len(line)
+
+        # إزالة سطر ناقص خلفه انهيار أثناء الكتابة
+        if position < os.path.getsize(self.path):
+            logger.warning(f"تم اقتطاع قيد ناقص من نهاية {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(position)
+        self._file = open(self.path, 'ab')
+
+    def _load_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            self.balances = {account: int(amount) for account, amount in checkpoint['balances'].items()}
+            self._keys = checkpoint.get('keys', {})
+            self._next_id = checkpoint['next_id']
+            return checkpoint['offset']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
+            logger.info(f"إعادة بناء أرصدة الدفتر من البداية: {e}")
+            self.balances, self._keys, self._next_id = {}, {}, 1
+            return 0
+
+    def checkpoint(self):
+        """حفظ الأرصدة المشتقة حتى لا يُعاد تشغيل الدفتر كاملاً عند الإقلاع"""
+        if self._file is None:
+            return
+        self._file.flush()
+        cutoff = time.time() - LEDGER_KEY_TTL
+        self._keys = {key: ts for key, ts in self._keys.items() if ts >= cutoff}
+        checkpoint = {
+            'next_id': self._next_id,
+            'offset': self._file.tell(),
+            'balances': self.balances,
+            'keys': self._keys,
+        }
+        try:
+            with open(self.checkpoint_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, separators=(',', ':'))
+            os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+        except Exception as e:
+            logger.error(f"خطأ في حفظ نقطة تحقق الدفتر: {e}")
+
+    def _apply(self, entry: Dict[str, Any]):
+        for account, amount in entry['postings']:
+            self.balances[account] = self.balances.get(account, 0) + amount
+        if 'key' in entry:
+            self._keys[entry['key']] = entry['ts']
+        self._next_id = entry['id'] + 1
+
+    def _entry(self, kind: str, postings, key: Optional[str]) -> Dict[str, Any]:
+        if sum(amount for _, amount in postings) != 0:
+            raise ValueError(f"قيد غير متوازن: {postings}")
+        entry = {
+            'id': self._next_id,
+            'ts': round(time.time(), 3),
+            'kind': kind,
+            'postings': [[account, amount] for account, amount in postings if amount],
+        }
+        if key is not None:
+            entry['key'] = key
+        return entry
+
+    def has_key(self, key: str) -> bool:
+        return key in self._keys
+
+    def post(self, kind: str, postings, key: Optional[str] = None) -> Optional[int]:
+        """تسجيل قيد متوازن - يعيد None إذا سبق تسجيل نفس المفتاح"""
+        if key is not None and key in self._keys:
+            return None
+        entry = self._entry(kind, postings, key)
+        self._file.write(encode_record(entry) + b"\n")
+        self._file.flush()
+        self._apply(entry)
+        return entry['id']
+
+    def _post_opening_balances(self, users):
+        """قيود افتتاحية بأرصدة المستخدمين الحالية على دفعات"""
+        batch = []
+        for user_id, user_data in users.items():
+            if user_data.get('balance'):
+                batch.append((user_account(user_id), user_data['balance']))
+            if len(batch) >= LEDGER_OPENING_BATCH:
+                self.post("opening", batch + [(OPENING_ACCOUNT, -sum(a for _, a in batch))])
+                batch = []
+        if batch:
+            self.post("opening", batch + [(OPENING_ACCOUNT, -sum(a for _, a in batch))])
+
+    def balance(self, account: str) -> int:
+        return self.balances.get(account, 0)
+
+# ===== البحث في الرسائل =====
+
+# التشكيل والتطويل، وتوحيد أشكال الألف والياء والتاء المربوطة
+ARABIC_DIACRITICS = dict.fromkeys(list(range(0x064B, 0x0653)) + [0x0670, 0x0640])
+ARABIC_FOLDING = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه"})
+
+def normalize_arabic(text: str) -> str:
+    """تطبيع النص للفهرسة والبحث بنفس الطريقة"""
+    return text.translate(ARABIC_DIACRITICS).translate(ARABIC_FOLDING).casefold()
+
+class MessageSearchIndex:
+    """فهرس بحث نصي كامل في SQLite (FTS5 عند توفره) يُغذّى تدريجياً من تسجيل الرسائل"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, ts INTEGER NOT NULL, text TEXT NOT NULL, body TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_ts ON messages(ts)")
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                "body, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("FTS5 غير متوفر في SQLite - سيُستخدم البحث بـ LIKE")
+            self.fts = False
+        self._db.commit()
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._db.execute("SELECT count(*) FROM messages").fetchone()[0]
+
+    def add(self, user_id: int, ts: int, text: str):
+        """إضافة رسالة للدفعة الحالية - الكتابة الفعلية دفعة واحدة لكل عدة رسائل"""
+        self._pending.append((int(user_id), ts, text, normalize_arabic(text)))
+        if len(self._pending) >= SEARCH_FLUSH_BATCH or time.monotonic() - self._last_flush >= SEARCH_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            with self._db:
+                cursor = self._db.execute("SELECT coalesce(max(id), 0) FROM messages")
+                first_id = cursor.fetchone()[0] + 1
+                self._db.executemany(
+                    "INSERT INTO messages (id, user_id, ts, text, body) VALUES (?, ?, ?, ?, ?)",
+                    [(first_id + i, *row) for i, row in enumerate(rows)]
+                )
+                if self.fts:
+                    self._db.executemany(
+                        "INSERT INTO messages_fts (rowid, body) VALUES (?, ?)",
+                        [(first_id + i, row[3]) for i, row in enumerate(rows)]
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"خطأ في فهرسة الرسائل: {e}")
+
+    def backfill(self, messages_log) -> int:
+        """بناء الفهرس من سجل الرسائل الحالي عند أول تشغيل (مرتباً زمنياً ليبقى ترتيب المعرفات زمنياً)"""
+        rows = [
+            (int(user_id), int(datetime.fromisoformat(message['timestamp']).timestamp()),
+             message['text'], normalize_arabic(message['text']))
+            for user_id, message_data in messages_log.items()
+            for message in message_data.get('messages', [])
+        ]
+        rows.sort(key=lambda row: row[1])
+        for start in range(0, len(rows), SEARCH_FLUSH_BATCH * 50):
+            self._pending = rows[start:start + SEARCH_FLUSH_BATCH * 50]
+            self.flush()
+        return len(rows)
+
+    @staticmethod
+    def _match_expression(term: str) -> str:
+        """كل كلمة عبارة مقتبسة (لا يُفسَّر أي رمز من المدخلات كصيغة FTS) و * في النهاية للبادئة"""
+        tokens = []
+        for word in normalize_arabic(term).split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', '""')
+            if word:
+                tokens.append(f'"{word}"' + ("*" if prefix else ""))
+        return " ".join(tokens)
+
+    def search(self, term: str, since: Optional[int] = None, until: Optional[int] = None,
+               user_id: Optional[int] = None, limit: int = 10, offset: int = 0) -> Tuple[int, list]:
+        """إرجاع (عدد النتائج حتى SEARCH_COUNT_CAP، صفحة النتائج) مرتبة من الأحدث"""
+        self.flush()
+        filters, params = [], []
+        if self.fts:
+            expression = self._match_expression(term)
+            if not expression:
+                return 0, []
+            source = "messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+            filters.append("messages_fts MATCH ?")
+            params.append(expression)
+        else:
+            source = "messages m"
+            for word in normalize_arabic(term).replace("*", "").split():
+                filters.append("m.body LIKE ?")
+                params.append(f"%{word}%")
+        if since is not None:
+            filters.append("m.ts >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("m.ts < ?")
+            params.append(until)
+        if user_id is not None:
+            filters.append("m.user_id = ?")
+            params.append(user_id)
+
+        where = " AND ".join(filters) or "1"
+        # العد حتى سقف محدد فقط؛ المعرفات تتزايد مع الزمن فالترتيب بها يسمح لـ FTS5 بالتوقف مبكراً
+        total = self._db.execute(
+            f"SELECT count(*) FROM (SELECT 1 FROM {source} WHERE {where} LIMIT ?)", params + [SEARCH_COUNT_CAP]
+        ).fetchone()[0]
+        rows = self._db.execute(
+            f"SELECT m.user_id, m.ts, m.text FROM {source} WHERE {where} ORDER BY m.id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return total, rows
+
+    def prune(self, before: int) -> int:
+        """حذف الرسائل الأقدم من مدة الاحتفاظ من الجدول والفهرس"""
+        self.flush()
+        with self._db:
+            if self.fts:
+                self._db.execute(
+                    "INSERT INTO messages_fts (messages_fts, rowid, body) SELECT 'delete', id, body FROM messages WHERE ts < ?",
+                    (before,)
+                )
+            deleted = self._db.execute("DELETE FROM messages WHERE ts < ?", (before,)).rowcount
+            if self.fts and deleted:
+                self._db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+        return deleted
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+# ===== دليل المستخدمين =====
+
+class UserDirectory:
+    """دليل الأسماء: فهرس تجزئة لاسم المستخدم وفهرس مرتب للبحث بالبادئة مع سجل تغيير الأسماء"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, list] = {}        # المعرف -> [username, first_name, last_name, history]
+        self.by_username: Dict[str, str] = {}     # اسم المستخدم بأحرف صغيرة -> المعرف
+        self._prefix_index: list = []             # (مفتاح مطبّع، المعرف) مرتبة
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def load(self, messages_log):
+        """تحميل الدليل، أو بناؤه من سجل الرسائل عند أول تشغيل"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            for user_id, message_data in messages_log.items():
+                username = message_data.get('username')
+                self.update(user_id, None if username == 'غير محدد' else username,
+                            message_data.get('first_name'), message_data.get('last_name'), record_history=False)
+            self.save()
+            logger.info(f"تم بناء دليل المستخدمين: {len(self.records):,} مستخدم")
+            return
+
+        for user_id, record in records.items():
+            self.records[user_id] = record
+            self._index(user_id, record)
+        self._prefix_index.sort()
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(self.records, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"خطأ في حفظ دليل المستخدمين: {e}")
+
+    @staticmethod
+    def _keys(record: list) -> set:
+        """مفاتيح البادئة: اسم المستخدم وكل كلمة من الاسم والاسم الكامل"""
+        username, first_name, last_name = record[0], record[1] or "", record[2] or ""
+        full_name = normalize_arabic(f"{first_name} {last_name}".strip())
+        keys = set(full_name.split())
+        if full_name:
+            keys.add(full_name)
+        if username:
+            keys.add(username.lower())
+        return keys
+
+    def _index(self, user_id: str, record: list):
+        if record[0]:
+            self.by_username[record[0].lower()] = user_id
+        for key in self._keys(record):
+            self._prefix_index.append((key, user_id))
+
+    def _unindex(self, user_id: str, record: list):
+        if record[0] and self.by_username.get(record[0].lower()) == user_id:
+            del self.by_username[record[0].lower()]
+        for key in self._keys(record):
+            position = bisect.bisect_left(self._prefix_index, (key, user_id))
+            if position < len(self._prefix_index) and self._prefix_index[position] == (key, user_id):
+                del self._prefix_index[position]
+
+    def update(self, user_id, username: Optional[str], first_name: Optional[str], last_name: Optional[str],
+               record_history: bool = True) -> bool:
+        """تحديث الدليل فقط إذا تغير الاسم فعلاً - يعيد True عند التغيير"""
+        user_id = str(user_id)
+        record = self.records.get(user_id)
+        names = [username or None, first_name or None, last_name or None]
+        if record is not None and record[:3] == names:
+            return False
+
+        if record is not None:
+            self._unindex(user_id, record)
+            if record_history:
+                record[3].append([datetime.now().isoformat(timespec='seconds')] + record[:3])
+                del record[3][:-DIRECTORY_HISTORY_LIMIT]
+            record[:3] = names
+        else:
+            record = self.records[user_id] = names + [[]]
+        if record[0]:
+            self.by_username[record[0].lower()] = user_id
+        for key in self._keys(record):
+            bisect.insort(self._prefix_index, (key, user_id))
+        self._dirty = True
+        return True
+
+    def find_username(self, username: str) -> Optional[str]:
+        return self.by_username.get(username.lstrip("@").lower())
+
+    def search_prefix(self, prefix: str, limit: int) -> list:
+        """المستخدمون الذين يبدأ اسمهم أو إحدى كلماته أو اسم المستخدم بالبادئة - O(log N + النتائج)"""
+        prefix = normalize_arabic(prefix.lstrip("@").strip())
+        if not prefix:
+            return []
+        found = []
+        position = bisect.bisect_left(self._prefix_index, (prefix,))
+        while position < len(self._prefix_index) and len(found) < limit:
+            key, user_id = self._prefix_index[position]
+            if not key.startswith(prefix):
+                break
+            if user_id not in found:
+                found.append(user_id)
+            position += 1
+        return found
+
+    def display_name(self, user_id) -> str:
+        record = self.records.get(str(user_id))
+        if record is None:
+            return str(user_id)
+        name = f"{record[1] or ''} {record[2] or ''}".strip() or "بدون اسم"
+        return f"{name} (@{record[0]})" if record[0] else name
+
+# ===== التحليلات العمودية =====
+
+ANALYTICS_GAME = 1
+ANALYTICS_DAILY = 2
+ANALYTICS_MESSAGE = 3
+ANALYTICS_SIGNUP = 4
+ANALYTICS_PAYOUT = 5   # دفعة من لعبة خارج الجولة (جائزة اليانصيب) - تدخل في الربح لا في عدد الجولات
+ANALYTICS_GAMES = ("roulette", "slots", "dice", "coinflip", "blackjack", "lottery")  # الرمز = الترتيب + 1
+
+# اسم العمود -> نوع array (وما يقابله في numpy)
+ANALYTICS_COLUMNS = (("ts", "I"), ("user", "q"), ("kind", "B"), ("game", "B"), ("bet", "q"), ("net", "q"))
+ANALYTICS_NUMPY_TYPES = {"I": "<u4", "q": "<i8", "B": "u1"}
+
+class AnalyticsStore:
+    """سجل أحداث إلحاقي بملف مستقل لكل عمود - التسجيل إضافة لمصفوفات في الذاكرة والكتابة دفعة من مهمة دورية"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._buffers = {name: array(typecode) for name, typecode in ANALYTICS_COLUMNS}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._repair()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, f"{name}.bin")
+
+    def _repair(self):
+        """اقتطاع الأعمدة إلى أقصر طول مشترك بعد انهيار أثناء الكتابة"""
+        sizes = {}
+        for name, typecode in ANALYTICS_COLUMNS:
+            path = self._path(name)
+            sizes[name] = os.path.getsize(path) // array(typecode).itemsize if os.path.exists(path) else 0
+        rows = min(sizes.values())
+        for name, typecode in ANALYTICS_COLUMNS:
+            if sizes[name] != rows:
+                logger.warning(f"اقتطاع عمود التحليلات {name} من {sizes[name]} إلى {rows} صف")
+                with open(self._path(name), 'r+b') as f:
+                    f.truncate(rows * array(typecode).itemsize)
+
+    def record(self, kind: int, user_id, game: int = 0, bet: int = 0, net: int = 0):
+        buffers = self._buffers
+        buffers["ts"].append(int(time.time()))
+        buffers["user"].append(int(user_id))
+        buffers["kind"].append(kind)
+        buffers["game"].append(game)
+        buffers["bet"].append(bet)
+        buffers["net"].append(net)
+
+    def record_game(self, user_id, game: str, bet: int, net: int):
+        """جولة لعب: net هو صافي ربح اللاعب (سالب عند الخسارة) - ألعاب الإضافات تُسجل بالرمز 0"""
+        code = ANALYTICS_GAMES.index(game) + 1 if game in ANALYTICS_GAMES else 0
+        self.record(ANALYTICS_GAME, user_id, code, bet, net)
+
+    def flush(self) -> int:
+        """إلحاق الأحداث المخزنة بملفات الأعمدة"""
+        with self._lock:
+            buffers, self._buffers = self._buffers, {name: array(typecode) for name, typecode in ANALYTICS_COLUMNS}
+            rows = len(buffers["ts"])
+            if not rows:
+                return 0
+            for name, _ in ANALYTICS_COLUMNS:
+                with open(self._path(name), 'ab') as f:
+                    buffers[name].tofile(f)
+        return rows
+
+    def columns(self) -> Dict[str, Any]:
+        """قراءة الأعمدة المحفوظة (numpy memmap عند توفره وإلا array)"""
+        with self._lock:
+            rows = os.path.getsize(self._path("ts")) // array("I").itemsize if os.path.exists(self._path("ts")) else 0
+            result = {}
+            for name, typecode in ANALYTICS_COLUMNS:
+                if np is not None:
+                    result[name] = (np.memmap(self._path(name), dtype=ANALYTICS_NUMPY_TYPES[typecode], mode='r', shape=(rows,))
+                                    if rows else np.zeros(0, dtype=ANALYTICS_NUMPY_TYPES[typecode]))
+                else:
+                    column = array(typecode)
+                    if rows:
+                        with open(self._path(name), 'rb') as f:
+                            column.fromfile(f, rows)
+                    result[name] = column
+            return result
+
+def analytics_report(columns: Dict[str, Any], now: float, days: int = 30) -> Dict[str, Any]:
+    """حساب تقرير الإدارة من الأعمدة - متجه مع numpy ومكافئ بحلقات بايثون بدونها"""
+    day0 = int(datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()) - (days - 1) * 86400
+    start = bisect.bisect_left(columns["ts"], day0)
+    ts, user, kind, game, bet, net = (columns[name][start:] for name, _ in ANALYTICS_COLUMNS)
+    report = {'days': days, 'day0': day0, 'events': len(ts)}
+
+    if np is not None:
+        day = np.clip((ts.astype(np.int64) - day0) // 86400, 0, days - 1)
+        recent = ts >= now - 86400
+        week = ts >= now - 7 * 86400
+        report['dau'] = int(np.unique(user[recent]).size)
+        report['wau'] = int(np.unique(user[week]).size)
+        report['mau'] = int(np.unique(user).size)
+        report['signups_week'] = int(np.count_nonzero((kind == ANALYTICS_SIGNUP) & week))
+        report['daily_claims_today'] = int(np.count_nonzero((kind == ANALYTICS_DAILY) & recent))
+        report['messages_today'] = int(np.count_nonzero((kind == ANALYTICS_MESSAGE) & recent))
+        # المستخدمون النشطون يومياً: أزواج (مستخدم، يوم) فريدة
+        pairs = np.unique(user.astype(np.int64) * days + day)
+        report['active_series'] = np.bincount(pairs % days, minlength=days).tolist()
+
+        plays = kind == ANALYTICS_GAME
+        g, b, n, d, u = game[plays], bet[plays], net[plays], day[plays], user[plays]
+        size = len(ANALYTICS_GAMES) + 1
+        rounds = np.bincount(g, minlength=size)
+        wagered = np.bincount(g, weights=b, minlength=size)
+        profit = -np.bincount(g, weights=n, minlength=size)
+        wins = np.bincount(g, weights=n > 0, minlength=size)
+        profit_series = -np.bincount(d, weights=n, minlength=days)
+        paid = kind == ANALYTICS_PAYOUT
+        profit -= np.bincount(game[paid], weights=net[paid], minlength=size)
+        profit_series -= np.bincount(day[paid], weights=net[paid], minlength=days)
+        report['profit_series'] = profit_series.astype(np.int64).tolist()
+
+        users, inverse = np.unique(u, return_inverse=True)
+        user_rounds = np.bincount(inverse, minlength=users.size)
+        user_wins = np.bincount(inverse, weights=n > 0, minlength=users.size)
+        qualified = user_rounds >= ANALYTICS_MIN_ROUNDS
+        rates = user_wins[qualified] / user_rounds[qualified]
+        report['win_rate_histogram'] = np.bincount(np.minimum((rates * 10).astype(np.int64), 9), minlength=10).tolist()
+    else:
+        recent_ts, week_ts = now - 86400, now - 7 * 86400
+        dau, wau, mau, pairs = set(), set(), set(), set()
+        report.update({'signups_week': 0, 'daily_claims_today': 0, 'messages_today': 0})
+        size = len(ANALYTICS_GAMES) + 1
+        rounds, wagered, profit, wins = [0] * size, [0] * size, [0] * size, [0] * size
+        profit_series = [0] * days
+        per_user: Dict[int, list] = {}
+        for t, u, k, g, b, n in zip(ts, user, kind, game, bet, net):
+            day = min(max((t - day0) // 86400, 0), days - 1)
+            mau.add(u)
+            pairs.add((u, day))
+            if t >= week_ts:
+                wau.add(u)
+                report['signups_week'] += k == ANALYTICS_SIGNUP
+            if t >= recent_ts:
+                dau.add(u)
+                report['daily_claims_today'] += k == ANALYTICS_DAILY
+                report['messages_today'] += k == ANALYTICS_MESSAGE
+            if k == ANALYTICS_GAME:
+                rounds[g] += 1
+                wagered[g] += b
+                profit[g] -= n
+                wins[g] += n > 0
+                profit_series[day] -= n
+                stats = per_user.setdefault(u, [0, 0])
+                stats[0] += 1
+                stats[1] += n > 0
+            elif k == ANALYTICS_PAYOUT:
+                profit[g] -= n
+                profit_series[day] -= n
+        report.update({'dau': len(dau), 'wau': len(wau), 'mau': len(mau), 'profit_series': profit_series})
+        active_series = [0] * days
+        for _, day in pairs:
+            active_series[day] += 1
+        report['active_series'] = active_series
+        histogram = [0] * 10
+        for played, won in per_user.values():
+            if played >= ANALYTICS_MIN_ROUNDS:
+                histogram[min(int(won / played * 10), 9)] += 1
+        report['win_rate_histogram'] = histogram
+
+    report['games'] = {
+        name: {
+            'rounds': int(rounds[code]),
+            'wagered': int(wagered[code]),
+            'profit': int(profit[code]),
+            'win_rate': float(wins[code] / rounds[code]) if rounds[code] else 0.0,
+        }
+        for code, name in enumerate(ANALYTICS_GAMES, 1) if rounds[code]
+    }
+    return report
+
+def render_analytics_chart(report: Dict[str, Any]) -> Optional[bytes]:
+    """رسم السلاسل الزمنية كصورة PNG (يتطلب matplotlib)"""
+    if plt is None:
+        return None
+    labels = [datetime.fromtimestamp(report['day0'] + i * 86400).strftime('%m-%d') for i in range(report['days'])]
+    figure, (active_axis, profit_axis) = plt.subplots(2, 1, figsize=(10, 6), sharex=True)
+    positions = range(report['days'])
+    active_axis.plot(positions, report['active_series'], marker='o', color='tab:blue')
+    active_axis.set_title("Daily active users")
+    profit_axis.bar(positions, report['profit_series'],
+                    color=['tab:green' if value >= 0 else 'tab:red' for value in report['profit_series']])
+    profit_axis.set_title("House profit per day")
+    profit_axis.set_xticks(list(positions), labels, rotation=60)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=100)
+    plt.close(figure)
+    return buffer.getvalue()
+
+# ===== سجل تدقيق الجولات =====
+
+AUDIT_SEGMENT_MAGIC = b"GBAU"
+AUDIT_INDEX_MAGIC = b"GBAI"
+AUDIT_VERSION = 1
+AUDIT_SEGMENT_HEADER = struct.Struct("<4sII32s")  # التوقيع، الإصدار، اليوم YYYYMMDD، تجزئة المقطع السابق
+AUDIT_RECORD = struct.Struct("<Iq16sqqQI")        # الوقت، المستخدم، اللعبة، الرهان، صافي الرصيد، nonce، النتيجة
+AUDIT_INDEX_HEADER = struct.Struct("<4sIII")      # التوقيع، الإصدار، عدد المستخدمين، عدد السجلات
+AUDIT_INDEX_USER = struct.Struct("<q")
+AUDIT_INDEX_START = struct.Struct("<I")
+AUDIT_READ_RECORDS = 8192                          # سجلات كل قراءة عند المرور على مقطع كامل
+
+def audit_day(timestamp: float) -> int:
+    return int(datetime.fromtimestamp(timestamp).strftime("%Y%m%d"))
+
+def decode_audit_record(record) -> Tuple[int, int, str, int, int, int, int]:
+    """(الوقت، المستخدم، اللعبة، الرهان، صافي الرصيد، nonce، النتيجة)"""
+    timestamp, user_id, game, bet, net, nonce, outcome = record
+    return timestamp, user_id, game.rstrip(b"\0").decode('ascii', 'replace'), bet, net, nonce, outcome
+
+class RoundAuditLog:
+    """سجل إلحاقي لجولات الألعاب بسجلات ثابتة الطول في مقطع لكل يوم
+
+    كل مقطع يبدأ بتجزئة SHA-256 للمقطع السابق كاملاً، فتعديل أو حذف أي جولة سابقة يكسر السلسلة.
+    جولات اليوم المفتوح تُبحث من فهرس في الذاكرة؛ المقاطع المغلقة من ملف .idx فيه مدخل لكل مستخدم
+    ظهر في ذلك اليوم فقط يشير إلى أرقام سجلاته، فالبحث ثنائي عبر mmap دون قراءة المقطع.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.day = 0
+        self.count = 0
+        self._file = None
+        self._day_ends = 0.0
+        self._digest = hashlib.sha256()
+        self._postings: Dict[int, array] = {}   # المستخدم -> أرقام سجلاته في المقطع المفتوح
+        os.makedirs(folder, exist_ok=True)
+        segments = self.segments()
+        if segments:
+            self._resume(*segments[-1])
+
+    def segment_path(self, day: int) -> str:
+        return os.path.join(self.folder, f"rounds_{day}.bin")
+
+    @staticmethod
+    def index_path(path: str) -> str:
+        return path[:-3] + ".idx" if path.endswith(".gz") else path + ".idx"
+
+    def segments(self) -> list:
+        """(اليوم، المسار) لكل مقطع بالترتيب الزمني - النسخة غير المضغوطة أولى إن وُجدت الاثنتان"""
+        paths: Dict[int, str] = {}
+        for filename in os.listdir(self.folder):
+            if not filename.startswith("rounds_"):
+                continue
+            path = os.path.join(self.folder, filename)
+            if filename.endswith(".bin"):
+                paths[int(filename[7:-4])] = path
+            elif filename.endswith(".bin.gz"):
+                paths.setdefault(int(filename[7:-7]), path)
+        return sorted(paths.items())
+
+    @staticmethod
+    def _open_segment(path: str):
+        return gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')
+
+    def _resume(self, day: int, path: str):
+        """متابعة آخر مقطع بعد إعادة التشغيل: إعادة حساب تجزئته وفهرسه واقتطاع سجل ناقص"""
+        if path.endswith(".gz"):
+            # مقطع قديم مغلق: تكفي تجزئته ليبدأ بها المقطع التالي
+            self.day, self.count, _, self._digest = self._hash_segment(path)
+            return
+        size = os.path.getsize(path)
+        if size < AUDIT_SEGMENT_HEADER.size:
+            # انهيار أثناء فتح المقطع قبل كتابة رأسه كاملاً
+            os.remove(path)
+            segments = self.segments()
+            if segments:
+                self._resume(*segments[-1])
+            return
+        complete = size - (size - AUDIT_SEGMENT_HEADER.size) % AUDIT_RECORD.size
+        if complete != size:
+            logger.warning(f"اقتطاع سجل تدقيق ناقص من {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(complete)
+
+        self.day, self.count, _, self._digest = self._hash_segment(path)
+        self._postings = {}
+        for number, record in enumerate(self._iter_records(path)):
+            postings = self._postings.get(record[1])
+            if postings is None:
+                postings = self._postings[record[1]] = array('I')
+            postings.append(number)
+        self._file = open(path, 'ab')
+
+    def _iter_records(self, path: str, limit: Optional[int] = None) -> Iterator[tuple]:
+        """المرور على سجلات مقطع (مضغوط أو لا) على دفعات دون تحميله كاملاً"""
+        with self._open_segment(path) as f:
+            f.seek(AUDIT_SEGMENT_HEADER.size)
+            remaining = limit
+            while remaining is None or remaining > 0:
+                records = AUDIT_READ_RECORDS if remaining is None else min(remaining, AUDIT_READ_RECORDS)
+                chunk = f.read(records * AUDIT_RECORD.size)
+                chunk = chunk[:len(chunk) - len(chunk) % AUDIT_RECORD.size]
+                if not chunk:
+                    return
+                yield from AUDIT_RECORD.iter_unpack(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk) // AUDIT_RECORD.size
+
+    def _hash_segment(self, path: str, limit: Optional[int] = None) -> Tuple[int, int, bytes, Any]:
+        """(اليوم، عدد السجلات، تجزئة المقطع السابق، تجزئة المقطع) - limit يقصر الحساب على أول السجلات"""
+        with self._open_segment(path) as f:
+            header = f.read(AUDIT_SEGMENT_HEADER.size)
+            if len(header) < AUDIT_SEGMENT_HEADER.size:
+                raise ValueError(f"رأس مقطع ناقص: {path}")
+            magic, version, day, previous = AUDIT_SEGMENT_HEADER.unpack(header)
+            if magic != AUDIT_SEGMENT_MAGIC or version != AUDIT_VERSION:
+                raise ValueError(f"مقطع تدقيق غير صالح: {path}")
+            digest = hashlib.sha256(header)
+            remaining = None if limit is None else limit * AUDIT_RECORD.size
+            size = 0
+            while remaining is None or remaining > 0:
+                chunk = f.read(1 << 20 if remaining is None else min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+        if size % AUDIT_RECORD.size:
+            raise ValueError(f"سجل ناقص في {path}")
+        return day, size // AUDIT_RECORD.size, previous, digest
+
+    def _rotate(self, now: float):
+        """فتح مقطع اليوم الجديد برأس يحمل تجزئة المقطع المغلق"""
+        day = audit_day(now)
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self._day_ends = midnight.timestamp()
+        if self._file is not None and day <= self.day:
+            return   # رجوع الساعة: الاستمرار في المقطع الحالي
+        if self._file is not None:
+            self._file.close()
+        header = AUDIT_SEGMENT_HEADER.pack(AUDIT_SEGMENT_MAGIC, AUDIT_VERSION, day, self._digest.digest())
+        self._file = open(self.segment_path(day), 'ab')
+        self._file.write(header)
+        self._file.flush()
+        self.day, self.count = day, 0
+        self._digest = hashlib.sha256(header)
+        self._postings = {}
+
+    def append(self, user_id, game: str, bet: int, net: int, nonce: int, outcome: int):
+        """تسجيل جولة مسواة - net هو التغير في رصيد اللاعب"""
+        now = time.time()
+        if now >= self._day_ends:
+            self._rotate(now)
+        user_id = int(user_id)
+        record = AUDIT_RECORD.pack(int(now), user_id, game.encode('ascii', 'replace')[:16], bet, net, nonce, outcome)
+        self._file.write(record)
+        self._file.flush()
+        self._digest.update(record)
+        postings = self._postings.get(user_id)
+        if postings is None:
+            postings = self._postings[user_id] = array('I')
+        postings.append(self.count)
+        self.count += 1
+
+    def head(self) -> Tuple[int, int, Any]:
+        """(اليوم، عدد السجلات، التجزئة) للمقطع المفتوح - تُلتقط قبل التحقق في خيط آخر"""
+        return self.day, self.count, self._digest.copy()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day_ends = 0.0
+
+    def _indexed_numbers(self, path: str, user_id: int) -> Optional[list]:
+        """أرقام سجلات المستخدم من فهرس المقطع - None إذا لم يُبنَ الفهرس بعد"""
+        try:
+            f = open(self.index_path(path), 'rb')
+        except FileNotFoundError:
+            return None
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, users, _ = AUDIT_INDEX_HEADER.unpack_from(mapped, 0)
+            if magic != AUDIT_INDEX_MAGIC or version != AUDIT_VERSION:
+                return None
+            starts_at = AUDIT_INDEX_HEADER.size + users * AUDIT_INDEX_USER.size
+            postings_at = starts_at + (users + 1) * AUDIT_INDEX_START.size
+            low, high = 0, users
+            while low < high:
+                middle = (low + high) // 2
+                found, = AUDIT_INDEX_USER.unpack_from(mapped, AUDIT_INDEX_HEADER.size + middle * AUDIT_INDEX_USER.size)
+                if found < user_id:
+                    low = middle + 1
+                elif found > user_id:
+                    high = middle
+                else:
+                    start, = AUDIT_INDEX_START.unpack_from(mapped, starts_at + middle * AUDIT_INDEX_START.size)
+                    end, = AUDIT_INDEX_START.unpack_from(mapped, starts_at + (middle + 1) * AUDIT_INDEX_START.size)
+                    return list(array('I', mapped[postings_at + start * 4:postings_at + end * 4]))
+        return []
+
+    def _read_records(self, path: str, numbers: list) -> list:
+        """قراءة سجلات بأرقامها: mmap للمقطع غير المضغوط وقراءة متقدمة للأمام في المضغوط"""
+        if not numbers:
+            return []
+        offsets = [AUDIT_SEGMENT_HEADER.size + number * AUDIT_RECORD.size for number in numbers]
+        if path.endswith(".gz"):
+            records = []
+            with gzip.open(path, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    records.append(decode_audit_record(AUDIT_RECORD.unpack(f.read(AUDIT_RECORD.size))))
+            return records
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return [decode_audit_record(AUDIT_RECORD.unpack_from(mapped, offset)) for offset in offsets]
+
+    def user_rounds(self, user_id: int, limit: int) -> list:
+        """أحدث جولات المستخدم من الأحدث إلى الأقدم عبر المقاطع"""
+        rounds = []
+        for day, path in reversed(self.segments()):
+            if self._file is not None and day == self.day:
+                numbers = list(self._postings.get(user_id, ()))
+            else:
+                numbers = self._indexed_numbers(path, user_id)
+                if numbers is None:
+                    numbers = [number for number, record in enumerate(self._iter_records(path)) if record[1] == user_id]
+            rounds.extend(reversed(self._read_records(path, numbers[-(limit - len(rounds)):])))
+            if len(rounds) >= limit:
+                break
+        return rounds
+
+    def build_index(self, path: str) -> int:
+        """كتابة فهرس مقطع مغلق: المستخدمون مرتبين ثم بداية سجلات كل منهم ثم أرقام السجلات"""
+        postings: Dict[int, array] = {}
+        records = 0
+        for records, record in enumerate(self._iter_records(path), 1):
+            numbers = postings.get(record[1])
+            if numbers is None:
+                numbers = postings[record[1]] = array('I')
+            numbers.append(records - 1)
+        users = sorted(postings)
+        starts = array('I', [0])
+        for user_id in users:
+            starts.append(starts[-1] + len(postings[user_id]))
+        index_path = self.index_path(path)
+        with open(index_path + ".tmp", 'wb') as f:
+            f.write(AUDIT_INDEX_HEADER.pack(AUDIT_INDEX_MAGIC, AUDIT_VERSION, len(users), records))
+            array('q', users).tofile(f)
+            starts.tofile(f)
+            for user_id in users:
+                postings[user_id].tofile(f)
+        os.replace(index_path + ".tmp", index_path)
+        return len(users)
+
+    def maintain(self, now: float) -> Tuple[int, int]:
+        """فهرسة المقاطع المغلقة وضغط ما تجاوز AUDIT_PLAIN_DAYS - (مفهرسة، مضغوطة)"""
+        current = self.day if self._file is not None else None
+        compress_before = audit_day(now - AUDIT_PLAIN_DAYS * 86400)
+        indexed = compressed = 0
+        for day, path in self.segments():
+            if current is not None and day >= current:
+                continue   # المقطع المفتوح (أو مقطع فُتح أثناء المرور)
+            if not os.path.exists(self.index_path(path)):
+                self.build_index(path)
+                indexed += 1
+            if day < compress_before and not path.endswith(".gz"):
+                with open(path, 'rb') as source, gzip.open(path + ".gz.tmp", 'wb') as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+                os.replace(path + ".gz.tmp", path + ".gz")
+                os.remove(path)
+                compressed += 1
+        return indexed, compressed
+
+    def verify(self, head: Tuple[int, int, Any]) -> Tuple[bool, str]:
+        """إعادة حساب سلسلة التجزئة لكل المقاطع ومقارنة المقطع المفتوح بتجزئته في الذاكرة"""
+        head_day, head_count, head_digest = head
+        previous = None
+        segments = rounds = 0
+        for day, path in self.segments():
+            if day > head_day:
+                break   # مقطع فُتح بعد التقاط الرأس
+            try:
+                header_day, count, linked, digest = self._hash_segment(path, head_count if day == head_day else None)
+            except (OSError, ValueError, EOFError, gzip.BadGzipFile) as e:
+                return False, f"تعذر قراءة {os.path.basename(path)}: {e}"
+            if header_day != day:
+                return False, f"{os.path.basename(path)} يحمل يوماً مختلفاً في رأسه ({header_day})"
+            if previous is not None and linked != previous:
+                return False, f"انقطاع السلسلة عند {day}: تجزئة اليوم السابق لا تطابق ما يحمله المقطع"
+            if day == head_day and (count != head_count or digest.digest() != head_digest.digest()):
+                return False, f"سجلات اليوم المفتوح {day} لا تطابق تجزئتها في الذاكرة"
+            previous = digest.digest()
+            segments += 1
+            rounds += count
+        if previous is None:
+            return True, "لا توجد جولات مسجلة بعد"
+        return True, f"السلسلة سليمة: {segments} يوم، {rounds:,} جولة\nرأس السلسلة: {previous.hex()}"
+
+class EnhancedGameBot:
+    def __init__(self, root: str = ""):
+        # كل ملفات البوت نسبية إلى مجلده حتى تستقل بيانات البوتات المستضافة في نفس العملية
+        self.root = root
+        self.data_file = self.path(DATA_FILE)
+        self.messages_file = self.path(MESSAGES_FILE)
+        self.ledger_file = self.path(LEDGER_FILE)
+        self.backup_folder = self.path(BACKUP_FOLDER)
+        self.users_backup_prefix = self.path(USERS_BACKUP_PREFIX)
+        self.messages_backup_prefix = self.path(MESSAGES_BACKUP_PREFIX)
+        self.settings_store = SettingsStore(self.path(SETTINGS_FILE))
+        self.settings_store.load()
+        self.recovered_from: Optional[str] = None
+        self._backed_up_at: Dict[str, float] = {}
+        self._users_dirty = False
+        self._level_table: Optional[LevelTable] = None
+        self.achievements = AchievementEngine.load(self.path(ACHIEVEMENTS_FILE))
+        if FAST_STARTUP_MODE:
+            self.users_data = LazySnapshotStore.open_or_build(self.path(USERS_SNAPSHOT_FILE), self.data_file, self.load_data)
+            self.messages_log = LazySnapshotStore.open_or_build(self.path(MESSAGES_SNAPSHOT_FILE), self.messages_file, self.load_messages)
+        elif USER_TIERING:
+            self.users_data = TieredUserStore(self.path(USERS_COLD_FILE), self.load_data())
+            self.messages_log = self.load_messages()
+        else:
+            self.users_data = self.load_data()
+            self.messages_log = self.load_messages()
+        self.search_index = MessageSearchIndex(self.path(SEARCH_INDEX_FILE))
+        self.analytics = AnalyticsStore(self.path(ANALYTICS_FOLDER))
+        self.audit = RoundAuditLog(self.path(AUDIT_FOLDER))
+        self.directory = UserDirectory(self.path(DIRECTORY_FILE))
+        self.directory.load(self.messages_log)
+        self.ledger = Ledger(self.ledger_file, self.path(LEDGER_CHECKPOINT_FILE))
+        self.ledger.load(self.users_data)
         self.create_backup_folder()
+        if self.recovered_from is None and self.users_file_stale():
+            # الحفظ المجمع للجولات: انهيار قبل الحفظ يترك الدفتر أحدث من ملف المستخدمين
+            self.recovered_from = self.ledger_file
+        if self.recovered_from:
+            self.restore_balances_from_ledger()
         
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+    
+    def users_file_stale(self) -> bool:
+        """آخر قيد في الدفتر أحدث من آخر حفظ للمستخدمين
+
+        التساوي يُعد تأخراً: دقة الطوابع الزمنية قد تجمع الحفظ وقيداً بعده في نفس اللحظة،
+        والاستعادة حين لا فرق لا تصحح شيئاً.
+        """
+        try:
+            return os.stat(self.ledger_file).st_mtime_ns >= os.stat(self.data_file).st_mtime_ns
+        except OSError:
+            return False
+    
     def create_backup_folder(self):
         """إنشاء مجلد النسخ الاحتياطية"""
-        if not os.path.exists("backups"):
-            os.makedirs("backups")
+        if not os.path.exists(self.backup_folder):
+            os.makedirs(self.backup_folder)
+    
+    def restore_balances_from_ledger(self):
+        """بعد الاستعادة من نسخة قديمة: الدفتر أحدث منها فتُصحح الأرصدة منه ويُعاد إنشاء من انضم بعدها"""
+        corrected = created = 0
+        for account, balance in self.ledger.balances.items():
+            if not account.startswith("user:"):
+                continue
+            user_id = account[5:]
+            if isinstance(self.users_data, TieredUserStore):
+                user_data = self.users_data.peek(user_id)   # بلا استعادة المؤرشفين السليمين
+            else:
+                user_data = self.users_data.get(user_id)
+            if user_data is None:
+                user_data = self.users_data[user_id] = new_user_record(self.settings)
+                created += 1
+            if user_data['balance'] != balance:
+                user_data['balance'] = balance
+                self.users_data[user_id] = user_data
+                corrected += 1
+        logger.warning(f"استعادة من {self.recovered_from}: تصحيح {corrected:,} رصيد وإعادة إنشاء {created:,} مستخدم من الدفتر")
+        self.save_data()
     
     def load_data(self) -> Dict:
-        """تحميل بيانات المستخدمين مع معالجة الأخطاء"""
+        """تحميل بيانات المستخدمين - الملف التالف يُستبدل بأحدث نسخة احتياطية سليمة ثم بالدفتر"""
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            logger.warning(f"خطأ في تحميل بيانات المستخدمين: {e}")
+            users, version, source = load_state_with_fallback(self.data_file, self.users_backup_prefix)
+        except FileNotFoundError:
+            logger.info("لا يوجد ملف بيانات مستخدمين - بدء بحالة جديدة")
+            return {}
+        except StateRecoveryError as e:
+            if not os.path.exists(self.ledger_file):
+                raise
+            # آخر خيار: الأرصدة من الدفتر مع الاحتفاظ بالملف التالف للفحص اليدوي
+            logger.critical(f"{e} - إعادة بناء الأرصدة من الدفتر")
+            # قد يكون الملف الرئيسي مفقوداً والتالف هو النسخ الاحتياطية وحدها
+            if os.path.exists(self.data_file):
+                os.replace(self.data_file, f"{self.data_file}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+            self.recovered_from = self.ledger_file
             return {}
+        if source != self.data_file:
+            self.recovered_from = source
+        migrate_users(users, version, self.settings)
+        return users
     
     def load_messages(self) -> Dict:
-        """تحميل سجل الرسائل"""
+        """تحميل سجل الرسائل مع الرجوع لأحدث نسخة احتياطية سليمة"""
         try:
-            with open(MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            return load_state_with_fallback(self.messages_file, self.messages_backup_prefix)[0]
+        except FileNotFoundError:
+            return {}
+        except StateRecoveryError as e:
+            # السجل غير مالي: البدء بسجل فارغ مع حفظ الملف التالف بدلاً من الكتابة فوقه
+            logger.critical(f"{e} - البدء بسجل رسائل فارغ")
+            if os.path.exists(self.messages_file):
+                os.replace(self.messages_file, f"{self.messages_file}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}")
             return {}
     
-    def load_settings(self) -> Dict:
-        """تحميل إعدادات البوت"""
-        try:
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                # دمج الإعدادات الافتراضية مع المحفوظة
-                for key, value in DEFAULT_SETTINGS.items():
-                    if key not in settings:
-                        settings[key] = value
-                return settings
-        except (FileNotFoundError, json.JSONDecodeError):
-            return DEFAULT_SETTINGS.copy()
+    def backup_before_save(self, path: str, prefix: str):
+        """نسخة احتياطية للملف الحالي بحد أقصى مرة كل BACKUP_INTERVAL_SECONDS"""
+        now = time.monotonic()
+        if now - self._backed_up_at.get(path, -BACKUP_INTERVAL_SECONDS) < BACKUP_INTERVAL_SECONDS:
+            return
+        self._backed_up_at[path] = now
+        backup_state_file(path, prefix)
+    
+    @property
+    def settings(self) -> SettingsSnapshot:
+        """لقطة الإعدادات الحالية - للقراءة فقط، والتعديل عبر settings_store.update"""
+        return self.settings_store.current
     
+    @hot_path("storage:save_data")
     def save_data(self):
-        """حفظ بيانات المستخدمين مع نسخة احتياطية"""
+        """حفظ بيانات المستخدمين ذرياً مع نسخة احتياطية دورية - الحفظ الفاشل يبقى معلّقاً لـ users_save_job"""
         try:
-            # إنشاء نسخة احتياطية
-            if os.path.exists(DATA_FILE):
-                backup_name = f"backups/users_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                with open(DATA_FILE, 'r', encoding='utf-8') as old_file:
-                    with open(backup_name, 'w', encoding='utf-8') as backup_file:
-                        backup_file.write(old_file.read())
-            
-            # حفظ البيانات الجديدة
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.users_data, f, ensure_ascii=False, indent=2)
-                
+            self.backup_before_save(self.data_file, self.users_backup_prefix)
+            if isinstance(self.users_data, LazySnapshotStore):
+                self.users_data.persist(self.data_file, STATE_CODEC)
+            elif isinstance(self.users_data, TieredUserStore):
+                self.users_data.persist(self.data_file)
+            else:
+                write_file_atomic(self.data_file, dump_state(self.users_data))
+            self._users_dirty = False
         except Exception as e:
             logger.error(f"خطأ في حفظ البيانات: {e}")
     
+    def mark_users_dirty(self):
+        """تأجيل الحفظ إلى users_save_job - الدفتر يحفظ الأرصدة فوراً"""
+        self._users_dirty = True
+    
+    def flush_users(self):
+        if self._users_dirty:
+            self.save_data()
+    
+    @hot_path("storage:save_messages")
     def save_messages(self):
-        """حفظ سجل الرسائل"""
+        """حفظ سجل الرسائل ذرياً"""
         try:
-            with open(MESSAGES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.messages_log, f, ensure_ascii=False, indent=2)
+            self.backup_before_save(self.messages_file, self.messages_backup_prefix)
+            if isinstance(self.messages_log, LazySnapshotStore):
+                self.messages_log.persist(self.messages_file, STATE_CODEC)
+                return
+            write_file_atomic(self.messages_file, dump_state(self.messages_log))
         except Exception as e:
             logger.error(f"خطأ في حفظ الرسائل: {e}")
     
-    def save_settings(self):
-        """حفظ إعدادات البوت"""
-        try:
-            with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"خطأ في حفظ الإعدادات: {e}")
-    
+    @hot_path("messages:log_message")
     def log_message(self, user_id: int, username: Optional[str], first_name: Optional[str], 
                    last_name: Optional[str], message_text: str):
         """تسجيل الرسائل مع معالجة محسنة"""
@@ -142,13 +2554,18 @@ class EnhancedGameBot:
                     'last_seen': datetime.now().isoformat()
                 }
             
-            # تحديث معلومات المستخدم
-            self.messages_log[user_id].update({
+            # تحديث معلومات المستخدم - المقارنة مع السجل نفسه لأن track_user قد يكون
+            # حدّث الدليل بالاسم الجديد قبل هذه الرسالة فلا يرى الدليل تغييراً
+            self.directory.update(user_id, username, first_name, last_name)
+            names = {
                 'username': username or 'غير محدد',
                 'first_name': first_name or 'غير محدد',
-                'last_name': last_name or '',
-                'last_seen': datetime.now().isoformat()
-            })
+                'last_name': last_name or ''
+            }
+            entry = self.messages_log[user_id]
+            if any(entry.get(field) != value for field, value in names.items()):
+                entry.update(names)
+            self.messages_log[user_id]['last_seen'] = datetime.now().isoformat()
             
             # إضافة الرسالة مع تحديد طولها
             message_entry = {
@@ -160,6 +2577,8 @@ class EnhancedGameBot:
             
             self.messages_log[user_id]['messages'].append(message_entry)
             self.messages_log[user_id]['message_count'] += 1
+            self.search_index.add(user_id, int(time.time()), message_entry['text'])
+            self.analytics.record(ANALYTICS_MESSAGE, user_id)
             
             # الاحتفاظ بآخر 100 رسالة لكل مستخدم
             if len(self.messages_log[user_id]['messages']) > 100:
@@ -170,101 +2589,1196 @@ class EnhancedGameBot:
                 self.save_messages()
                 
         except Exception as e:
-            logger.error(f"خطأ في تسجيل الرسالة: {e}")
-    
-    def get_user_data(self, user_id: int) -> Dict[str, Any]:
-        """الحصول على بيانات المستخدم مع الإعدادات المحدثة"""
-        user_id = str(user_id)
-        if user_id not in self.users_data:
-            self.users_data[user_id] = {
-                'balance': self.settings['starting_balance'],
-                'wins': 0,
-                'losses': 0,
-                'games_played': 0,
-                'last_daily': None,
-                'level': 1,
-                'exp': 0,
-                'achievements': [],
-                'is_banned': False,
-                'ban_reason': None,
-                'ban_date': None,
-                'join_date': datetime.now().isoformat(),
-                'total_wagered': 0,
-                'total_won': 0,
-                'total_lost': 0,
-                'favorite_game': None,
-                'vip_status': False,
-                'referral_count': 0,
-                'referred_by': None,
-                'daily_streak': 0,
-                'last_activity': datetime.now().isoformat()
-            }
-            self.save_data()
-        
-        # تحديث آخر نشاط
-        self.users_data[user_id]['last_activity'] = datetime.now().isoformat()
-        return self.users_data[user_id]
-    
-    def update_user_data(self, user_id: int, data: Dict[str, Any]):
-        """تحديث بيانات المستخدم"""
+            logger.error(f"خطأ في تسجيل الرسالة: {e}")
+    
+    @hot_path("users:get_user_data")
+    def get_user_data(self, user_id: int, touch: bool = True) -> Dict[str, Any]:
+        """الحصول على بيانات المستخدم - touch=False لاستعلامات المشرفين حتى لا يُحسب نشاطاً للمستخدم"""
+        user_id = str(user_id)
+        if user_id not in self.users_data:
+            self.users_data[user_id] = new_user_record(self.settings)
+            self.ledger.post("signup", [
+                (user_account(user_id), self.settings['starting_balance']),
+                (REWARDS_ACCOUNT, -self.settings['starting_balance'])
+            ], key=f"signup:{user_id}")
+            self.analytics.record(ANALYTICS_SIGNUP, user_id)
+            self.save_data()
+        
+        user_data = self.users_data[user_id]
+        if touch:
+            user_data['last_activity'] = datetime.now().isoformat()
+        return user_data
+    
+    @hot_path("users:update_user_data")
+    def update_user_data(self, user_id: int, data: Dict[str, Any]):
+        """تحديث بيانات المستخدم"""
+        try:
+            self.users_data[str(user_id)].update(data)
+            self.save_data()
+        except Exception as e:
+            logger.error(f"خطأ في تحديث بيانات المستخدم {user_id}: {e}")
+    
+    @property
+    def level_table(self) -> LevelTable:
+        """جدول المستويات الحالي - يُعاد بناؤه فقط عند تغيير المنحنى في الإعدادات"""
+        curve = self.settings.get('level_curve') or DEFAULT_SETTINGS['level_curve']
+        key = (int(curve['linear']), int(curve['quadratic']), int(curve['max_level']))
+        if self._level_table is None or self._level_table.curve != key:
+            self._level_table = LevelTable(*key)
+        return self._level_table
+    
+    def calculate_level_up_exp(self, level: int) -> int:
+        """حساب النقاط المطلوبة للمستوى التالي"""
+        return self.level_table.exp_for_next(level)
+    
+    def apply_level_ups(self, user_id: int, user_data: Dict[str, Any]) -> Tuple[int, int, int]:
+        """رفع المستوى دفعة واحدة مهما كان عدد المستويات المستحقة"""
+        old_level, new_level, bonus = apply_level_ups(user_data, self.level_table, self.settings['level_up_bonus'])
+        if bonus:
+            self.ledger.post("level_bonus", [(user_account(user_id), bonus), (REWARDS_ACCOUNT, -bonus)])
+        return old_level, new_level, bonus
+    
+    def adjust_balance(self, user_id: int, user_data: Dict[str, Any], amount: int, kind: str,
+                       counterparty: str, key: Optional[str] = None) -> bool:
+        """تعديل رصيد المستخدم مع قيد مزدوج - يعيد False إذا كانت العملية مكررة"""
+        if amount and self.ledger.post(kind, [(user_account(user_id), amount), (counterparty, -amount)], key) is None:
+            return False
+        user_data['balance'] += amount
+        return True
+    
+    def transfer_funds(self, sender_id: int, sender_data: Dict[str, Any], recipient_id: int,
+                       recipient_data: Dict[str, Any], amount: int, fee: int, key: str) -> bool:
+        """تحويل ذري: قيد واحد للمرسل والمستلم والرسوم ثم حفظ واحد"""
+        posted = self.ledger.post("transfer", [
+            (user_account(sender_id), -amount),
+            (user_account(recipient_id), amount - fee),
+            (FEES_ACCOUNT, fee)
+        ], key)
+        if posted is None:
+            return False
+        sender_data['balance'] -= amount
+        recipient_data['balance'] += amount - fee
+        self.save_data()
+        return True
+    
+    def settle_escrow(self, user_id: int, user_data: Dict[str, Any], stake: int, payout: int, kind: str,
+                      account: str = ESCROW_ACCOUNT, key: Optional[str] = None) -> bool:
+        """تسوية مبلغ محجوز: يُعاد المبلغ المستحق للمستخدم والفرق على الكازينو"""
+        posted = self.ledger.post(kind, [
+            (user_account(user_id), payout),
+            (account, -stake),
+            (HOUSE_ACCOUNT, stake - payout)
+        ], key)
+        if posted is None:
+            return False
+        user_data['balance'] += payout
+        return True
+    
+    def settle_escrow_batch(self, settlements, kind: str, account: str = ESCROW_ACCOUNT,
+                            key: Optional[str] = None) -> bool:
+        """تسوية عدة مبالغ محجوزة بقيد واحد - settlements: (المعرف، البيانات، المحجوز، المستحق)"""
+        stake = sum(entry[2] for entry in settlements)
+        payout = sum(entry[3] for entry in settlements)
+        postings = [(user_account(user_id), amount) for user_id, _, _, amount in settlements]
+        posted = self.ledger.post(kind, postings + [(account, -stake), (HOUSE_ACCOUNT, stake - payout)], key)
+        if posted is None:
+            return False
+        for _, user_data, _, amount in settlements:
+            user_data['balance'] += amount
+        return True
+    
+    @hot_path("users:check_achievements")
+    def check_achievements(self, user_id: int, user_data: Dict, changed_fields=None) -> str:
+        """فحص الإنجازات الجديدة (الحفظ مسؤولية المستدعي)"""
+        achievements = self.achievements.evaluate(user_data, changed_fields)
+        if achievements:
+            return "🏅 إنجاز جديد!\n" + self.achievements.describe(achievements)
+        return ""
+    
+    def temporary_ban(self, user_id: int, reason: str, minutes: int):
+        """حظر مؤقت يُرفع تلقائياً بعد انتهاء المدة"""
+        now = datetime.now()
+        self.get_user_data(user_id)
+        self.update_user_data(user_id, {
+            'is_banned': True,
+            'ban_reason': reason,
+            'ban_date': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'ban_until': (now + timedelta(minutes=minutes)).isoformat()
+        })
+    
+    def lift_expired_ban(self, user_data: Dict[str, Any]) -> bool:
+        """رفع الحظر المؤقت المنتهي - يعيد True إذا تغيرت البيانات"""
+        ban_until = user_data.get('ban_until')
+        if user_data.get('is_banned') and ban_until and datetime.fromisoformat(ban_until) <= datetime.now():
+            user_data.update({'is_banned': False, 'ban_reason': None, 'ban_date': None, 'ban_until': None})
+            return True
+        return False
+    
+    def is_maintenance_mode(self) -> bool:
+        """التحقق من وضع الصيانة"""
+        return self.settings.get('maintenance_mode', False)
+
+# ===== المهام المجدولة والإرسال =====
+
+class RateLimitedSender:
+    """طابور إرسال بمعدل محدود للرسائل الجماعية والتذكيرات"""
+
+    def __init__(self, rate_per_second: float = OUTBOX_RATE_PER_SECOND):
+        self._interval = 1.0 / rate_per_second
+        self._queue: Optional[asyncio.Queue] = None
+        self._bot = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, application):
+        """تشغيل عامل الإرسال داخل حلقة أحداث التطبيق"""
+        self._queue = asyncio.Queue(maxsize=OUTBOX_MAX_SIZE)
+        self._bot = application.bot
+        application.create_task(self._worker())
+
+    def enqueue(self, chat_id: int, text: str, **kwargs) -> bool:
+        """إضافة رسالة إلى الطابور دون انتظار"""
+        if self._queue is None:
+            logger.warning("طابور الإرسال غير مفعل بعد")
+            return False
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"طابور الإرسال ممتلئ، تم تجاهل رسالة إلى {chat_id}")
+            return False
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        """إرسال الرسائل بالتتابع مع احترام RetryAfter"""
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+            except RetryAfter as e:
+                # الإصدارات الأحدث من المكتبة تعيد timedelta بدلاً من عدد ثوانٍ
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+                try:
+                    self._queue.put_nowait((chat_id, text, kwargs))
+                except asyncio.QueueFull:
+                    # العامل هو المستهلك الوحيد فلا يمكنه انتظار مكان في طابوره
+                    self.failed += 1
+                    metrics.inc("outbox.dropped")
+                    logger.warning(f"طابور الإرسال ممتلئ بعد RetryAfter، تم تجاهل رسالة إلى {chat_id}")
+            except Forbidden:
+                # المستخدم حظر البوت
+                self.failed += 1
+            except TelegramError as e:
+                self.failed += 1
+                logger.error(f"فشل في إرسال رسالة إلى {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+            await asyncio.sleep(self._interval)
+
+class RewardScheduler:
+    """مجدول مهام بكومة مرتبة حسب وقت الاستحقاق - كل نبضة تعالج المستحقين فقط"""
+
+    DAILY_READY = "daily_ready"
+    STREAK_RESET = "streak_reset"
+    VIP_EXPIRY = "vip_expiry"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._heap = []
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def load(self, users):
+        """تحميل الجدول المحفوظ، أو بناؤه من بيانات المستخدمين عند أول تشغيل"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._heap = [tuple(entry) for entry in json.load(f)]
+            heapq.heapify(self._heap)
+            return
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            pass
+
+        self._heap = []
+        for user_id, user_data in users.items():
+            self.schedule_user(user_id, user_data)
+        self.save()
+        logger.info(f"تم بناء جدول المهام: {len(self._heap):,} مهمة")
+
+    def save(self):
+        """حفظ الجدول إذا تغير"""
+        if not self._dirty:
+            return
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(self._heap, f, separators=(',', ':'))
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"خطأ في حفظ جدول المهام: {e}")
+
+    def schedule(self, due: float, kind: str, user_id: str, stamp: str):
+        """جدولة مهمة - stamp قيمة الحقل وقت الجدولة للتحقق من صلاحيتها لاحقاً"""
+        heapq.heappush(self._heap, (due, kind, str(user_id), stamp))
+        self._dirty = True
+
+    def schedule_user(self, user_id: str, user_data: Dict[str, Any]):
+        """جدولة مهام المستخدم حسب آخر مكافأة يومية وانتهاء VIP"""
+        last_daily = user_data.get('last_daily')
+        if last_daily:
+            claimed_at = datetime.fromisoformat(last_daily).timestamp()
+            self.schedule(claimed_at + 86400, self.DAILY_READY, user_id, last_daily)
+            if user_data.get('daily_streak'):
+                # السلسلة تنقطع بعد مرور يومين كاملين دون مطالبة
+                self.schedule(claimed_at + 2 * 86400, self.STREAK_RESET, user_id, last_daily)
+
+        vip_expires = user_data.get('vip_expires')
+        if user_data.get('vip_status') and vip_expires:
+            self.schedule(datetime.fromisoformat(vip_expires).timestamp(), self.VIP_EXPIRY, user_id, vip_expires)
+
+    def pop_due(self, now: float, limit: int):
+        """إخراج دفعة من المهام المستحقة"""
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self._heap))
+        if due:
+            self._dirty = True
+        return due
+
+# ===== اليانصيب اليومي =====
+
+LOTTERY_TICKET_RECORD = struct.Struct("<qI")  # المعرف، عدد التذاكر
+
+def lottery_ticket_index(seed: bytes, draw_id: int, tickets_sha256: str, rank: int, total: int) -> int:
+    """رقم التذكرة الفائزة - دالة حتمية في البذرة المُلتزم بها مسبقاً وبصمة ملف التذاكر"""
+    message = f"{draw_id}:{tickets_sha256}:{rank}".encode()
+    return int.from_bytes(hmac.new(seed, message, hashlib.sha256).digest(), 'big') % total
+
+class LotteryDraw:
+    """سحب واحد: تذاكر في ملف إلحاقي وفهرس مجاميع تراكمية لاختيار الفائز بالبحث الثنائي"""
+
+    def __init__(self, folder: str, draw_id: int, seed: bytes, draw_at: float, price: int):
+        self.draw_id = draw_id
+        self.seed = seed
+        self.commitment = hashlib.sha256(seed).hexdigest()
+        self.draw_at = draw_at
+        self.price = price
+        self.path = os.path.join(folder, f"tickets_{draw_id}.bin")
+        self.owners = array('q')
+        self.cumulative = array('Q')  # cumulative[i] = عدد التذاكر حتى الشراء i شاملاً
+        self.per_user: Dict[int, int] = {}
+        self._digest = hashlib.sha256()
+        self._file = None
+
+    @property
+    def total(self) -> int:
+        return self.cumulative[-1] if self.cumulative else 0
+
+    @property
+    def tickets_sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def open(self):
+        """إعادة بناء الفهرس بقراءة ملف التذاكر تسلسلياً، مع اقتطاع سجل ناقص إن وجد"""
+        size = LOTTERY_TICKET_RECORD.size
+        position = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                while True:
+                    record = f.read(size)
+                    if len(record) < size:
+                        break
+                    self._index(record, *LOTTERY_TICKET_RECORD.unpack(record))
+                    position += size
+            if position < os.path.getsize(self.path):
+                logger.warning(f"تم اقتطاع سجل تذاكر ناقص من {self.path}")
+                with open(self.path, 'r+b') as f:
+                    f.truncate(position)
+        self._file = open(self.path, 'ab')
+
+    def _index(self, record: bytes, user_id: int, count: int):
+        self.owners.append(user_id)
+        self.cumulative.append(self.total + count)
+        self.per_user[user_id] = self.per_user.get(user_id, 0) + count
+        self._digest.update(record)
+
+    def add(self, user_id: int, count: int):
+        """شراء تذاكر - كتابة سجل واحد وإضافة عنصر واحد للفهرس"""
+        record = LOTTERY_TICKET_RECORD.pack(user_id, count)
+        self._file.write(record)
+        self._file.flush()
+        self._index(record, user_id, count)
+
+    def owner_of(self, ticket: int) -> int:
+        return self.owners[bisect.bisect_right(self.cumulative, ticket)]
+
+    def pick_winners(self, places: int):
+        """اختيار تذاكر فائزة مختلفة - احتمال فوز المستخدم يتناسب مع عدد تذاكره"""
+        winners = []
+        seen = set()
+        counter = 0
+        while len(winners) < min(places, self.total):
+            ticket = lottery_ticket_index(self.seed, self.draw_id, self.tickets_sha256, counter, self.total)
+            counter += 1
+            if ticket in seen:
+                continue
+            seen.add(ticket)
+            winners.append((ticket, self.owner_of(ticket)))
+        return winners
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def state(self) -> Dict[str, Any]:
+        return {'draw_id': self.draw_id, 'seed': self.seed.hex(), 'draw_at': self.draw_at, 'price': self.price}
+
+def iter_lottery_tickets(path: str) -> Iterator[Tuple[int, int]]:
+    """قراءة سجلات التذاكر تسلسلياً دون تحميل الملف في الذاكرة"""
+    size = LOTTERY_TICKET_RECORD.size
+    with open(path, 'rb') as f:
+        while True:
+            record = f.read(size)
+            if len(record) < size:
+                return
+            yield LOTTERY_TICKET_RECORD.unpack(record)
+
+def next_lottery_time(now: float, hour: int) -> float:
+    """موعد السحب القادم في الساعة المحددة من اليوم"""
+    current = datetime.fromtimestamp(now)
+    draw_at = current.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if draw_at <= current:
+        draw_at += timedelta(days=1)
+    return draw_at.timestamp()
+
+class LotteryEngine:
+    """اليانصيب اليومي: بذرة يُلتزم بها عند فتح السحب وتُكشف مع النتائج للتحقق"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.state_path = os.path.join(folder, "state.json")
+        self.current: Optional[LotteryDraw] = None
+        self.pending: list = []  # نتائج لم تكتمل تسويتها
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def result_path(self, draw_id: int) -> str:
+        return os.path.join(self.folder, f"draw_{draw_id}.json")
+
+    def load(self, settings):
+        """استعادة السحب المفتوح والنتائج غير المسوّاة بعد إعادة التشغيل"""
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.current = LotteryDraw(self.folder, state['draw_id'], bytes.fromhex(state['seed']),
+                                       state['draw_at'], state['price'])
+            self.current.open()
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self._open_draw(1, settings)
+
+        for draw_id in range(self.current.draw_id - 1, 0, -1):
+            result = self._read_result(draw_id)
+            if result is None:
+                break
+            if self.last_result is None:
+                self.last_result = result
+            if result['paid']:
+                break
+            self.pending.insert(0, result)
+
+    def _read_result(self, draw_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.result_path(draw_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_result(self, result: Dict[str, Any]):
+        path = self.result_path(result['draw_id'])
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _open_draw(self, draw_id: int, settings):
+        self.current = LotteryDraw(self.folder, draw_id, secrets.token_bytes(32),
+                                   next_lottery_time(time.time(), settings['lottery_draw_hour']),
+                                   settings['lottery_ticket_price'])
+        self.current.open()
+        with open(self.state_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.current.state(), f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def is_due(self, now: float) -> bool:
+        return self.current is not None and now >= self.current.draw_at
+
+    def draw(self, settings) -> Dict[str, Any]:
+        """إغلاق السحب الحالي واختيار الفائزين وفتح سحب جديد فوراً"""
+        draw = self.current
+        draw.close()
+        pot = draw.total * draw.price
+        house_cut = int(pot * settings['lottery_house_cut'])
+        shares = settings['lottery_prize_shares']
+        winners = draw.pick_winners(len(shares))
+        # إعادة توزيع الأنصبة إذا كانت التذاكر أقل من عدد المراكز
+        share_total = sum(shares[:len(winners)]) or 1
+        prizes = [int((pot - house_cut) * share / share_total) for share in shares[:len(winners)]]
+        result = {
+            'draw_id': draw.draw_id,
+            'drawn_at': datetime.now().isoformat(),
+            'commitment': draw.commitment,
+            'seed': draw.seed.hex(),
+            'tickets_file': os.path.basename(draw.path),
+            'tickets_sha256': draw.tickets_sha256,
+            'total_tickets': draw.total,
+            'participants': len(draw.per_user),
+            'ticket_price': draw.price,
+            'pot': pot,
+            # باقي التقريب يذهب للكازينو حتى يُفرَّغ حساب الجائزة بالكامل
+            'house_cut': pot - sum(prizes),
+            'winners': [{'rank': rank + 1, 'ticket': ticket, 'user_id': user_id, 'prize': prize}
+                        for rank, ((ticket, user_id), prize) in enumerate(zip(winners, prizes))],
+            'paid': False,
+        }
+        self.write_result(result)
+        self._open_draw(draw.draw_id + 1, settings)
+        self.pending.append(result)
+        self.last_result = result
+        return result
+
+def verify_lottery_draw(folder: str, draw_id: int) -> Tuple[bool, str]:
+    """إعادة حساب السحب من ملف التذاكر والبذرة المكشوفة ومقارنته بالنتيجة المنشورة"""
+    with open(os.path.join(folder, f"draw_{draw_id}.json"), 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    seed = bytes.fromhex(result['seed'])
+    if hashlib.sha256(seed).hexdigest() != result['commitment']:
+        return False, "البذرة المكشوفة لا تطابق الالتزام المنشور"
+
+    replay = LotteryDraw(folder, draw_id, seed, 0, result['ticket_price'])
+    for user_id, count in iter_lottery_tickets(os.path.join(folder, result['tickets_file'])):
+        replay._index(LOTTERY_TICKET_RECORD.pack(user_id, count), user_id, count)
+    if replay.tickets_sha256 != result['tickets_sha256'] or replay.total != result['total_tickets']:
+        return False, "ملف التذاكر لا يطابق البصمة المنشورة"
+
+    expected = replay.pick_winners(len(result['winners']))
+    published = [(w['ticket'], w['user_id']) for w in result['winners']]
+    if expected != published:
+        return False, f"الفائزون لا يطابقون إعادة الحساب: {expected}"
+    return True, f"السحب #{draw_id} صحيح: {replay.total:,} تذكرة، {len(expected)} فائز"
+
+# ===== جلسات الألعاب متعددة الخطوات =====
+
+class SessionStore:
+    """جلسات الألعاب في الذاكرة بترتيب LRU - الأقدم نشاطاً في المقدمة فينتهي الخامل بتكلفة O(1)"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def values(self):
+        return list(self._sessions.values())
+
+    def get(self, key):
+        """جلب الجلسة وتحديث وقت نشاطها"""
+        session = self._sessions.get(key)
+        if session is not None:
+            session.touched = time.monotonic()
+            self._sessions.move_to_end(key)
+        return session
+
+    def put(self, key, session) -> list:
+        """إضافة جلسة - يعيد الجلسات المُزاحة عند امتلاء المخزن لتسويتها"""
+        session.touched = time.monotonic()
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        evicted = []
+        while len(self._sessions) > self.max_size:
+            evicted.append(self._sessions.popitem(last=False)[1])
+        return evicted
+
+    def pop(self, key):
+        return self._sessions.pop(key, None)
+
+    def pop_expired(self, now: float) -> list:
+        """إخراج الجلسات الخاملة من مقدمة الترتيب فقط"""
+        expired = []
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched + self.ttl > now:
+                break
+            expired.append(self._sessions.popitem(last=False)[1])
+        return expired
+
+CARD_RANKS = ("A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K")
+CARD_SUITS = ("♠", "♥", "♦", "♣")
+
+def card_label(card: int) -> str:
+    """البطاقة رقم 0-51: الرتبة = card % 13 والنوع = card // 13"""
+    return CARD_RANKS[card % 13] + CARD_SUITS[card // 13]
+
+def add_card_value(total: int, soft_aces: int, card: int) -> Tuple[int, int]:
+    """تحديث قيمة اليد ببطاقة واحدة - الآس يُحسب 11 ويُخفض إلى 1 عند التجاوز"""
+    rank = card % 13
+    if rank == 0:
+        total, soft_aces = total + 11, soft_aces + 1
+    else:
+        total += min(rank + 1, 10)
+    while total > 21 and soft_aces:
+        total, soft_aces = total - 10, soft_aces - 1
+    return total, soft_aces
+
+class Shoe:
+    """صندوق بطاقات مشترك بعدة مجموعات في bytearray - السحب خطوة Fisher-Yates واحدة"""
+
+    def __init__(self, decks: int, penetration: float, rng: Optional[random.Random] = None):
+        self._cards = bytearray(card for _ in range(decks) for card in range(52))
+        self._cut = int(len(self._cards) * penetration)
+        self._position = 0
+        self._rng = rng or random.SystemRandom()
+
+    def draw(self) -> int:
+        if self._position >= self._cut:
+            # إعادة الخلط: كل البطاقات متاحة مجدداً دون إعادة بناء الصندوق
+            self._position = 0
+        swap = self._rng.randrange(self._position, len(self._cards))
+        cards = self._cards
+        cards[self._position], cards[swap] = cards[swap], cards[self._position]
+        self._position += 1
+        return cards[self._position - 1]
+
+class BlackjackHand:
+    """يد لاعب أو موزع بقيمة محدثة تدريجياً"""
+    __slots__ = ("cards", "total", "soft_aces")
+
+    def __init__(self):
+        self.cards = bytearray()
+        self.total = 0
+        self.soft_aces = 0
+
+    def add(self, card: int):
+        self.cards.append(card)
+        self.total, self.soft_aces = add_card_value(self.total, self.soft_aces, card)
+
+    @property
+    def is_blackjack(self) -> bool:
+        return self.total == 21 and len(self.cards) == 2
+
+    def render(self, hide_second: bool = False) -> str:
+        if hide_second:
+            return f"{card_label(self.cards[0])} 🂠"
+        return " ".join(card_label(card) for card in self.cards) + f" = {self.total}"
+
+class BlackjackSession:
+    """جولة بلاك جاك واحدة - الرهان محجوز في حساب الضمان حتى التسوية"""
+    __slots__ = ("user_id", "bet", "player", "dealer", "message_id", "touched")
+
+    def __init__(self, user_id: int, bet: int):
+        self.user_id = user_id
+        self.bet = bet
+        self.player = BlackjackHand()
+        self.dealer = BlackjackHand()
+        self.message_id: Optional[int] = None
+        self.touched = 0.0
+
+    def deal(self, shoe: Shoe):
+        for _ in range(2):
+            self.player.add(shoe.draw())
+            self.dealer.add(shoe.draw())
+
+    def play_dealer(self, shoe: Shoe):
+        """الموزع يسحب حتى 17 على الأقل"""
+        while self.dealer.total < 17:
+            self.dealer.add(shoe.draw())
+
+    def payout(self) -> Tuple[int, str]:
+        """المبلغ المعاد من الضمان ونتيجة الجولة"""
+        player, dealer = self.player, self.dealer
+        if player.total > 21:
+            return 0, "bust"
+        if player.is_blackjack and not dealer.is_blackjack:
+            return self.bet * 5 // 2, "blackjack"
+        if dealer.is_blackjack and not player.is_blackjack:
+            # بلاك جاك الموزع يغلب أي 21 من ثلاث أوراق أو أكثر
+            return 0, "lose"
+        if dealer.total > 21 or player.total > dealer.total:
+            return self.bet * 2, "win"
+        if player.total == dealer.total:
+            return self.bet, "push"
+        return 0, "lose"
+
+# ===== الاستثمار =====
+
+class Investment:
+    """مركز استثماري بفائدة مركبة يومياً - القيمة تُحسب عند القراءة ولا تُخزن"""
+    __slots__ = ("position_id", "user_id", "principal", "daily_rate", "opened_at", "matures_at")
+
+    def __init__(self, position_id: int, user_id: int, principal: int, daily_rate: float,
+                 opened_at: float, matures_at: float):
+        self.position_id = position_id
+        self.user_id = user_id
+        self.principal = principal
+        self.daily_rate = daily_rate
+        self.opened_at = opened_at
+        self.matures_at = matures_at
+
+    def value_at(self, now: float) -> int:
+        """أصل × (1 + معدل)^الأيام المنقضية حتى الاستحقاق"""
+        days = (min(now, self.matures_at) - self.opened_at) / 86400
+        return round(self.principal * math.exp(math.log1p(self.daily_rate) * days))
+
+    def row(self) -> list:
+        return [self.position_id, self.user_id, self.principal, self.daily_rate, self.opened_at, self.matures_at]
+
+class InvestmentBook:
+    """المراكز المفتوحة مع فهرس لكل مستخدم وكومة مرتبة حسب موعد الاستحقاق"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.positions: Dict[int, Investment] = {}
+        self.by_user: Dict[int, list] = {}
+        self._maturities = []
+        self._next_id = 1
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self._next_id = data['next_id']
+        for row in data['positions']:
+            self._index(Investment(*row))
+        self._maturities = [(p.matures_at, p.position_id) for p in self.positions.values()]
+        heapq.heapify(self._maturities)
+
+    def save(self):
+        """حفظ المراكز كصفوف مضغوطة - فقط عند فتح أو تسوية مراكز"""
+        if not self._dirty:
+            return
+        data = {'next_id': self._next_id, 'positions': [p.row() for p in self.positions.values()]}
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"خطأ في حفظ الاستثمارات: {e}")
+
+    def _index(self, position: Investment):
+        self.positions[position.position_id] = position
+        self.by_user.setdefault(position.user_id, []).append(position.position_id)
+
+    def open(self, user_id: int, principal: int, daily_rate: float, days: int, now: float) -> Investment:
+        position = Investment(self._next_id, user_id, principal, daily_rate, now, now + days * 86400)
+        self._next_id += 1
+        self._index(position)
+        heapq.heappush(self._maturities, (position.matures_at, position.position_id))
+        self._dirty = True
+        return position
+
+    def user_positions(self, user_id: int) -> list:
+        return [self.positions[position_id] for position_id in self.by_user.get(user_id, ())]
+
+    def pop_matured(self, now: float, limit: int) -> list:
+        """إخراج دفعة من المراكز المستحقة فقط"""
+        matured = []
+        while self._maturities and self._maturities[0][0] <= now and len(matured) < limit:
+            _, position_id = heapq.heappop(self._maturities)
+            position = self.positions.pop(position_id)
+            ids = self.by_user[position.user_id]
+            ids.remove(position_id)
+            if not ids:
+                del self.by_user[position.user_id]
+            matured.append(position)
+        if matured:
+            self._dirty = True
+        return matured
+
+# ===== البطولات =====
+
+class Tournament:
+    """بطولة محددة المدة: النتيجة = صافي ربح اللاعب في الجولات التي تُحسم داخل نافذة البطولة"""
+
+    __slots__ = ('tournament_id', 'game', 'starts_at', 'ends_at', 'entry_fee', 'prize_shares', 'house_cut',
+                 'scores', 'standings', 'status', 'results')
+
+    def __init__(self, tournament_id: int, game: str, starts_at: float, ends_at: float, entry_fee: int,
+                 prize_shares, house_cut: float, scores: Optional[Dict[int, int]] = None,
+                 status: str = "open", results: Optional[list] = None):
+        self.tournament_id = tournament_id
+        self.game = game
+        self.starts_at = starts_at
+        self.ends_at = ends_at
+        self.entry_fee = entry_fee
+        self.prize_shares = list(prize_shares)
+        self.house_cut = house_cut
+        self.scores: Dict[int, int] = scores or {}
+        self.status = status
+        self.results = results or []
+        # الترتيب الحي: (-النتيجة، المعرف) مرتبة تصاعدياً فالأول هو المتصدر
+        self.standings = sorted((-score, user_id) for user_id, score in self.scores.items())
+
+    @property
+    def pot(self) -> int:
+        return self.entry_fee * len(self.scores)
+
+    def is_live(self, now: float) -> bool:
+        return self.status == "open" and self.starts_at <= now < self.ends_at
+
+    def join(self, user_id: int) -> bool:
+        if user_id in self.scores:
+            return False
+        self.scores[user_id] = 0
+        bisect.insort(self.standings, (0, user_id))
+        return True
+
+    def apply(self, deltas: Dict[int, int]):
+        """إضافة تغيرات النتائج: إعادة فرز للدفعات الكبيرة وإلا تحديث موضعي بالبحث الثنائي"""
+        if len(deltas) > len(self.standings) // TOURNAMENT_RESORT_RATIO:
+            for user_id, delta in deltas.items():
+                self.scores[user_id] += delta
+            # الترتيب السابق شبه مرتب فيكون الفرز قريباً من الخطي
+            self.standings = sorted([(-self.scores[user_id], user_id) for _, user_id in self.standings])
+            return
+        for user_id, delta in deltas.items():
+            old = self.scores[user_id]
+            del self.standings[bisect.bisect_left(self.standings, (-old, user_id))]
+            self.scores[user_id] = old + delta
+            bisect.insort(self.standings, (-(old + delta), user_id))
+
+    def rank_of(self, user_id: int) -> Optional[int]:
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.standings, (-score, user_id)) + 1
+
+    def top(self, count: int) -> list:
+        return [(user_id, -negative) for negative, user_id in self.standings[:count]]
+
+    def prizes(self) -> Tuple[list, int]:
+        """توزيع الجائزة على المتصدرين - باقي التقريب ونصيب الكازينو يذهبان للكازينو"""
+        pot = self.pot
+        leaders = self.top(len(self.prize_shares))
+        shares = self.prize_shares[:len(leaders)]
+        share_total = sum(shares) or 1
+        distributable = pot - int(pot * self.house_cut)
+        awards = [(user_id, score, int(distributable * share / share_total))
+                  for (user_id, score), share in zip(leaders, shares)]
+        return awards, pot - sum(prize for _, _, prize in awards)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.tournament_id, 'game': self.game, 'starts_at': self.starts_at, 'ends_at': self.ends_at,
+            'entry_fee': self.entry_fee, 'prize_shares': self.prize_shares, 'house_cut': self.house_cut,
+            'scores': [[user_id, score] for user_id, score in self.scores.items()],
+            'status': self.status, 'results': self.results,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Tournament':
+        return cls(data['id'], data['game'], data['starts_at'], data['ends_at'], data['entry_fee'],
+                   data['prize_shares'], data['house_cut'], {user_id: score for user_id, score in data['scores']},
+                   data['status'], data['results'])
+
+class TournamentEngine:
+    """البطولات النشطة مع طابور نتائج تملؤه الألعاب بتكلفة ثابتة وتفرغه مهمة دورية"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tournaments: Dict[int, Tournament] = {}
+        self.queue: deque = deque()   # (معرف البطولة، المستخدم، صافي الربح)
+        self._next_id = 1
+        self._dirty = False
+
+    def load(self):
         try:
-            self.users_data[str(user_id)].update(data)
-            self.save_data()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self._next_id = data['next_id']
+        for row in data['tournaments']:
+            tournament = Tournament.from_dict(row)
+            self.tournaments[tournament.tournament_id] = tournament
+
+    def save(self):
+        if not self._dirty:
+            return
+        data = {'next_id': self._next_id, 'tournaments': [t.to_dict() for t in self.tournaments.values()]}
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
         except Exception as e:
-            logger.error(f"خطأ في تحديث بيانات المستخدم {user_id}: {e}")
-    
-    def calculate_level_up_exp(self, level: int) -> int:
-        """حساب النقاط المطلوبة للمستوى التالي"""
-        return level * 150 + (level * level * 10)
-    
-    def check_achievements(self, user_id: int, user_data: Dict) -> str:
-        """فحص الإنجازات الجديدة"""
-        achievements = []
-        current_achievements = set(user_data.get('achievements', []))
-        
-        # إنجازات الألعاب
-        if user_data['games_played'] >= 100 and 'games_100' not in current_achievements:
-            achievements.append('games_100')
-            user_data['achievements'].append('games_100')
-            
-        if user_data['wins'] >= 50 and 'wins_50' not in current_achievements:
-            achievements.append('wins_50')
-            user_data['achievements'].append('wins_50')
-            
-        # إنجازات المال
-        if user_data['balance'] >= 10000 and 'rich_10k' not in current_achievements:
-            achievements.append('rich_10k')
-            user_data['achievements'].append('rich_10k')
-            
-        # إنجازات المستوى
-        if user_data['level'] >= 10 and 'level_10' not in current_achievements:
-            achievements.append('level_10')
-            user_data['achievements'].append('level_10')
-        
-        if achievements:
-            self.update_user_data(user_id, user_data)
-            achievement_names = {
-                'games_100': '🎮 لاعب محترف - 100 لعبة',
-                'wins_50': '🏆 المنتصر - 50 انتصار',
-                'rich_10k': '💰 الثري - 10,000 كوين',
-                'level_10': '⭐ الخبير - المستوى 10'
-            }
-            return "🏅 إنجاز جديد!\n" + "\n".join([achievement_names.get(a, a) for a in achievements])
-        
-        return ""
-    
-    def is_maintenance_mode(self) -> bool:
-        """التحقق من وضع الصيانة"""
-        return self.settings.get('maintenance_mode', False)
+            logger.error(f"خطأ في حفظ البطولات: {e}")
+
+    def create(self, game: str, starts_at: float, ends_at: float, entry_fee: int, settings) -> Tournament:
+        tournament = Tournament(self._next_id, game, starts_at, ends_at, entry_fee,
+                                settings['tournament_prize_shares'], settings['tournament_house_cut'])
+        self.tournaments[tournament.tournament_id] = tournament
+        self._next_id += 1
+        self._dirty = True
+        # البطولات المنتهية الأقدم تُحذف حتى لا يكبر الملف بلا حد
+        finished = [t.tournament_id for t in self.tournaments.values() if t.status != "open"]
+        for tournament_id in finished[:-TOURNAMENT_HISTORY]:
+            del self.tournaments[tournament_id]
+        return tournament
+
+    def join(self, tournament: Tournament, user_id: int) -> bool:
+        if not tournament.join(user_id):
+            return False
+        self._dirty = True
+        return True
+
+    def open_tournaments(self) -> list:
+        return [t for t in self.tournaments.values() if t.status == "open"]
+
+    def record(self, user_id: int, game: str, net: int):
+        """تُستدعى من كل جولة محسومة - O(عدد البطولات الحية) دون أي فرز"""
+        now = time.time()
+        for tournament in self.tournaments.values():
+            if (tournament.game in (game, "all") and user_id in tournament.scores
+                    and tournament.is_live(now)):
+                self.queue.append((tournament.tournament_id, user_id, net))
+
+    def drain(self, limit: int = TOURNAMENT_DRAIN_BATCH) -> int:
+        """تجميع النتائج المنتظرة لكل بطولة ثم تحديث ترتيبها مرة واحدة"""
+        deltas: Dict[int, Dict[int, int]] = {}
+        drained = 0
+        while self.queue and drained < limit:
+            tournament_id, user_id, net = self.queue.popleft()
+            per_user = deltas.setdefault(tournament_id, {})
+            per_user[user_id] = per_user.get(user_id, 0) + net
+            drained += 1
+        for tournament_id, per_user in deltas.items():
+            tournament = self.tournaments.get(tournament_id)
+            if tournament is not None and tournament.status == "open":
+                tournament.apply(per_user)
+        if drained:
+            self._dirty = True
+        return drained
+
+    def due(self, now: float) -> list:
+        return [t for t in self.tournaments.values() if t.status == "open" and t.ends_at <= now]
+
+    def close(self, tournament: Tournament, status: str = "closed"):
+        tournament.status = status
+        tournament.standings = []
+        self._dirty = True
+
+# ===== شبكة الإحالات =====
+
+class ReferralGraph:
+    """فهرس الإحالات في الذاكرة: الداعي والمدعوون لكل مستخدم بتكلفة O(1) - المصدر يبقى حقل referred_by"""
+
+    def __init__(self):
+        self.referrer: Dict[str, str] = {}
+        self.referees: Dict[str, list] = {}
+        self.subtree_sizes: Dict[str, int] = {}  # تُحدّث من مهمة التحليل الدورية
+        self.suspects: list = []
+
+    def build(self, users):
+        for user_id, user_data in users.items():
+            referrer_id = user_data.get('referred_by')
+            if referrer_id is not None:
+                self.add(user_id, referrer_id)
+
+    def add(self, user_id, referrer_id):
+        user_id, referrer_id = str(user_id), str(referrer_id)
+        self.referrer[user_id] = referrer_id
+        self.referees.setdefault(referrer_id, []).append(user_id)
+
+    def would_cycle(self, user_id, referrer_id) -> bool:
+        """هل يصبح المستخدم جداً لنفسه إذا رُبط بهذا الداعي؟"""
+        user_id, node = str(user_id), str(referrer_id)
+        seen = set()
+        while node is not None and node not in seen:
+            if node == user_id:
+                return True
+            seen.add(node)
+            node = self.referrer.get(node)
+        return False
+
+    def upline(self, user_id, depth: int) -> list:
+        """سلسلة الدعاة حتى العمق المطلوب (للمكافآت متعددة المستويات)"""
+        chain = []
+        node = self.referrer.get(str(user_id))
+        while node is not None and len(chain) < depth and node not in chain:
+            chain.append(node)
+            node = self.referrer.get(node)
+        return chain
+
+    def tree_levels(self, user_id, depth: int) -> list:
+        """عدد المدعوين في كل مستوى من شجرة المستخدم (بحث بالعرض)"""
+        levels = []
+        frontier = [str(user_id)]
+        seen = set(frontier)
+        for _ in range(depth):
+            frontier = [child for node in frontier for child in self.referees.get(node, ()) if child not in seen]
+            if not frontier:
+                break
+            seen.update(frontier)
+            levels.append(len(frontier))
+        return levels
+
+def analyze_referrals(referrer: Dict[str, str], activity: Dict[str, Tuple[int, float]]) -> Dict[str, Any]:
+    """تحليل الشبكة كاملة: أحجام الأشجار، حلقات الإحالة، وتجمعات الحسابات الوهمية - O(N)"""
+    referees: Dict[str, list] = {}
+    for user_id, parent in referrer.items():
+        referees.setdefault(parent, []).append(user_id)
+
+    # الحلقات: لكل عقدة داعٍ واحد على الأكثر، فالمسار يتوقف عند جذر أو يعود لعقدة في نفس المسار
+    state: Dict[str, int] = {}
+    rings = []
+    for start in referrer:
+        path = []
+        node = start
+        while node is not None and node not in state:
+            state[node] = len(path)
+            path.append(node)
+            node = referrer.get(node)
+        if node is not None and state[node] >= 0:
+            rings.append(path[state[node]:])
+        for visited in path:
+            state[visited] = -1
+
+    # أحجام الأشجار من الأوراق نحو الجذور؛ عقد الحلقات لا تصل أبداً إلى صفر أبناء متبقين
+    remaining = {node: len(children) for node, children in referees.items()}
+    sizes: Dict[str, int] = {}
+    queue = [node for node in referrer if node not in remaining]
+    while queue:
+        node = queue.pop()
+        sizes[node] = 1 + sum(sizes[child] for child in referees.get(node, ()))
+        parent = referrer.get(node)
+        if parent is not None:
+            remaining[parent] -= 1
+            if remaining[parent] == 0:
+                queue.append(parent)
 
-# إنشاء كائن البوت المحسن
-game_bot = EnhancedGameBot()
+    # الدعاة المشبوهون: أغلب مدعويهم بلا نشاط أو انضموا دفعة واحدة خلال دقائق
+    flagged = set()
+    for parent, children in referees.items():
+        if len(children) < REFERRAL_FARM_MIN_REFEREES:
+            continue
+        inactive = sum(1 for child in children if activity.get(child, (0, 0))[0] == 0)
+        joins = sorted(activity.get(child, (0, 0))[1] for child in children)
+        burst = max(
+            bisect.bisect_right(joins, joined + REFERRAL_BURST_WINDOW) - i for i, joined in enumerate(joins)
+        )
+        if inactive / len(children) >= REFERRAL_INACTIVE_RATIO or burst >= REFERRAL_FARM_MIN_REFEREES:
+            flagged.add(parent)
+
+    # التجمعات: مكونات مترابطة من الدعاة المشبوهين (سلاسل مزارع الإحالة)
+    clusters = []
+    seen = set()
+    for node in flagged:
+        if node in seen:
+            continue
+        component = []
+        stack = [node]
+        seen.add(node)
+        while stack:
+            current = stack.pop()
+            component.append(current)
+            neighbours = list(referees.get(current, ()))
+            if current in referrer:
+                neighbours.append(referrer[current])
+            for neighbour in neighbours:
+                if neighbour in flagged and neighbour not in seen:
+                    seen.add(neighbour)
+                    stack.append(neighbour)
+        clusters.append({
+            'members': sorted(component),
+            'referees': sum(len(referees.get(member, ())) for member in component),
+        })
+    clusters.sort(key=lambda cluster: cluster['referees'], reverse=True)
+    return {'sizes': sizes, 'rings': rings, 'clusters': clusters}
+
+# ===== تعدد البوتات في عملية واحدة =====
+
+class Tenant:
+    """بوت مستضاف: رمزه ومشرفوه ومجلد بياناته وخدماته التي تحجز أموالاً أو ترسل رسائل
+
+    محركات الألعاب (صندوق البلاك جاك وجداول الروليت) وذاكرة النتائج والمحلل وصيغ الحفظ
+    مشتركة بين كل البوتات، أما المستخدمون والإعدادات والدفتر فمستقلة في مجلد كل بوت.
+    """
+
+    def __init__(self, name: str, token: str, root: str = "", admins=None, rate_limits=None):
+        self.name = name
+        self.token = token
+        self.root = root
+        self.admins = list(admins if admins is not None else ADMIN_IDS)
+        if root:
+            os.makedirs(root, exist_ok=True)
+        self.game_bot = EnhancedGameBot(root)
+        self.metrics = Metrics()
+        self.flood_control = FloodController({**RATE_LIMITS, **(rate_limits or {})})
+        self.outbox = RateLimitedSender()
+        self.reward_scheduler = RewardScheduler(self.path(SCHEDULE_FILE))
+        self.lottery = LotteryEngine(self.path(LOTTERY_FOLDER))
+        self.blackjack_sessions = SessionStore(BLACKJACK_SESSION_TTL, BLACKJACK_MAX_SESSIONS)
+        self.investments = InvestmentBook(self.path(INVESTMENTS_FILE))
+        self.referral_graph = ReferralGraph()
+        self.tournaments = TournamentEngine(self.path(TOURNAMENTS_FILE))
+        self.roulette_tables: Dict[int, Any] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+class TenantLocal:
+    """وكيل لخدمة البوت الحالي - المعالجات والمهام تستخدم game_bot وغيره كأنها كائن واحد"""
+
+    __slots__ = ("_attr",)
+
+    def __init__(self, attr: str):
+        object.__setattr__(self, "_attr", attr)
+
+    def _target(self):
+        return getattr(current_tenant.get(), self._attr)
+
+    def __getattr__(self, name: str):
+        # المسار الأكثر استخداماً: بدون استدعاء _target
+        return getattr(getattr(current_tenant.get(), self._attr), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target(), name, value)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self) -> int:
+        return len(self._target())
+
+    def __bool__(self) -> bool:
+        return bool(self._target())
+
+    def __repr__(self) -> str:
+        return f"<{self._attr} of {current_tenant.get().name}>"
+
+def load_tenants(path: str = TENANTS_FILE) -> list:
+    """البوتات الإضافية من ملف الإعداد - مصفوفة من {name, token, admins?, rate_limits?}"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+
+    loaded = []
+    for entry in entries:
+        name = str(entry['name'])
+        if not name.replace('-', '').replace('_', '').isalnum() or name in tenants:
+            raise ValueError(f"اسم بوت غير صالح أو مكرر: {name}")
+        limits = {}
+        for category, limit in (entry.get('rate_limits') or {}).items():
+            if category not in RATE_LIMITS:
+                raise ValueError(f"{name}: فئة حد غير معروفة {category}")
+            limits[category] = (int(limit[0]), float(limit[1]))
+        tenant = Tenant(name, entry['token'], os.path.join(TENANTS_FOLDER, name), entry.get('admins'), limits)
+        tenants[name] = tenant
+        loaded.append(tenant)
+        logger.info(f"تم تحميل البوت {name}: {len(tenant.game_bot.users_data):,} مستخدم")
+    return loaded
+
+def tenant_job(func):
+    """ديكوريتر للمهام الدورية: تنفيذها في سياق البوت صاحب طابور المهام"""
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        current_tenant.set(context.application.bot_data['tenant'])
+        return await func(context)
+    return wrapper
+
+async def enter_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أول معالج لكل تحديث: تحديد البوت الذي وصل إليه"""
+    current_tenant.set(context.application.bot_data['tenant'])
+
+# البوت الرئيسي (BOT_TOKEN) يعمل في المجلد الحالي كما كان قبل تعدد البوتات
+main_tenant = Tenant("main", BOT_TOKEN)
+tenants: Dict[str, Tenant] = {main_tenant.name: main_tenant}
+current_tenant: ContextVar = ContextVar("current_tenant", default=main_tenant)
+
+# خدمات البوت الحالي
+game_bot = TenantLocal("game_bot")
+metrics = TenantLocal("metrics")
+flood_control = TenantLocal("flood_control")
+outbox = TenantLocal("outbox")
+reward_scheduler = TenantLocal("reward_scheduler")
+lottery = TenantLocal("lottery")
+blackjack_sessions = TenantLocal("blackjack_sessions")
+investments = TenantLocal("investments")
+referral_graph = TenantLocal("referral_graph")
+tournaments = TenantLocal("tournaments")
+roulette_tables = TenantLocal("roulette_tables")
+
+# المشترك بين كل البوتات: محلل الأداء وصندوق البلاك جاك
+profiler = SamplingProfiler()
+blackjack_shoe = Shoe(BLACKJACK_DECKS, BLACKJACK_PENETRATION)
 
 # ===== وظائف مساعدة =====
 
+def user_aggregates() -> Dict[str, int]:
+    """إجماليات كل المستخدمين بما فيهم المؤرشفين"""
+    if isinstance(game_bot.users_data, TieredUserStore):
+        return game_bot.users_data.aggregates()
+    totals = {'users': len(game_bot.users_data), 'banned': 0, 'balance': 0, 'games': 0}
+    for user_data in game_bot.users_data.values():
+        totals['banned'] += bool(user_data.get('is_banned', False))
+        totals['balance'] += user_data.get('balance', 0)
+        totals['games'] += user_data.get('games_played', 0)
+    return totals
+
+def iter_users():
+    """(المعرف، السجل) لكل المستخدمين واحداً تلو الآخر - الطبقة الباردة تُقرأ على صفحات لا دفعة واحدة"""
+    if isinstance(game_bot.users_data, TieredUserStore):
+        yield from game_bot.users_data.items()
+        return
+    # نسخة من المعرفات فقط حتى يُسمح بإضافة مستخدمين أثناء المرور
+    for user_id in list(game_bot.users_data):
+        user_data = game_bot.users_data.get(user_id)
+        if user_data is not None:
+            yield user_id, user_data
+
+def iter_user_balances():
+    """(المعرف، الرصيد) لكل المستخدمين - عمود الرصيد في الطبقة الباردة يغني عن تحميل السجلات"""
+    if isinstance(game_bot.users_data, TieredUserStore):
+        return game_bot.users_data.balances()
+    return ((user_id, user_data.get('balance', 0)) for user_id, user_data in iter_users())
+
+def record_game_result(user_id: int, game: str, bet: int, net: int):
+    """تسجيل جولة محسومة في التحليلات وطابور البطولات"""
+    game_bot.analytics.record_game(user_id, game, bet, net)
+    tournaments.record(user_id, game, net)
+
 def is_admin(user_id: int) -> bool:
     """التحقق من صلاحية الإدمن"""
-    return user_id in ADMIN_IDS
+    return user_id in current_tenant.get().admins
 
 def admin_only(func):
     """ديكوريتر للأوامر المقتصرة على الإدمن"""
@@ -291,6 +3805,8 @@ def ban_check(func):
     """ديكوريتر للتحقق من حظر المستخدم"""
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_data = game_bot.get_user_data(update.effective_user.id)
+        if game_bot.lift_expired_ban(user_data):
+            game_bot.save_data()
         if user_data.get('is_banned', False) and not is_admin(update.effective_user.id):
             ban_reason = user_data.get('ban_reason', 'غير محدد')
             ban_date = user_data.get('ban_date', 'غير محدد')
@@ -316,6 +3832,50 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         except Exception as e:
             logger.error(f"فشل في إرسال رسالة الخطأ: {e}")
 
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حارس الإغراق: يعمل قبل كل المعالجات ويوقف التحديثات الزائدة"""
+    user = update.effective_user
+    if user is None or is_admin(user.id):
+        return
+    category = classify_update(update)
+    if category is None:
+        return
+
+    if update.message and update.message.date:
+        flood_control.observe_latency(update.message.date.timestamp(), time.time())
+        metrics.set("flood.queue_latency", flood_control.queue_latency)
+
+    # تخفيف الحمل العام
+    level = flood_control.load_level
+    if level >= 2 or (level == 1 and category == "messages"):
+        metrics.inc(f"flood.shed.{category}")
+        raise ApplicationHandlerStop
+
+    if flood_control.allow(user.id, category, time.monotonic()):
+        return
+
+    metrics.inc(f"flood.throttled.{category}")
+    strikes = flood_control.strike(user.id, time.monotonic())
+    try:
+        if strikes >= FLOOD_STRIKES_TO_BAN:
+            flood_control.forgive(user.id)
+            game_bot.temporary_ban(user.id, "إغراق البوت بالطلبات (حظر تلقائي)", FLOOD_BAN_MINUTES)
+            metrics.inc("flood.bans")
+            logger.warning(f"حظر مؤقت للمستخدم {user.id} بسبب الإغراق")
+            if update.effective_message:
+                await update.effective_message.reply_text(
+                    f"🚫 تم حظرك مؤقتاً لمدة {FLOOD_BAN_MINUTES} دقيقة بسبب الإرسال المفرط!"
+                )
+        elif strikes == 1:
+            # تنبيه واحد فقط لكل نافذة حتى لا يتحول التنبيه نفسه إلى إغراق
+            if update.callback_query:
+                await update.callback_query.answer("⏳ مهلاً! حاول بعد قليل.")
+            elif category not in ("messages", "inline"):
+                await update.message.reply_text("⏳ مهلاً! أنت ترسل بسرعة كبيرة، حاول بعد قليل.")
+    except TelegramError as e:
+        logger.error(f"فشل في إرسال تنبيه الإغراق: {e}")
+    raise ApplicationHandlerStop
+
 async def log_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تسجيل جميع الرسائل"""
     if update.message and update.message.text and not update.message.text.startswith('/'):
@@ -328,8 +3888,46 @@ async def log_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
             update.message.text
         )
 
+async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تحديث دليل المستخدمين من كل التحديثات (مقارنة O(1) ولا كتابة إلا عند تغير الاسم)"""
+    user = update.effective_user
+    if user is not None:
+        game_bot.directory.update(user.id, user.username, user.first_name, user.last_name)
+
 # ===== الأوامر الأساسية =====
 
+def register_referral(user_id: int, user_data: Dict[str, Any], referrer_id: int) -> str:
+    """ربط مستخدم لم يلعب بعد بداعٍ مسجل وصرف مكافآت كل المستويات في قيد واحد وحفظ واحد"""
+    referrer_data = game_bot.users_data.get(str(referrer_id))
+    if (referrer_id == user_id or referrer_data is None or referrer_data.get('is_banned')
+            or user_data.get('referred_by') or user_data.get('games_played')
+            or referral_graph.would_cycle(user_id, referrer_id)):
+        return ""
+
+    rewards = game_bot.settings['referral_rewards']
+    chain = [str(referrer_id)] + referral_graph.upline(referrer_id, len(rewards) - 1)
+    tiers = [(ancestor, reward) for ancestor, reward in zip(chain, rewards) if ancestor in game_bot.users_data]
+    welcome = game_bot.settings['welcome_bonus']
+    postings = [(user_account(user_id), welcome)] + [(user_account(ancestor), reward) for ancestor, reward in tiers]
+    postings.append((REWARDS_ACCOUNT, -sum(amount for _, amount in postings)))
+    if game_bot.ledger.post("referral", postings, key=f"referral:{user_id}") is None:
+        return ""
+
+    referral_graph.add(user_id, referrer_id)
+    user_data['referred_by'] = referrer_id
+    user_data['balance'] += welcome
+    referrer_data['referral_count'] += 1
+    for tier, (ancestor, reward) in enumerate(tiers, 1):
+        game_bot.users_data[ancestor]['balance'] += reward
+        outbox.enqueue(int(ancestor), f"👥 انضم عضو جديد إلى شبكتك (المستوى {tier})! +{reward:,} كوين")
+
+    achievement_msg = game_bot.check_achievements(referrer_id, referrer_data, ('referral_count', 'balance'))
+    if achievement_msg:
+        outbox.enqueue(referrer_id, achievement_msg)
+    game_bot.save_data()
+    metrics.inc("referrals.registered")
+    return f"\n🎉 تم قبول دعوتك! حصلت على {welcome} كوين إضافية!"
+
 @maintenance_check
 @ban_check
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -339,19 +3937,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # تحقق من الدعوة
     referral_bonus = ""
-    if context.args and len(context.args) > 0:
+    if context.args:
         try:
-            referrer_id = int(context.args[0])
-            if referrer_id != user.id and not user_data.get('referred_by'):
-                referrer_data = game_bot.get_user_data(referrer_id)
-                referrer_data['referral_count'] += 1
-                referrer_data['balance'] += 100  # مكافأة الداعي
-                user_data['referred_by'] = referrer_id
-                user_data['balance'] += game_bot.settings['welcome_bonus']
-                game_bot.update_user_data(referrer_id, referrer_data)
-                game_bot.update_user_data(user.id, user_data)
-                referral_bonus = f"\n🎉 تم قبول دعوتك! حصلت على {game_bot.settings['welcome_bonus']} كوين إضافية!"
-        except (ValueError, IndexError):
+            referral_bonus = register_referral(user.id, user_data, int(context.args[0]))
+        except ValueError:
             pass
     
     welcome_text = f"""
@@ -382,6 +3971,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • /stats - إحصائياتك الشخصية
 • /leaderboard - لوحة المتصدرين
 • /achievements - إنجازاتك
+• /tournament - البطولات
 • /referral - نظام الإحالة
 
 {referral_bonus}
@@ -466,6 +4056,7 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @maintenance_check  
 @ban_check
+@hot_path("cmd:daily")
 async def daily_reward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """المكافأة اليومية المحسنة"""
     user_id = update.effective_user.id
@@ -473,6 +4064,7 @@ async def daily_reward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     now = datetime.now()
     last_daily = user_data.get('last_daily')
+    previous_streak = user_data['daily_streak']
     
     if last_daily:
         last_daily_date = datetime.fromisoformat(last_daily)
@@ -515,21 +4107,27 @@ async def daily_reward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     total_reward = base_reward + streak_bonus + level_bonus + vip_bonus
     
-    user_data['balance'] += total_reward
+    if not game_bot.adjust_balance(user_id, user_data, total_reward, "daily", REWARDS_ACCOUNT,
+                                   key=f"daily:{user_id}:{now.strftime('%Y-%m-%d')}"):
+        # طلب مكرر (ضغطتان متتاليتان مثلاً) - المكافأة قُيدت في الطلب الأول
+        user_data['daily_streak'] = previous_streak
+        await update.message.reply_text("⏰ لقد استلمت مكافأتك اليومية بالفعل!")
+        return
+    game_bot.analytics.record(ANALYTICS_DAILY, user_id, net=total_reward)
     user_data['last_daily'] = now.isoformat()
     user_data['exp'] += 5
     
     # فحص رفع المستوى
     level_up_msg = ""
-    if user_data['exp'] >= game_bot.calculate_level_up_exp(user_data['level']):
-        user_data['level'] += 1
-        user_data['balance'] += game_bot.settings['level_up_bonus']
-        level_up_msg = f"\n🆙 <b>تهانينا! ارتقيت للمستوى {user_data['level']}!</b>\n💰 مكافأة: +{game_bot.settings['level_up_bonus']} كوين"
+    old_level, new_level, level_bonus = game_bot.apply_level_ups(user_id, user_data)
+    if new_level > old_level:
+        level_up_msg = f"\n🆙 <b>تهانينا! ارتقيت للمستوى {new_level}!</b>\n💰 مكافأة: +{level_bonus} كوين"
     
     # فحص الإنجازات
-    achievement_msg = game_bot.check_achievements(user_id, user_data)
+    achievement_msg = game_bot.check_achievements(user_id, user_data, ('balance', 'level', 'daily_streak'))
     
     game_bot.update_user_data(user_id, user_data)
+    reward_scheduler.schedule_user(str(user_id), user_data)
     
     reward_text = f"""
 🎁 <b>المكافأة اليومية!</b>
@@ -550,16 +4148,318 @@ async def daily_reward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(reward_text, parse_mode='HTML')
 
+@maintenance_check
+@ban_check
+async def transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تحويل الأموال بين المستخدمين مع رسوم"""
+    fee_rate = game_bot.settings['transfer_fee']
+    if len(context.args) < 2:
+        await update.message.reply_text(
+            f"💸 <b>تحويل الأموال</b>\n\n"
+            f"📝 <b>الاستخدام:</b> /transfer <معرف المستلم> <المبلغ>\n"
+            f"💰 <b>الحد الأدنى:</b> {game_bot.settings['min_transfer']} كوين\n"
+            f"🧾 <b>الرسوم:</b> {fee_rate * 100:.1f}% تخصم من المبلغ المحول",
+            parse_mode='HTML'
+        )
+        return
+
+    try:
+        recipient_id = int(context.args[0])
+        amount = int(context.args[1])
+    except ValueError:
+        await update.message.reply_text("❌ المعرف والمبلغ يجب أن يكونا أرقاماً!")
+        return
+
+    sender_id = update.effective_user.id
+    if recipient_id == sender_id:
+        await update.message.reply_text("❌ لا يمكنك التحويل لنفسك!")
+        return
+    if amount < game_bot.settings['min_transfer']:
+        await update.message.reply_text(f"❌ الحد الأدنى للتحويل {game_bot.settings['min_transfer']} كوين!")
+        return
+
+    # المستلم يجب أن يكون مستخدماً مسجلاً (بدون إنشاء سجل جديد)
+    recipient_data = game_bot.users_data.get(str(recipient_id))
+    if recipient_data is None:
+        await update.message.reply_text("❌ المستخدم المستلم غير موجود!")
+        return
+    if recipient_data.get('is_banned'):
+        await update.message.reply_text("❌ لا يمكن التحويل لمستخدم محظور!")
+        return
+
+    sender_data = game_bot.get_user_data(sender_id)
+    if amount > sender_data['balance']:
+        await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {sender_data['balance']:,} كوين")
+        return
+
+    fee = math.ceil(amount * fee_rate)
+    if not game_bot.transfer_funds(sender_id, sender_data, recipient_id, recipient_data,
+                                   amount, fee, key=f"transfer:{update.update_id}"):
+        await update.message.reply_text("⚠️ تمت معالجة هذا التحويل مسبقاً")
+        return
+
+    await update.message.reply_text(
+        f"✅ <b>تم التحويل بنجاح!</b>\n\n"
+        f"👤 <b>المستلم:</b> {recipient_id}\n"
+        f"💸 <b>المبلغ:</b> {amount:,} كوين\n"
+        f"🧾 <b>الرسوم:</b> {fee:,} كوين\n"
+        f"📥 <b>وصل للمستلم:</b> {amount - fee:,} كوين\n"
+        f"💳 <b>رصيدك:</b> {sender_data['balance']:,} كوين",
+        parse_mode='HTML'
+    )
+    outbox.enqueue(recipient_id, f"💰 استلمت {amount - fee:,} كوين من المستخدم {sender_id}!")
+
+def investment_overview(user_id: int) -> str:
+    """الخطط المتاحة ومراكز المستخدم بقيمتها الحالية"""
+    now = time.time()
+    plans = "\n".join(
+        f"• <b>{name}</b>: {plan['days']} يوم بفائدة {plan['daily_rate'] * 100:.1f}% يومياً"
+        for name, plan in game_bot.settings['investment_plans'].items()
+    )
+    positions = "\n".join(
+        f"#{p.position_id}: {p.principal:,} ← {p.value_at(now):,} كوين "
+        f"(الاستحقاق {datetime.fromtimestamp(p.matures_at).strftime('%Y-%m-%d %H:%M')})"
+        for p in investments.user_positions(user_id)
+    ) or "لا توجد استثمارات نشطة"
+    return (
+        f"📈 <b>الاستثمار</b>\n\n"
+        f"📋 <b>الخطط:</b>\n{plans}\n\n"
+        f"💼 <b>استثماراتك:</b>\n{positions}\n\n"
+        f"📝 <b>الاستخدام:</b> /invest <الخطة> <المبلغ>\n"
+        f"💰 <b>الحد الأدنى:</b> {game_bot.settings['min_investment']:,} كوين"
+    )
+
+@maintenance_check
+@ban_check
+async def invest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """فتح استثمار بفائدة مركبة يُصرف تلقائياً عند الاستحقاق"""
+    user_id = update.effective_user.id
+    if len(context.args) < 2:
+        await update.message.reply_text(investment_overview(user_id), parse_mode='HTML')
+        return
+
+    plan = game_bot.settings['investment_plans'].get(context.args[0].lower())
+    if plan is None:
+        await update.message.reply_text(
+            f"❌ خطة غير معروفة! الخطط: {'، '.join(game_bot.settings['investment_plans'])}"
+        )
+        return
+
+    try:
+        amount = int(context.args[1])
+    except ValueError:
+        await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
+        return
+
+    if amount < game_bot.settings['min_investment']:
+        await update.message.reply_text(f"❌ الحد الأدنى للاستثمار {game_bot.settings['min_investment']:,} كوين!")
+        return
+
+    if len(investments.by_user.get(user_id, ())) >= game_bot.settings['max_investments']:
+        await update.message.reply_text(f"❌ الحد الأقصى {game_bot.settings['max_investments']} استثمارات نشطة!")
+        return
+
+    user_data = game_bot.get_user_data(user_id)
+    if amount > user_data['balance']:
+        await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين")
+        return
+
+    if not game_bot.adjust_balance(user_id, user_data, -amount, "invest:open",
+                                   INVESTMENT_ACCOUNT, key=f"invest:{update.update_id}"):
+        return
+    position = investments.open(user_id, amount, plan['daily_rate'], plan['days'], time.time())
+    investments.save()
+    game_bot.save_data()
+    metrics.inc("investments.opened")
+
+    await update.message.reply_text(
+        f"✅ <b>تم فتح الاستثمار #{position.position_id}</b>\n\n"
+        f"💰 <b>المبلغ:</b> {amount:,} كوين\n"
+        f"📅 <b>المدة:</b> {plan['days']} يوم\n"
+        f"📈 <b>القيمة عند الاستحقاق:</b> {position.value_at(position.matures_at):,} كوين\n"
+        f"💳 <b>رصيدك:</b> {user_data['balance']:,} كوين",
+        parse_mode='HTML'
+    )
+
+TOURNAMENT_GAME_NAMES = {"roulette": "الروليت", "slots": "السلوت", "dice": "النرد", "coinflip": "العملة",
+                         "blackjack": "البلاك جاك", "all": "كل الألعاب"}
+
+def tournament_overview(user_id: int) -> str:
+    """البطولات المفتوحة والقادمة مع ترتيب المستخدم في كل منها"""
+    now = time.time()
+    lines = []
+    for tournament in tournaments.open_tournaments():
+        state = "🟢 جارية" if tournament.is_live(now) else "⏳ قادمة"
+        rank = tournament.rank_of(user_id)
+        mine = (f"\n   📍 ترتيبك: {rank:,} من {len(tournament.scores):,} ({tournament.scores[user_id]:+,})"
+                if rank else "")
+        lines.append(
+            f"🏆 <b>#{tournament.tournament_id}</b> - {TOURNAMENT_GAME_NAMES[tournament.game]} {state}\n"
+            f"   🕐 {datetime.fromtimestamp(tournament.starts_at).strftime('%m-%d %H:%M')} ← "
+            f"{datetime.fromtimestamp(tournament.ends_at).strftime('%m-%d %H:%M')}\n"
+            f"   🎟️ الدخول: {tournament.entry_fee:,} - 👥 {len(tournament.scores):,} - 💰 {tournament.pot:,} كوين{mine}"
+        )
+    body = "\n\n".join(lines) or "لا توجد بطولات مفتوحة حالياً"
+    return (
+        f"🏆 <b>البطولات</b>\n\n{body}\n\n"
+        f"📝 /tournament join <رقم> - الاشتراك\n"
+        f"📊 /tournament <رقم> - الترتيب الحالي\n"
+        f"🎯 النتيجة = صافي ربحك في ألعاب البطولة خلال مدتها"
+    )
+
+def tournament_standings(tournament: Tournament, user_id: int) -> str:
+    """المتصدرون والترتيب الحي للمستخدم، أو النتائج النهائية للبطولة المنتهية"""
+    title = f"🏆 <b>البطولة #{tournament.tournament_id} - {TOURNAMENT_GAME_NAMES[tournament.game]}</b>\n\n"
+    if tournament.status != "open":
+        if tournament.status == "cancelled":
+            return title + "❌ أُلغيت البطولة وأُعيدت رسوم الدخول"
+        winners = "\n".join(f"{entry['rank']}. {html.escape(game_bot.directory.display_name(entry['user_id']))} "
+                            f"({entry['score']:+,}) - {entry['prize']:,} كوين" for entry in tournament.results)
+        return title + (f"🏁 <b>النتائج النهائية:</b>\n{winners}" if winners else "🏁 انتهت دون مشاركين")
+    leaders = "\n".join(f"{rank}. {html.escape(game_bot.directory.display_name(leader))} ({score:+,})"
+                        for rank, (leader, score) in enumerate(tournament.top(TOURNAMENT_STANDINGS_SHOWN), 1))
+    rank = tournament.rank_of(user_id)
+    mine = f"\n\n📍 <b>ترتيبك:</b> {rank:,} من {len(tournament.scores):,}" if rank else ""
+    awards, _ = tournament.prizes()
+    prizes = "، ".join(f"{prize:,}" for _, _, prize in awards)
+    return (title + f"{leaders or 'لا يوجد مشاركون بعد'}{mine}\n\n"
+            f"💰 <b>الجوائز الحالية:</b> {prizes or '-'} كوين\n"
+            f"⏰ <b>تنتهي:</b> {datetime.fromtimestamp(tournament.ends_at).strftime('%Y-%m-%d %H:%M')}")
+
+@maintenance_check
+@ban_check
+async def tournament_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض البطولات والاشتراك فيها، وإنشاؤها أو إلغاؤها للمشرفين"""
+    user_id = update.effective_user.id
+    args = [arg.lower() for arg in context.args]
+    if not args:
+        await update.message.reply_text(tournament_overview(user_id), parse_mode='HTML')
+        return
+
+    if args[0] in ("create", "cancel"):
+        if not is_admin(user_id):
+            await update.message.reply_text("❌ هذا الأمر للمشرفين فقط!")
+            return
+        if args[0] == "create":
+            await create_tournament(update, args[1:])
+        else:
+            await cancel_tournament(update, args[1:])
+        return
+
+    try:
+        tournament = tournaments.tournaments.get(int(args[-1]))
+    except ValueError:
+        tournament = None
+    if tournament is None:
+        await update.message.reply_text("❌ بطولة غير موجودة! اكتب /tournament لعرض البطولات")
+        return
+
+    if args[0] != "join":
+        await update.message.reply_text(tournament_standings(tournament, user_id), parse_mode='HTML')
+        return
+
+    if tournament.status != "open" or time.time() >= tournament.ends_at:
+        await update.message.reply_text("❌ انتهى التسجيل في هذه البطولة!")
+        return
+    if user_id in tournament.scores:
+        await update.message.reply_text("✅ أنت مشترك بالفعل في هذه البطولة!")
+        return
+    user_data = game_bot.get_user_data(user_id)
+    entry_key = f"tournament:{tournament.tournament_id}:entry:{user_id}"
+    # رسوم مقيدة سابقاً دون حفظ الاشتراك (توقف بين الخطوتين) تُكمل الاشتراك ولا تُخصم مرة ثانية
+    if not game_bot.ledger.has_key(entry_key):
+        if tournament.entry_fee > user_data['balance']:
+            await update.message.reply_text(f"❌ رصيدك غير كافي! رسوم الدخول {tournament.entry_fee:,} كوين")
+            return
+        game_bot.adjust_balance(user_id, user_data, -tournament.entry_fee, "tournament:entry", TOURNAMENT_ACCOUNT,
+                                key=entry_key)
+    tournaments.join(tournament, user_id)
+    tournaments.save()
+    game_bot.save_data()
+    metrics.inc("tournaments.entries")
+    await update.message.reply_text(
+        f"✅ <b>تم اشتراكك في البطولة #{tournament.tournament_id}</b>\n\n"
+        f"🎮 {TOURNAMENT_GAME_NAMES[tournament.game]} - 👥 {len(tournament.scores):,} مشترك\n"
+        f"💳 <b>رصيدك:</b> {user_data['balance']:,} كوين",
+        parse_mode='HTML'
+    )
+
+async def create_tournament(update: Update, args: list):
+    """/tournament create <اللعبة> <الساعات> <رسوم الدخول> [بعد كم دقيقة تبدأ]"""
+    usage = ("📝 <b>الاستخدام:</b> /tournament create <اللعبة> <الساعات> <رسوم الدخول> [تبدأ بعد دقائق]\n"
+             f"🎮 الألعاب: {', '.join(TOURNAMENT_GAMES)}")
+    if len(args) < 3 or args[0] not in TOURNAMENT_GAMES:
+        await update.message.reply_text(usage, parse_mode='HTML')
+        return
+    try:
+        hours = float(args[1])
+        entry_fee = int(args[2])
+        delay = int(args[3]) if len(args) > 3 else 0
+    except ValueError:
+        await update.message.reply_text(usage, parse_mode='HTML')
+        return
+    if not 0 < hours <= TOURNAMENT_MAX_HOURS or entry_fee < 0 or delay < 0:
+        await update.message.reply_text(f"❌ المدة بين 0 و{TOURNAMENT_MAX_HOURS} ساعة والرسوم والتأخير غير سالبين!")
+        return
+    starts_at = time.time() + delay * 60
+    tournament = tournaments.create(args[0], starts_at, starts_at + hours * 3600, entry_fee, game_bot.settings)
+    tournaments.save()
+    await update.message.reply_text(
+        f"✅ تم إنشاء البطولة #{tournament.tournament_id} ({TOURNAMENT_GAME_NAMES[tournament.game]})\n"
+        f"📝 للاشتراك: /tournament join {tournament.tournament_id}"
+    )
+
+async def cancel_tournament(update: Update, args: list):
+    """إلغاء بطولة مفتوحة وإعادة رسوم الدخول على دفعات"""
+    try:
+        tournament = tournaments.tournaments.get(int(args[0]))
+    except (IndexError, ValueError):
+        tournament = None
+    if tournament is None or tournament.status != "open":
+        await update.message.reply_text("❌ لا توجد بطولة مفتوحة بهذا الرقم!")
+        return
+    refund_tournament(tournament)
+    await update.message.reply_text(f"✅ أُلغيت البطولة #{tournament.tournament_id} وأُعيدت رسوم {len(tournament.scores):,} مشترك")
+
+def referral_overview(user_id: int, bot_username: str) -> str:
+    """رابط الدعوة ومكافآت المستويات وإحصائيات شجرة المستخدم"""
+    rewards = game_bot.settings['referral_rewards']
+    levels = referral_graph.tree_levels(user_id, len(rewards))
+    # حجم الشبكة الكاملة محسوب دفعة واحدة في مهمة التحليل الدورية
+    network = max(referral_graph.subtree_sizes.get(str(user_id), 1) - 1, sum(levels))
+    referred_by = referral_graph.referrer.get(str(user_id))
+
+    reward_lines = "\n".join(f"• المستوى {tier}: {reward:,} كوين" for tier, reward in enumerate(rewards, 1))
+    level_lines = "\n".join(f"• المستوى {tier}: {count:,} عضو" for tier, count in enumerate(levels, 1)) or "لا يوجد مدعوون بعد"
+    return (
+        f"👥 <b>نظام الإحالة</b>\n\n"
+        f"🔗 <b>رابط دعوتك:</b>\n<code>https://t.me/{bot_username}?start={user_id}</code>\n\n"
+        f"🎁 <b>مكافآت الدعوة:</b>\n{reward_lines}\n"
+        f"• صديقك يحصل على {game_bot.settings['welcome_bonus']:,} كوين\n\n"
+        f"📊 <b>شبكتك:</b>\n{level_lines}\n"
+        f"🌐 <b>إجمالي الشبكة:</b> {network:,} عضو"
+        + (f"\n\n👤 <b>دعاك:</b> {referred_by}" if referred_by else "")
+    )
+
+@maintenance_check
+@ban_check
+async def referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض نظام الإحالة وشجرة المدعوين"""
+    await update.message.reply_text(
+        referral_overview(update.effective_user.id, context.bot.username), parse_mode='HTML'
+    )
+
 # ===== أوامر الإدمن المتقدمة =====
 
 @admin_only
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """لوحة تحكم المشرف المتقدمة"""
-    total_users = len(game_bot.users_data)
-    active_users = sum(1 for u in game_bot.users_data.values() if not u.get('is_banned', False))
-    banned_users = total_users - active_users
-    total_balance = sum(u.get('balance', 0) for u in game_bot.users_data.values())
-    total_games = sum(u.get('games_played', 0) for u in game_bot.users_data.values())
+    totals = user_aggregates()
+    total_users = totals['users']
+    banned_users = totals['banned']
+    active_users = total_users - banned_users
+    total_balance = totals['balance']
+    total_games = totals['games']
     total_messages = sum(u.get('message_count', 0) for u in game_bot.messages_log.values())
     
     admin_text = f"""
@@ -577,15 +4477,25 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 🛠️ <b>الأوامر المتاحة:</b>
 /settings - إعدادات البوت
-/userinfo <المعرف> - معلومات مستخدم
+/userinfo <المعرف أو @الاسم> - معلومات مستخدم
 /usermessages <المعرف> - رسائل المستخدم
 /ban <المعرف> <السبب> - حظر مستخدم
 /unban <المعرف> - إلغاء حظر
 /addmoney <المعرف> <المبلغ> - إضافة أموال
 /removemoney <المعرف> <المبلغ> - خصم أموال
+/bulk <ban|unban|credit|debit|vip> [القيمة] - عملية جماعية من ملف CSV
+/export <users|messages> - تصدير CSV مضغوط
 /broadcast <الرسالة> - رسالة جماعية
 /backup - نسخة احتياطية
 /stats_admin - إحصائيات تفصيلية
+/profile start|stop - محلل الأداء
+/vip <المعرف> <الأيام|off> - عضوية VIP
+/backfill_achievements - منح الإنجازات الجديدة للجميع
+/metrics - مقاييس التشغيل
+/reconcile [fix] - مطابقة دفتر القيود
+/audit <المعرف|verify> - سجل تدقيق الجولات
+/search - البحث في الرسائل
+/find - البحث عن مستخدم
 """
     
     keyboard = [
@@ -602,6 +4512,36 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(admin_text, reply_markup=reply_markup, parse_mode='HTML')
 
+SETTINGS_ALIASES = {"maintenance": "maintenance_mode", "daily_min": "daily_reward_min", "daily_max": "daily_reward_max"}
+
+def parse_setting_value(key: str, args: list):
+    """تحويل وسائط الأمر إلى قيمة بنوع الإعداد في المخطط - ValueError عند الفشل"""
+    expected = SETTINGS_SCHEMA[key]
+    raw = " ".join(args)
+    if expected is bool:
+        mode = raw.lower()
+        if mode in ('on', 'true', '1', 'نعم'):
+            return True
+        if mode in ('off', 'false', '0', 'لا'):
+            return False
+        raise ValueError("استخدم on أو off")
+    try:
+        if expected is int:
+            return int(raw)
+        if expected is float:
+            return float(raw[:-1]) / 100 if raw.endswith('%') else float(raw)
+    except ValueError:
+        raise ValueError("يجب أن تكون القيمة رقماً")
+    if expected is str:
+        return raw
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        raise ValueError("صيغة JSON غير صحيحة")
+    if not isinstance(value, expected):
+        raise ValueError(f"يجب أن تكون القيمة من النوع {expected.__name__}")
+    return value
+
 @admin_only
 async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إعدادات البوت"""
@@ -617,6 +4557,7 @@ async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🆙 <b>مكافأة رفع المستوى:</b> {game_bot.settings['level_up_bonus']} كوين
 💸 <b>رسوم التحويل:</b> {game_bot.settings['transfer_fee']*100:.1f}%
 🎉 <b>مكافأة الترحيب:</b> {game_bot.settings['welcome_bonus']} كوين
+🔢 <b>إصدار الإعدادات:</b> {game_bot.settings.version}
 
 📝 <b>الاستخدام:</b>
 /settings maintenance on/off - تفعيل/إلغاء الصيانة
@@ -624,57 +4565,59 @@ async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /settings max_bet <رقم> - تغيير الحد الأقصى
 /settings daily_min <رقم> - أقل مكافأة يومية
 /settings daily_max <رقم> - أكبر مكافأة يومية
+/settings <مفتاح> <قيمة> - أي إعداد آخر (القوائم والقواميس بصيغة JSON)
 """
         await update.message.reply_text(settings_text, parse_mode='HTML')
         return
     
-    setting = context.args[0].lower()
+    key = context.args[0].lower()
+    key = SETTINGS_ALIASES.get(key, key)
+    if key not in SETTINGS_SCHEMA or len(context.args) < 2:
+        await update.message.reply_text("❌ إعداد غير معروف أو قيمة مفقودة! اكتب /settings لعرض الاستخدام")
+        return
     
-    if setting == "maintenance":
-        if len(context.args) > 1:
-            mode = context.args[1].lower()
-            if mode in ['on', 'true', '1', 'نعم']:
-                game_bot.settings['maintenance_mode'] = True
-                await update.message.reply_text("🔧 تم تفعيل وضع الصيانة!")
-            elif mode in ['off', 'false', '0', 'لا']:
-                game_bot.settings['maintenance_mode'] = False
-                await update.message.reply_text("✅ تم إلغاء وضع الصيانة!")
-            game_bot.save_settings()
-    
-    elif setting == "min_bet" and len(context.args) > 1:
-        try:
-            new_value = int(context.args[1])
-            if new_value > 0:
-                game_bot.settings['min_bet'] = new_value
-                game_bot.save_settings()
-                await update.message.reply_text(f"✅ تم تغيير الحد الأدنى إلى {new_value} كوين")
-        except ValueError:
-            await update.message.reply_text("❌ قيمة غير صحيحة!")
+    try:
+        value = parse_setting_value(key, context.args[1:])
+        snapshot = game_bot.settings_store.update({key: value})
+    except ValueError as e:
+        await update.message.reply_text(f"❌ قيمة غير صحيحة: {html.escape(str(e))}")
+        return
+    except OSError as e:
+        logger.error(f"خطأ في حفظ الإعدادات: {e}")
+        await update.message.reply_text("❌ تعذر حفظ الإعدادات!")
+        return
     
-    elif setting == "max_bet" and len(context.args) > 1:
-        try:
-            new_value = int(context.args[1])
-            if new_value > game_bot.settings['min_bet']:
-                game_bot.settings['max_bet'] = new_value
-                game_bot.save_settings()
-                await update.message.reply_text(f"✅ تم تغيير الحد الأقصى إلى {new_value:,} كوين")
-        except ValueError:
-            await update.message.reply_text("❌ قيمة غير صحيحة!")
+    metrics.set("settings.version", snapshot.version)
+    if key == 'maintenance_mode':
+        await update.message.reply_text("🔧 تم تفعيل وضع الصيانة!" if value else "✅ تم إلغاء وضع الصيانة!")
+    else:
+        await update.message.reply_text(f"✅ تم تغيير {key} إلى {html.escape(json.dumps(value, ensure_ascii=False))} "
+                                        f"(الإصدار {snapshot.version})")
 
 @admin_only
 async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معلومات مستخدم محسنة"""
     if not context.args:
-        await update.message.reply_text("📝 <b>الاستخدام:</b> /userinfo <معرف المستخدم>", parse_mode='HTML')
+        await update.message.reply_text("📝 <b>الاستخدام:</b> /userinfo <معرف المستخدم أو @اسم_المستخدم>", parse_mode='HTML')
         return
     
-    try:
-        user_id = int(context.args[0])
-    except ValueError:
-        await update.message.reply_text("❌ معرف المستخدم يجب أن يكون رقماً!")
-        return
+    if context.args[0].startswith("@"):
+        found = game_bot.directory.find_username(context.args[0])
+        if found is None:
+            await update.message.reply_text("❌ لا يوجد مستخدم بهذا الاسم! جرّب /find")
+            return
+        user_id = int(found)
+    else:
+        try:
+            user_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ معرف المستخدم يجب أن يكون رقماً أو @اسم_المستخدم!")
+            return
     
-    user_data = game_bot.get_user_data(user_id)
+    if str(user_id) not in game_bot.users_data:
+        await update.message.reply_text("❌ المستخدم غير موجود!")
+        return
+    user_data = game_bot.get_user_data(user_id, touch=False)
     message_data = game_bot.messages_log.get(str(user_id), {})
     
     # حساب الإحصائيات المتقدمة
@@ -743,25 +4686,1089 @@ async def user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
 
-# ===== الألعاب المحسنة =====
+async def admin_adjust_money(update: Update, context: ContextTypes.DEFAULT_TYPE, sign: int):
+    """إضافة أو خصم أموال من مستخدم مع قيد في الدفتر"""
+    command = "addmoney" if sign > 0 else "removemoney"
+    if len(context.args) < 2:
+        await update.message.reply_text(f"📝 <b>الاستخدام:</b> /{command} <المعرف> <المبلغ>", parse_mode='HTML')
+        return
 
-@maintenance_check
-@ban_check
-async def roulette_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """لعبة الروليت المحسنة"""
+    try:
+        user_id = int(context.args[0])
+        amount = int(context.args[1])
+    except ValueError:
+        await update.message.reply_text("❌ المعرف والمبلغ يجب أن يكونا أرقاماً!")
+        return
+
+    user_data = game_bot.users_data.get(str(user_id))
+    if user_data is None:
+        await update.message.reply_text("❌ المستخدم غير موجود!")
+        return
+    if amount <= 0 or (sign < 0 and amount > user_data['balance']):
+        await update.message.reply_text(f"❌ مبلغ غير صحيح! رصيد المستخدم: {user_data['balance']:,} كوين")
+        return
+
+    if not game_bot.adjust_balance(user_id, user_data, sign * amount, f"admin:{command}",
+                                   ADMIN_ACCOUNT, key=f"admin:{update.update_id}"):
+        await update.message.reply_text("⚠️ تمت معالجة هذه العملية مسبقاً")
+        return
+    game_bot.save_data()
+    logger.info(f"المشرف {update.effective_user.id} نفذ {command} {amount} للمستخدم {user_id}")
+    await update.message.reply_text(
+        f"✅ تم {'إضافة' if sign > 0 else 'خصم'} {amount:,} كوين\n"
+        f"💳 رصيد المستخدم الآن: {user_data['balance']:,} كوين"
+    )
+
+@admin_only
+async def add_money(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إضافة أموال لمستخدم"""
+    await admin_adjust_money(update, context, 1)
+
+@admin_only
+async def remove_money(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """خصم أموال من مستخدم"""
+    await admin_adjust_money(update, context, -1)
+
+# ===== العمليات الجماعية والتصدير =====
+
+def parse_bulk_rows(lines) -> Iterator[Tuple[str, Optional[str]]]:
+    """صفوف (المعرف، القيمة) من CSV أو قائمة معرفات - الصفوف غير الرقمية كسطر العناوين تُتخطى"""
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        user_id = row[0].strip()
+        if not user_id.isdigit():
+            continue
+        value = row[1].strip() if len(row) > 1 else ""
+        yield user_id, value or None
+
+def apply_bulk_batch(action: str, default: Optional[str], rows, key: str, skipped: Counter) -> int:
+    """تطبيق دفعة واحدة - تعديلات الأرصدة كلها في قيد دفتر واحد. يعيد عدد المطبق"""
+    now = datetime.now()
+    postings = []
+    pending: Dict[str, int] = {}
+    changed = []
+    for user_id, value in rows:
+        user_data = game_bot.users_data.get(user_id)
+        if user_data is None:
+            skipped['missing'] += 1
+            continue
+        value = value or default
+
+        if action in ("credit", "debit"):
+            try:
+                amount = int(value)
+            except (TypeError, ValueError):
+                amount = 0
+            if amount <= 0:
+                skipped['invalid'] += 1
+                continue
+            if action == "debit":
+                if amount > user_data['balance'] + pending.get(user_id, 0):
+                    skipped['balance'] += 1
+                    continue
+                amount = -amount
+            pending[user_id] = pending.get(user_id, 0) + amount
+            postings.append((user_account(user_id), amount))
+            changed.append((user_data, amount))
+        elif action == "ban":
+            if is_admin(int(user_id)):
+                skipped['admin'] += 1
+                continue
+            user_data.update({'is_banned': True, 'ban_reason': value or "حظر جماعي",
+                              'ban_date': now.strftime('%Y-%m-%d %H:%M:%S'), 'ban_until': None})
+            changed.append((user_data, 0))
+        elif action == "unban":
+            user_data.update({'is_banned': False, 'ban_reason': None, 'ban_date': None, 'ban_until': None})
+            changed.append((user_data, 0))
+        elif action == "vip":
+            if value and value.lower() in ('off', '0'):
+                user_data['vip_status'] = False
+                user_data['vip_expires'] = None
+            else:
+                try:
+                    days = int(value)
+                except (TypeError, ValueError):
+                    days = 0
+                if not 1 <= days <= VIP_MAX_DAYS:
+                    skipped['invalid'] += 1
+                    continue
+                user_data['vip_status'] = True
+                user_data['vip_expires'] = (now + timedelta(days=days)).isoformat()
+                reward_scheduler.schedule_user(user_id, user_data)
+            changed.append((user_data, 0))
+
+    if postings:
+        total = sum(amount for _, amount in postings)
+        if game_bot.ledger.post(f"admin:bulk_{action}", postings + [(ADMIN_ACCOUNT, -total)], key) is None:
+            skipped['duplicate'] += len(changed)
+            return 0
+        for user_data, amount in changed:
+            user_data['balance'] += amount
+    return len(changed)
+
+def format_bulk_progress(action: str, done: int, applied: int, skipped: Counter, fraction: Optional[float]) -> str:
+    reasons = {'missing': "غير موجود", 'invalid': "قيمة غير صحيحة", 'balance': "رصيد غير كافٍ",
+               'admin': "مشرف", 'duplicate': "مكرر"}
+    lines = [f"⏳ <b>عملية {action} الجماعية</b>" + (f" - {fraction * 100:.0f}%" if fraction is not None else ""),
+             f"📄 الصفوف: {done:,}", f"✅ المطبق: {applied:,}"]
+    lines += [f"⚠️ {reasons[reason]}: {count:,}" for reason, count in skipped.items() if count]
+    return "\n".join(lines)
+
+async def read_bulk_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """مصدر الصفوف: ملف CSV (أو csv.gz) مرفق بالرسالة أو بالرسالة المردود عليها، وإلا أسطر الرسالة نفسها
+
+    يعيد (الأسطر، دالة نسبة التقدم). الملف يُقرأ كتدفق فلا تُبنى قائمة الصفوف في الذاكرة.
+    """
+    message = update.message
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        body = (message.text or message.caption or "").split("\n", 1)
+        lines = body[1].splitlines() if len(body) > 1 else []
+        return lines, None
+
+    file = await context.bot.get_file(document.file_id)
+    raw = io.BytesIO(bytes(await file.download_as_bytearray()))
+    size = len(raw.getbuffer()) or 1
+    stream = gzip.GzipFile(fileobj=raw) if raw.getbuffer()[:2] == b"\x1f\x8b" else raw
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), lambda: raw.tell() / size
+
+@admin_only
+async def bulk_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حظر أو إضافة أو خصم أو VIP لعدد كبير من المستخدمين بدفعات وحفظ واحد"""
+    args = context.args or []
+    if not args or args[0] not in BULK_ACTIONS:
+        await update.message.reply_text(
+            "📝 <b>الاستخدام:</b> /bulk <ban|unban|credit|debit|vip> [القيمة الافتراضية]\n"
+            "مع ملف CSV (المعرف،القيمة) مرفق أو بالرد عليه، أو المعرفات في أسطر تالية للأمر",
+            parse_mode='HTML'
+        )
+        return
+    action = args[0]
+    # القيمة الافتراضية من السطر الأول فقط: المبلغ أو الأيام أو سبب الحظر
+    first_line = (update.message.text or update.message.caption or "").split("\n", 1)[0].split(maxsplit=2)
+    default = first_line[2].strip() if len(first_line) > 2 else None
+
+    lines, fraction = await read_bulk_source(update, context)
+    status = await update.message.reply_text(format_bulk_progress(action, 0, 0, Counter(), 0.0), parse_mode='HTML')
+    started = time.monotonic()
+    last_report = started
+    done = applied = 0
+    skipped: Counter = Counter()
+    batch = []
+    batch_no = 0
+
+    async def flush():
+        nonlocal applied, batch_no, batch, last_report
+        batch_no += 1
+        applied += apply_bulk_batch(action, default, batch, f"bulk:{update.update_id}:{batch_no}", skipped)
+        batch = []
+        await asyncio.sleep(0)
+        if time.monotonic() - last_report >= BULK_PROGRESS_SECONDS:
+            last_report = time.monotonic()
+            try:
+                await status.edit_text(format_bulk_progress(action, done, applied, skipped,
+                                                            fraction() if fraction else None), parse_mode='HTML')
+            except TelegramError:
+                pass
+
+    for row in parse_bulk_rows(lines):
+        batch.append(row)
+        done += 1
+        if len(batch) >= BULK_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+
+    if applied:
+        game_bot.save_data()
+    metrics.inc(f"admin.bulk_{action}", applied)
+    logger.info(f"المشرف {update.effective_user.id} نفذ {action} جماعي: {applied}/{done} في {time.monotonic() - started:.1f}s")
+    text = format_bulk_progress(action, done, applied, skipped, None).replace("⏳", "✅", 1)
+    try:
+        await status.edit_text(text + f"\n⏱️ {time.monotonic() - started:.1f} ثانية", parse_mode='HTML')
+    except TelegramError:
+        await update.message.reply_text(text, parse_mode='HTML')
+
+async def bulk_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ملف أُرسل والأمر في تعليقه - CommandHandler لا يطابق التعليقات"""
+    context.args = update.message.caption.split()[1:]
+    await bulk_command(update, context)
+
+USER_EXPORT_FIELDS = ('balance', 'level', 'exp', 'games_played', 'wins', 'losses', 'total_wagered', 'total_won',
+                      'total_lost', 'daily_streak', 'is_banned', 'ban_reason', 'vip_status', 'vip_expires',
+                      'referral_count', 'referred_by', 'join_date', 'last_activity')
+MESSAGE_EXPORT_FIELDS = ('username', 'first_name', 'last_name', 'date', 'length', 'text')
+
+def csv_cell(value: Any) -> Any:
+    """منع تفسير النصوص كصيغ عند فتح الملف في برامج الجداول"""
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+def iter_records(store) -> Iterator[Tuple[str, Any]]:
+    """المرور على مخزن دون التأثر بتعديلاته بين الدفعات ودون استعادة المستخدمين المؤرشفين"""
+    if isinstance(store, TieredUserStore):
+        yield from store.items()
+        return
+    for key in list(store):
+        value = store.get(key)
+        if value is not None:
+            yield key, value
+
+def user_export_rows():
+    for user_id, user_data in iter_records(game_bot.users_data):
+        yield [user_id] + [csv_cell(user_data.get(field)) for field in USER_EXPORT_FIELDS]
+
+def message_export_rows():
+    for user_id, message_data in iter_records(game_bot.messages_log):
+        names = [csv_cell(message_data.get(field)) for field in MESSAGE_EXPORT_FIELDS[:3]]
+        for message in message_data.get('messages', []):
+            yield [user_id] + names + [message.get('date'), message.get('length'), csv_cell(message.get('text'))]
+
+EXPORT_SOURCES = {
+    "users": (("user_id",) + USER_EXPORT_FIELDS, user_export_rows, lambda: len(game_bot.users_data)),
+    "messages": (("user_id",) + MESSAGE_EXPORT_FIELDS, message_export_rows, None),
+}
+
+class GzipCsvParts:
+    """كاتب CSV مضغوط يبدأ جزءاً جديداً عند بلوغ الحد - جزء واحد فقط على القرص في كل وقت"""
+
+    def __init__(self, header, part_bytes: int):
+        self.header = header
+        self.part_bytes = part_bytes
+        self.parts = 0
+        self.path = None
+
+    def open(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv.gz")
+        self._raw = os.fdopen(fd, 'wb')
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+        self.writer = csv.writer(self._text)
+        self.writer.writerow(self.header)
+        self.parts += 1
+
+    @property
+    def full(self) -> bool:
+        return self._raw.tell() >= self.part_bytes
+
+    def close(self) -> str:
+        self._text.close()   # يغلق طبقة الضغط، وGzipFile لا يغلق الملف الممرر له
+        self._raw.close()
+        path, self.path = self.path, None
+        return path
+
+async def send_export_part(bot, chat_id: int, path: str, filename: str):
+    try:
+        with open(path, 'rb') as f:
+            await bot.send_document(chat_id=chat_id, document=f, filename=filename)
+    except TelegramError as e:
+        logger.error(f"فشل في إرسال ملف التصدير {filename}: {e}")
+    finally:
+        os.remove(path)
+
+@admin_only
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تصدير المستخدمين أو الرسائل كملفات CSV مضغوطة تُكتب وتُرسل جزءاً جزءاً"""
+    source = context.args[0] if context.args else ""
+    if source not in EXPORT_SOURCES:
+        await update.message.reply_text("📝 <b>الاستخدام:</b> /export <users|messages>", parse_mode='HTML')
+        return
+
+    header, rows, count = EXPORT_SOURCES[source]
+    total = count() if count else None
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    chat_id = update.effective_chat.id
+    status = await update.message.reply_text(f"⏳ جاري تصدير {source}...")
+    started = time.monotonic()
+    last_report = started
+    written = 0
+
+    parts = GzipCsvParts(header, EXPORT_PART_BYTES)
+    parts.open()
+    for row in rows():
+        parts.writer.writerow(row)
+        written += 1
+        if written % EXPORT_BATCH_ROWS:
+            continue
+        await asyncio.sleep(0)
+        if parts.full:
+            await send_export_part(context.bot, chat_id, parts.close(), f"{source}_{stamp}_part{parts.parts}.csv.gz")
+            parts.open()
+        if time.monotonic() - last_report >= BULK_PROGRESS_SECONDS:
+            last_report = time.monotonic()
+            progress = f"{written:,}" + (f" / {total:,} ({written / (total or 1) * 100:.0f}%)" if total else "")
+            try:
+                await status.edit_text(f"⏳ جاري تصدير {source}: {progress} صف")
+            except TelegramError:
+                pass
+    await send_export_part(context.bot, chat_id, parts.close(), f"{source}_{stamp}_part{parts.parts}.csv.gz")
+
+    elapsed = time.monotonic() - started
+    metrics.inc(f"admin.export_{source}", written)
+    logger.info(f"المشرف {update.effective_user.id} صدّر {source}: {written} صف في {parts.parts} جزء خلال {elapsed:.1f}s")
+    try:
+        await status.edit_text(f"✅ تم تصدير {written:,} صف في {parts.parts} ملف خلال {elapsed:.1f} ثانية")
+    except TelegramError:
+        pass
+
+@admin_only
+async def user_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض آخر رسائل مستخدم (يُحمَّل سجله عند الطلب فقط)"""
+    if not context.args:
+        await update.message.reply_text("📝 <b>الاستخدام:</b> /usermessages <معرف المستخدم> [العدد]", parse_mode='HTML')
+        return
+
+    try:
+        user_id = int(context.args[0])
+        limit = min(int(context.args[1]), 50) if len(context.args) > 1 else 10
+    except ValueError:
+        await update.message.reply_text("❌ معرف المستخدم والعدد يجب أن يكونا أرقاماً!")
+        return
+
+    message_data = game_bot.messages_log.get(str(user_id))
+    if not message_data or not message_data.get('messages'):
+        await update.message.reply_text("📭 لا توجد رسائل مسجلة لهذا المستخدم")
+        return
+
+    lines = [
+        f"• <code>{m['date']}</code>\n{html.escape(m['text'][:200])}"
+        for m in message_data['messages'][-limit:]
+    ]
+    await update.message.reply_text(
+        f"💬 <b>رسائل {html.escape(message_data.get('first_name', ''))} ({user_id})</b>\n"
+        f"📊 إجمالي الرسائل: {message_data.get('message_count', 0):,}\n\n" + "\n\n".join(lines),
+        parse_mode='HTML'
+    )
+
+def parse_search_args(args) -> Tuple[Dict[str, Any], Optional[str]]:
+    """فصل كلمات البحث عن المرشحات from: to: user: page:"""
+    options = {'term': [], 'since': None, 'until': None, 'user_id': None, 'page': 1}
+    for arg in args:
+        key, _, value = arg.partition(":")
+        try:
+            if key == "from" and value:
+                options['since'] = int(datetime.strptime(value, '%Y-%m-%d').timestamp())
+            elif key == "to" and value:
+                options['until'] = int((datetime.strptime(value, '%Y-%m-%d') + timedelta(days=1)).timestamp())
+            elif key == "user" and value:
+                options['user_id'] = int(value)
+            elif key == "page" and value:
+                options['page'] = max(int(value), 1)
+            else:
+                options['term'].append(arg)
+        except ValueError:
+            return options, f"❌ قيمة غير صحيحة: {arg}"
+    options['term'] = " ".join(options['term'])
+    return options, None
+
+def render_search_page(options: Dict[str, Any]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """صفحة نتائج البحث مع أزرار التنقل"""
+    page = options['page']
+    started = time.perf_counter()
+    total, rows = game_bot.search_index.search(
+        options['term'], options['since'], options['until'], options['user_id'],
+        limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics.inc("search.queries")
+    metrics.set("search.last_ms", elapsed_ms)
+
+    total_text = f"{total:,}+" if total >= SEARCH_COUNT_CAP else f"{total:,}"
+    lines = [
+        f"• <code>{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M')}</code> | <code>{user_id}</code>\n"
+        f"{html.escape(text[:200])}"
+        for user_id, ts, text in rows
+    ]
+    text = (
+        f"🔎 <b>بحث:</b> {html.escape(options['term'])}\n"
+        f"📊 <b>النتائج:</b> {total_text} | 📄 صفحة {page} | ⏱️ {elapsed_ms:.1f}ms\n\n"
+        + ("\n\n".join(lines) or "📭 لا توجد نتائج")
+    )
+
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"search_page_{page - 1}"))
+    if page * SEARCH_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton("التالي ➡️", callback_data=f"search_page_{page + 1}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+@admin_only
+async def search_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """بحث نصي في كل الرسائل المسجلة"""
+    options, error = parse_search_args(context.args)
+    if error or not options['term']:
+        await update.message.reply_text(
+            error or "📝 <b>الاستخدام:</b> /search <كلمات> [from:2024-01-01] [to:2024-12-31] [user:المعرف] [page:2]\n"
+                     "💡 استخدم * في نهاية الكلمة للبحث بالبادئة",
+            parse_mode='HTML'
+        )
+        return
+
+    # حفظ البحث الأخير للتنقل بين الصفحات بالأزرار
+    context.user_data['search'] = options
+    text, reply_markup = render_search_page(options)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
+
+async def show_search_page(query, context: ContextTypes.DEFAULT_TYPE, page: int):
+    options = context.user_data.get('search')
+    if options is None:
+        await query.edit_message_text("⌛ انتهت جلسة البحث، أعد تنفيذ /search")
+        return
+    options['page'] = page
+    text, reply_markup = render_search_page(options)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
+
+@admin_only
+async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """البحث عن مستخدم باسم المستخدم أو ببادئة الاسم"""
+    if not context.args:
+        await update.message.reply_text("📝 <b>الاستخدام:</b> /find <@اسم_المستخدم أو بداية الاسم>", parse_mode='HTML')
+        return
+
+    query = " ".join(context.args)
+    directory = game_bot.directory
+    if query.startswith("@"):
+        user_id = directory.find_username(query)
+        matches = [user_id] if user_id else directory.search_prefix(query, FIND_RESULTS_LIMIT)
+    else:
+        matches = directory.search_prefix(query, FIND_RESULTS_LIMIT)
+
+    if not matches:
+        await update.message.reply_text("🔍 لا يوجد مستخدم مطابق")
+        return
+
+    lines = [f"• <code>{user_id}</code> - {html.escape(directory.display_name(user_id))}" for user_id in matches]
+    text = f"🔍 <b>نتائج البحث عن:</b> {html.escape(query)}\n\n" + "\n".join(lines)
+
+    # سجل تغيير الأسماء عند وجود نتيجة واحدة
+    if len(matches) == 1:
+        history = directory.records[matches[0]][3]
+        if history:
+            text += "\n\n📜 <b>الأسماء السابقة:</b>\n" + "\n".join(
+                f"• <code>{changed_at[:10]}</code> {html.escape(' '.join(filter(None, (first, last))))}"
+                + (f" (@{html.escape(username)})" if username else "")
+                for changed_at, username, first, last in reversed(history)
+            )
+    await update.message.reply_text(text, parse_mode='HTML')
+
+def format_analytics_report(report: Dict[str, Any]) -> str:
+    games = "\n".join(
+        f"• {name}: {stats['rounds']:,} جولة | رهان {stats['wagered']:,} | ربح الكازينو {stats['profit']:+,} | فوز اللاعبين {stats['win_rate'] * 100:.1f}%"
+        for name, stats in sorted(report['games'].items(), key=lambda item: -item[1]['wagered'])
+    ) or "لا توجد جولات"
+    histogram = report['win_rate_histogram']
+    peak = max(histogram) or 1
+    distribution = "\n".join(
+        f"<code>{i * 10:>3}-{i * 10 + 10:<3}% {'█' * round(count / peak * 15):<15} {count:,}</code>"
+        for i, count in enumerate(histogram)
+    )
+    return (
+        f"📈 <b>تقرير الإدارة - آخر {report['days']} يوم</b>\n\n"
+        f"👥 <b>النشاط:</b> يومي {report['dau']:,} | أسبوعي {report['wau']:,} | شهري {report['mau']:,}\n"
+        f"🆕 <b>مستخدمون جدد (7 أيام):</b> {report['signups_week']:,}\n"
+        f"🎁 <b>مكافآت يومية اليوم:</b> {report['daily_claims_today']:,}\n"
+        f"💬 <b>رسائل اليوم:</b> {report['messages_today']:,}\n"
+        f"🏦 <b>ربح الكازينو:</b> {sum(report['profit_series']):+,} كوين\n\n"
+        f"🎮 <b>الألعاب:</b>\n{games}\n\n"
+        f"📊 <b>توزيع نسب الفوز (≥{ANALYTICS_MIN_ROUNDS} جولات):</b>\n{distribution}\n\n"
+        f"🗂️ الأحداث المحللة: {report['events']:,} | ⏱️ {report['elapsed_ms']:.0f}ms"
+    )
+
+async def build_analytics_report() -> Tuple[str, Optional[bytes]]:
+    """حساب التقرير والرسم في خيط منفصل حتى لا تتأثر حلقة الأحداث"""
+    game_bot.analytics.flush()
+
+    def compute():
+        started = time.perf_counter()
+        report = analytics_report(game_bot.analytics.columns(), time.time())
+        report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return report, render_analytics_chart(report)
+
+    report, chart = await asyncio.to_thread(compute)
+    return format_analytics_report(report), chart
+
+@admin_only
+async def stats_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إحصائيات تفصيلية للمشرفين من سجل الأحداث"""
+    text, chart = await build_analytics_report()
+    await update.message.reply_text(text, parse_mode='HTML')
+    if chart:
+        await update.message.reply_photo(photo=chart, caption="📈 النشاط وربح الكازينو اليومي")
+
+async def send_profile_report(bot, chat_id: int, report: Dict[str, Any]):
+    """إرسال ملخص جلسة التحليل مع ملفات التقرير"""
+    top_self = "\n".join(
+        f"• {count} - <code>{frame[:80]}</code>" for frame, count in report['top_self'][:8]
+    ) or "لا توجد عينات"
+    hot_paths = "\n".join(
+        f"• {tag}: {count / (report['samples'] or 1) * 100:.1f}%" for tag, count in report['hot_paths']
+    ) or "لم تظهر مسارات ساخنة"
+    allocations = "\n".join(
+        f"• {size / 1024:.1f} KB - <code>{where}</code>" for where, size in report['top_allocations']
+    ) or "غير متوفر"
+
+    summary = f"""
+🔬 <b>تقرير محلل الأداء</b>
+
+⏱️ <b>المدة:</b> {report['elapsed']:.1f} ثانية
+🧮 <b>العينات:</b> {report['samples']:,}
+
+🔥 <b>المسارات الساخنة:</b>
+{hot_paths}
+
+🧵 <b>أعلى الدوال (وقت ذاتي):</b>
+{top_self}
+
+🧠 <b>أكبر التخصيصات:</b>
+{allocations}
+"""
+    await bot.send_message(chat_id=chat_id, text=summary, parse_mode='HTML')
+
+    for path in (report['stacks_file'], report['allocations_file']):
+        if path:
+            try:
+                with open(path, 'rb') as f:
+                    await bot.send_document(chat_id=chat_id, document=f, filename=os.path.basename(path))
+            except TelegramError as e:
+                logger.error(f"فشل في إرسال ملف التحليل {path}: {e}")
+
+async def auto_stop_profile(bot, chat_id: int, session_id: int, duration: int):
+    """إيقاف جلسة التحليل تلقائياً عند انتهاء مدتها"""
+    await asyncio.sleep(duration + 1)
+    if profiler.session_id != session_id or not profiler.has_session:
+        return
+    report = profiler.stop()
+    if report:
+        await send_profile_report(bot, chat_id, report)
+
+@admin_only
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تشغيل/إيقاف محلل الأداء على البوت الحي"""
+    action = context.args[0].lower() if context.args else ""
+
+    if action == "start":
+        duration = PROFILE_DEFAULT_SECONDS
+        if len(context.args) > 1:
+            try:
+                duration = int(context.args[1])
+            except ValueError:
+                await update.message.reply_text("❌ المدة يجب أن تكون رقماً!")
+                return
+
+        duration = profiler.start(duration)
+        if not duration:
+            await update.message.reply_text("⚠️ المحلل يعمل بالفعل! استخدم /profile stop")
+            return
+
+        context.application.create_task(
+            auto_stop_profile(context.bot, update.effective_chat.id, profiler.session_id, duration)
+        )
+        await update.message.reply_text(
+            f"🔬 تم تشغيل المحلل لمدة <b>{duration}</b> ثانية\n"
+            f"سيتم إرسال التقرير تلقائياً عند الانتهاء.",
+            parse_mode='HTML'
+        )
+
+    elif action == "stop":
+        report = profiler.stop()
+        if report is None:
+            await update.message.reply_text("ℹ️ لا توجد جلسة تحليل نشطة")
+            return
+        await send_profile_report(context.bot, update.effective_chat.id, report)
+
+    else:
+        status = '🟢 يعمل' if profiler.is_running else '🔴 متوقف'
+        await update.message.reply_text(
+            f"🔬 <b>محلل الأداء:</b> {status}\n\n"
+            f"📝 <b>الاستخدام:</b>\n"
+            f"/profile start [الثواني] - بدء التحليل (حد أقصى {PROFILE_MAX_SECONDS})\n"
+            f"/profile stop - إيقاف التحليل وإرسال التقرير",
+            parse_mode='HTML'
+        )
+
+@admin_only
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض مقاييس التشغيل"""
+    metrics.set("outbox.pending", outbox.pending)
+    metrics.set("outbox.sent", outbox.sent)
+    metrics.set("outbox.failed", outbox.failed)
+    await update.message.reply_text(
+        f"📈 <b>المقاييس - {current_tenant.get().name}:</b>\n<pre>{html.escape(metrics.render())}</pre>", parse_mode='HTML'
+    )
+
+ACHIEVEMENT_BACKFILL_CHUNK = 1000
+
+async def run_achievement_backfill(bot, chat_id: int):
+    """منح الإنجازات المستحقة لكل المستخدمين على دفعات مع حفظ واحد في النهاية"""
+    started = time.monotonic()
+    scanned = awarded_users = awarded_total = 0
+    awarded_by_rule: Counter = Counter()
+
+    for user_id, user_data in iter_users():
+        new_achievements = game_bot.achievements.evaluate(user_data)
+        if new_achievements:
+            # إعادة الإسناد تعيد المستخدم المؤرشف إلى الذاكرة حتى يُحفظ التعديل
+            game_bot.users_data[user_id] = user_data
+            awarded_users += 1
+            awarded_total += len(new_achievements)
+            awarded_by_rule.update(new_achievements)
+        scanned += 1
+        if scanned % ACHIEVEMENT_BACKFILL_CHUNK == 0:
+            await asyncio.sleep(0)  # عدم حجب حلقة الأحداث
+
+    if awarded_total:
+        game_bot.save_data()
+
+    details = "\n".join(
+        f"• {game_bot.achievements.names.get(rule_id, rule_id)}: {count:,}"
+        for rule_id, count in awarded_by_rule.most_common()
+    )
+    await bot.send_message(
+        chat_id=chat_id,
+        text=f"🏅 <b>اكتمل منح الإنجازات</b>\n\n"
+             f"👥 تم فحص: {scanned:,} مستخدم\n"
+             f"🎖️ حصل على إنجازات: {awarded_users:,} مستخدم\n"
+             f"📊 إجمالي الإنجازات الممنوحة: {awarded_total:,}\n"
+             f"⏱️ المدة: {time.monotonic() - started:.2f} ثانية\n\n{details}",
+        parse_mode='HTML'
+    )
+
+@admin_only
+async def backfill_achievements(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تشغيل مهمة منح الإنجازات الجديدة للمستخدمين الحاليين"""
+    await update.message.reply_text("⏳ جاري فحص المستخدمين ومنح الإنجازات المستحقة...")
+    context.application.create_task(run_achievement_backfill(context.bot, update.effective_chat.id))
+
+# ===== إضافات الألعاب =====
+
+class GameRound:
+    """نتيجة جولة حسمتها اللعبة - المضاعف يشمل الرهان: 0 خسارة و2 ضعف الرهان
+
+    outcome ترميز رقمي لما سحبته اللعبة (رقم الروليت، وجه النرد...) يُحفظ في سجل التدقيق.
+    """
+
+    __slots__ = ('multiplier', 'exp', 'outcome', 'details')
+
+    def __init__(self, multiplier: int, exp: int, outcome: int = 0, **details):
+        self.multiplier = multiplier
+        self.exp = exp
+        self.outcome = outcome
+        self.details = details
+
+    @property
+    def won(self) -> bool:
+        return self.multiplier > 0
+
+class GamePlugin(abc.ABC):
+    """واجهة لعبة فردية: parse يحلل اختيار اللاعب ← resolve يحسم الجولة ← render يصوغ النتيجة
+
+    التحقق من الرهان والقيد والإحصائيات والمستوى والإنجازات والحفظ مشتركة في settle_game_round.
+    parse يرفع ValueError برسالة تُعرض للاعب إذا كان الاختيار غير صالح.
+    resolve يسحب كل عشوائيته من rng المبذور بـ nonce الجولة فتُعاد النتيجة نفسها من سجل التدقيق.
+    """
+
+    name = ""
+    min_args = 2   # المبلغ والاختيار
+    replay_label = "🔄 لعب مرة أخرى"
+
+    @abc.abstractmethod
+    def help_text(self, settings) -> str:
+        """نص الاستخدام عند كتابة الأمر دون وسائط كافية"""
+
+    def parse(self, args) -> Any:
+        return None
+
+    @abc.abstractmethod
+    def resolve(self, choice, rng: random.Random) -> GameRound:
+        """حسم الجولة - كل العشوائية من rng"""
+
+    @abc.abstractmethod
+    def render(self, result: GameRound, choice, bet: int, net: int, balance: int) -> str:
+        """نص نتيجة الجولة للاعب"""
+
+    def describe_outcome(self, outcome: int) -> str:
+        """عرض outcome المحفوظ في سجل التدقيق"""
+        return str(outcome)
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_data: Dict[str, Any],
+                    bet: int, choice) -> bool:
+        """تحويل الجولة إلى مسار آخر (كطاولة مشتركة) - True إذا عولجت هناك"""
+        return False
+
+def import_game_plugin(path: str, name: str) -> GamePlugin:
+    """استيراد ملف لعبة خارجية - create_plugin يستقبل هذه الوحدة بدلاً من استيرادها مرة ثانية"""
+    spec = importlib.util.spec_from_file_location(f"{GAME_PLUGINS_FOLDER}.{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_plugin(sys.modules[__name__])
+
+class GameRegistry:
+    """سجل الألعاب: الأسماء معروفة عند الإقلاع، واللعبة تُبنى (وتُستورد وحدتها) عند أول جولة"""
+
+    def __init__(self):
+        self._factories: Dict[str, Any] = {}
+        self._plugins: Dict[str, GamePlugin] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def names(self) -> list:
+        return list(self._factories)
+
+    def register(self, name: str, factory):
+        self._factories[name] = factory
+        GAME_COMMANDS.add(name)
+
+    def discover(self, folder: str) -> list:
+        """تسجيل ملفات الألعاب في المجلد بأسمائها فقط - لا يُستورد أي منها هنا"""
+        if not os.path.isdir(folder):
+            return []
+        found = []
+        for filename in sorted(os.listdir(folder)):
+            name, extension = os.path.splitext(filename)
+            if extension != ".py" or name.startswith("_") or name in self._factories:
+                continue
+            path = os.path.join(folder, filename)
+            self.register(name, lambda path=path, name=name: import_game_plugin(path, name))
+            found.append(name)
+        return found
+
+    def get(self, name: str) -> GamePlugin:
+        plugin = self._plugins.get(name)
+        if plugin is None:
+            started = time.perf_counter()
+            plugin = self._plugins[name] = self._factories[name]()
+            logger.info(f"تم تحميل اللعبة {name} خلال {(time.perf_counter() - started) * 1000:.1f}ms")
+        return plugin
+
+game_registry = GameRegistry()
+
+def validate_bet(bet_amount: int, user_data: Dict[str, Any]) -> Optional[str]:
+    """رسالة الخطأ إن كان الرهان خارج الحدود أو أكبر من الرصيد"""
+    settings = game_bot.settings
+    if bet_amount < settings['min_bet']:
+        return f"❌ الحد الأدنى للرهان {settings['min_bet']} كوين!"
+    if bet_amount > settings['max_bet']:
+        return f"❌ الحد الأقصى للرهان {settings['max_bet']:,} كوين!"
+    if bet_amount > user_data['balance']:
+        return f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين"
+    return None
+
+@hot_path("game:settle")
+def settle_game_round(game: str, user_id: int, user_data: Dict[str, Any], bet: int, result: GameRound,
+                      nonce: int) -> Tuple[int, str]:
+    """خط التسوية المشترك: قيد واحد وسجل تدقيق ثم الإحصائيات والمستوى والإنجازات، والحفظ مجمع
+
+    يعيد (صافي الربح أو الخسارة، نص المستوى والإنجازات الجديدة).
+    """
+    net = bet * (result.multiplier - 1) if result.won else -bet
+    game_bot.adjust_balance(user_id, user_data, net, f"game:{game}", HOUSE_ACCOUNT)
+    game_bot.audit.append(user_id, game, bet, net, nonce, result.outcome)
+    record_game_result(user_id, game, bet, net)
+
+    user_data['games_played'] += 1
+    user_data['total_wagered'] += bet
+    user_data['favorite_game'] = game
+    game_field = count_game_round(user_data, game)
+    if result.won:
+        user_data['wins'] += 1
+        user_data['total_won'] += net
+    else:
+        user_data['losses'] += 1
+        user_data['total_lost'] += bet
+    user_data['exp'] += result.exp
+
+    extra = ""
+    old_level, new_level, level_bonus = game_bot.apply_level_ups(user_id, user_data)
+    if new_level > old_level:
+        extra += f"\n🆙 <b>مستوى جديد! {old_level} → {new_level}</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
+    achievement_msg = game_bot.check_achievements(user_id, user_data, GAME_ROUND_FIELDS + (game_field,))
+    if achievement_msg:
+        extra += f"\n{achievement_msg}"
+    game_bot.mark_users_dirty()
+
+    counters = metrics.counters
+    counters[f"game.{game}.rounds"] += 1
+    counters[f"game.{game}.wagered"] += bet
+    counters[f"game.{game}.paid"] += bet + net
+    counters[f"game.{game}.wins"] += result.won
+    metrics.set(f"game.{game}.rtp", counters[f"game.{game}.paid"] / counters[f"game.{game}.wagered"])
+    return net, extra
+
+@hot_path("game:play")
+async def play_game(game: str, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """أمر لعبة مسجلة: تحليل الرهان ثم الحسم ثم التسوية المشتركة"""
+    plugin = game_registry.get(game)
     user_id = update.effective_user.id
     user_data = game_bot.get_user_data(user_id)
-    
-    if not context.args or len(context.args) < 2:
-        help_text = f"""
+    args = context.args or []
+
+    if len(args) < plugin.min_args:
+        await update.message.reply_text(plugin.help_text(game_bot.settings), parse_mode='HTML')
+        return
+    try:
+        bet_amount = int(args[0])
+    except ValueError:
+        await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
+        return
+    try:
+        choice = plugin.parse(args[1:])
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    error = validate_bet(bet_amount, user_data)
+    if error:
+        await update.message.reply_text(error)
+        return
+    if await plugin.route(update, context, user_data, bet_amount, choice):
+        return
+
+    started = time.perf_counter()
+    nonce = secrets.randbits(64)
+    result = plugin.resolve(choice, random.Random(nonce))
+    net, extra = settle_game_round(game, user_id, user_data, bet_amount, result, nonce)
+    text = plugin.render(result, choice, bet_amount, net, user_data['balance']) + extra
+    metrics.set(f"game.{game}.last_ms", (time.perf_counter() - started) * 1000)
+
+    keyboard = [
+        [InlineKeyboardButton(plugin.replay_label, callback_data=f"game_{game}"),
+         InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")],
+        [InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
+         InlineKeyboardButton("💰 الرصيد", callback_data="show_balance")]
+    ]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+def game_command(game: str):
+    """معالج أمر للعبة مسجلة - اللعبة نفسها لا تُحمَّل قبل أول استخدام"""
+    @maintenance_check
+    @ban_check
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await play_game(game, update, context)
+    return handler
+
+# ===== الألعاب المحسنة =====
+
+ROULETTE_RED_NUMBERS = frozenset({1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36})
+
+class RouletteBet:
+    """نوع رهان الروليت: المفتاح الموحد والوصف والمضاعف والجيوب الرابحة"""
+
+    __slots__ = ('key', 'label', 'multiplier', 'pockets')
+
+    def __init__(self, key: str, label: str, multiplier: int, pockets):
+        self.key = key
+        self.label = label
+        self.multiplier = multiplier
+        self.pockets = frozenset(pockets)
+
+def build_roulette_bets() -> Dict[str, RouletteBet]:
+    """جدول الرهانات المقبولة: كل اسم بديل يشير إلى نفس الكائن"""
+    bets = {str(number): RouletteBet(str(number), f"رقم مباشر ({number})", 35, (number,)) for number in range(37)}
+    outside = [
+        (("أحمر", "red"), "أحمر", 1, ROULETTE_RED_NUMBERS),
+        (("أسود", "black"), "أسود", 1, set(range(1, 37)) - ROULETTE_RED_NUMBERS),
+        (("زوجي", "even"), "زوجي", 1, range(2, 37, 2)),
+        (("فردي", "odd"), "فردي", 1, range(1, 37, 2)),
+        (("صف أول", "1st", "1-12"), "الصف الأول (1-12)", 2, range(1, 13)),
+        (("صف ثاني", "2nd", "13-24"), "الصف الثاني (13-24)", 2, range(13, 25)),
+        (("صف ثالث", "3rd", "25-36"), "الصف الثالث (25-36)", 2, range(25, 37)),
+    ]
+    for aliases, label, multiplier, pockets in outside:
+        bet = RouletteBet(aliases[-1], label, multiplier, pockets)
+        for alias in aliases:
+            bets[alias] = bet
+    return bets
+
+ROULETTE_BETS = build_roulette_bets()
+
+# العائد المحسوب مسبقاً لكل جيب: الرقم الفائز -> {مفتاح الرهان: المضاعف + 1}
+ROULETTE_PAYOUTS = [
+    {bet.key: bet.multiplier + 1 for bet in set(ROULETTE_BETS.values()) if number in bet.pockets}
+    for number in range(37)
+]
+
+def parse_roulette_bet(text: str) -> Optional[RouletteBet]:
+    """تحويل نص الرهان إلى نوعه - None إذا لم يكن رهاناً معروفاً"""
+    text = " ".join(text.split()).lower()
+    if text.isdigit():
+        text = str(int(text))
+    return ROULETTE_BETS.get(text)
+
+def roulette_color(number: int) -> str:
+    if number == 0:
+        return "🟢 أخضر"
+    return "🔴 أحمر" if number in ROULETTE_RED_NUMBERS else "⚫ أسود"
+
+def spin_roulette(rng=random) -> int:
+    return rng.randint(0, 36)
+
+class RouletteTable:
+    """طاولة روليت جماعية: تُجمع الرهانات خلال نافذة زمنية ثم دورة واحدة لكل اللاعبين"""
+
+    __slots__ = ('chat_id', 'table_id', 'closes_at', 'message_id', 'bets', 'names', 'refreshed_at')
+
+    def __init__(self, chat_id: int, window: int):
+        self.chat_id = chat_id
+        self.table_id = time.time_ns() // 1_000_000
+        self.closes_at = time.time() + window
+        self.message_id: Optional[int] = None
+        self.bets: list = []                      # (user_id, المبلغ، RouletteBet)
+        self.names: Dict[int, str] = {}
+        self.refreshed_at = 0.0
+
+    def bets_of(self, user_id: int) -> int:
+        return sum(1 for bettor, _, _ in self.bets if bettor == user_id)
+
+    def stakes(self) -> Dict[int, int]:
+        totals: Dict[int, int] = {}
+        for user_id, amount, _ in self.bets:
+            totals[user_id] = totals.get(user_id, 0) + amount
+        return totals
+
+    def returns(self, winning_number: int) -> list:
+        """العائد (شاملاً المبلغ) لكل رهان من جدول الجيوب المحسوب مسبقاً"""
+        payouts = ROULETTE_PAYOUTS[winning_number]
+        return [amount * payouts.get(bet.key, 0) for _, amount, bet in self.bets]
+
+def render_roulette_table(table: RouletteTable, winning_number: Optional[int] = None,
+                          returns: Optional[list] = None) -> str:
+    """نص رسالة الطاولة: الرهانات المفتوحة أو النتائج بعد الدوران"""
+    if winning_number is None:
+        remaining = max(0, int(table.closes_at - time.time()))
+        lines = [f"🎰 <b>طاولة الروليت مفتوحة!</b>\n⏳ الدوران بعد {remaining} ثانية\n"
+                 f"📝 للمشاركة: /roulette <المبلغ> <الرهان>\n"]
+        rows = [f"• {html.escape(table.names[user_id])}: {amount:,} على {bet.label}"
+                for user_id, amount, bet in table.bets]
+    else:
+        lines = [f"🎰 <b>نتيجة طاولة الروليت</b>\n🎲 <b>الرقم الفائز:</b> {winning_number} {roulette_color(winning_number)}\n"]
+        rows = [f"{'✅' if returned else '❌'} {html.escape(table.names[user_id])}: {bet.label} "
+                f"{'+' if returned else '-'}{(returned - amount if returned else amount):,}"
+                for (user_id, amount, bet), returned in zip(table.bets, returns)]
+    hidden = len(rows) - ROULETTE_TABLE_SHOWN_BETS
+    lines += rows[:ROULETTE_TABLE_SHOWN_BETS]
+    if hidden > 0:
+        lines.append(f"... و{hidden:,} رهان آخر")
+    lines.append(f"\n👥 {len(table.names):,} لاعب - 💰 {sum(amount for _, amount, _ in table.bets):,} كوين")
+    return "\n".join(lines)
+
+# الطاولات المفتوحة: معرف المجموعة -> الطاولة
+async def place_table_bet(update: Update, context: ContextTypes.DEFAULT_TYPE, user_data: Dict[str, Any],
+                          bet_amount: int, bet: RouletteBet):
+    """وضع رهان على طاولة المجموعة مع حجز المبلغ - الطاولة تُفتح مع أول رهان"""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    table = roulette_tables.get(chat_id)
+    if table is not None:
+        if table.bets_of(user_id) >= ROULETTE_TABLE_MAX_BETS:
+            await update.message.reply_text(f"❌ الحد الأقصى {ROULETTE_TABLE_MAX_BETS} رهانات لكل لاعب في الدورة!")
+            return
+        if user_id not in table.names and len(table.names) >= ROULETTE_TABLE_MAX_PLAYERS:
+            await update.message.reply_text("❌ الطاولة ممتلئة! انتظر الدورة القادمة")
+            return
+
+    if not game_bot.adjust_balance(user_id, user_data, -bet_amount, "escrow:roulette",
+                                   ESCROW_ACCOUNT, key=f"roulette_table:{update.update_id}"):
+        return
+    game_bot.update_user_data(user_id, user_data)
+
+    opening = table is None
+    if opening:
+        table = roulette_tables[chat_id] = RouletteTable(chat_id, ROULETTE_TABLE_WINDOW)
+        context.job_queue.run_once(roulette_table_job, ROULETTE_TABLE_WINDOW, data=chat_id,
+                                   name=f"roulette_table:{chat_id}")
+    table.bets.append((user_id, bet_amount, bet))
+    table.names[user_id] = update.effective_user.first_name or str(user_id)
+    metrics.inc("roulette.table_bets")
+
+    if opening:
+        table.refreshed_at = time.time()
+        message = await update.message.reply_text(render_roulette_table(table), parse_mode='HTML')
+        table.message_id = message.message_id
+    elif table.message_id is not None and time.time() - table.refreshed_at >= ROULETTE_TABLE_REFRESH:
+        # تحديث رسالة الطاولة نفسها بدلاً من رد مستقل لكل رهان
+        table.refreshed_at = time.time()
+        try:
+            await context.bot.edit_message_text(render_roulette_table(table), chat_id=chat_id,
+                                                message_id=table.message_id, parse_mode='HTML')
+        except TelegramError:
+            pass
+
+def settle_roulette_table(table: RouletteTable, winning_number: int, nonce: int) -> list:
+    """تسوية كل رهانات الطاولة بقيد واحد وحفظ واحد - تُرجع عائد كل رهان"""
+    returns = table.returns(winning_number)
+    stakes = table.stakes()
+    payouts: Dict[int, int] = dict.fromkeys(stakes, 0)
+    for (user_id, _, _), returned in zip(table.bets, returns):
+        payouts[user_id] += returned
+
+    players = {user_id: game_bot.get_user_data(user_id) for user_id in stakes}
+    settlements = [(user_id, players[user_id], stakes[user_id], payouts[user_id]) for user_id in stakes]
+    if not game_bot.settle_escrow_batch(settlements, "game:roulette",
+                                        key=f"roulette_table:{table.chat_id}:{table.table_id}"):
+        return returns
+
+    for (user_id, bet_amount, bet), returned in zip(table.bets, returns):
+        user_data = players[user_id]
+        user_data['games_played'] += 1
+        user_data['total_wagered'] += bet_amount
+        user_data['favorite_game'] = 'roulette'
+        count_game_round(user_data, 'roulette')
+        if returned:
+            profit = returned - bet_amount
+            user_data['wins'] += 1
+            user_data['total_won'] += profit
+            user_data['exp'] += min(10 + (bet.multiplier // 5), 50)
+        else:
+            profit = -bet_amount
+            user_data['losses'] += 1
+            user_data['total_lost'] += bet_amount
+            user_data['exp'] += 3
+        record_game_result(user_id, 'roulette', bet_amount, profit)
+        game_bot.audit.append(user_id, 'roulette', bet_amount, profit, nonce, winning_number)
+
+    for user_id, user_data in players.items():
+        game_bot.apply_level_ups(user_id, user_data)
+        game_bot.check_achievements(user_id, user_data, GAME_ROUND_FIELDS + ("games_by_type.roulette",))
+    game_bot.save_data()
+    metrics.inc("roulette.table_spins")
+    return returns
+
+@tenant_job
+async def roulette_table_job(context: ContextTypes.DEFAULT_TYPE):
+    """إغلاق الطاولة: دورة واحدة وتسوية جماعية وتعديل رسالة الطاولة بالنتائج"""
+    table = roulette_tables.pop(context.job.data, None)
+    if table is None or not table.bets:
+        return
+    nonce = secrets.randbits(64)
+    winning_number = spin_roulette(random.Random(nonce))
+    returns = settle_roulette_table(table, winning_number, nonce)
+    text = render_roulette_table(table, winning_number, returns)
+    try:
+        if table.message_id is None:
+            raise BadRequest("رسالة الطاولة غير متوفرة")
+        await context.bot.edit_message_text(text, chat_id=table.chat_id, message_id=table.message_id,
+                                            parse_mode='HTML')
+    except TelegramError:
+        outbox.enqueue(table.chat_id, text, parse_mode='HTML')
+
+
+class RouletteGame(GamePlugin):
+    """الروليت الفردي - في المجموعات يُحوَّل الرهان إلى الطاولة المشتركة"""
+
+    name = "roulette"
+
+    def help_text(self, settings) -> str:
+        return f"""
 🎲 <b>لعبة الروليت الأوروبي</b>
 
 📝 <b>الاستخدام:</b>
 /roulette <المبلغ> <الرهان>
 
 💰 <b>حدود الرهان:</b>
-الحد الأدنى: {game_bot.settings['min_bet']} كوين
-الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
+الحد الأدنى: {settings['min_bet']} كوين
+الحد الأقصى: {settings['max_bet']:,} كوين
 
 🎯 <b>أنواع الرهانات:</b>
 • رقم مباشر (0-36): ربح 35:1
@@ -772,162 +5779,315 @@ async def roulette_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • صف ثالث (25-36): ربح 2:1
 
 مثال: /roulette 100 أحمر
+
+👥 <b>في المجموعات:</b> تُجمع الرهانات {ROULETTE_TABLE_WINDOW} ثانية ثم دورة واحدة لكل اللاعبين
+"""
+
+    def parse(self, args) -> RouletteBet:
+        bet = parse_roulette_bet(' '.join(args))
+        if bet is None:
+            raise ValueError("❌ رهان غير معروف! اكتب /roulette لعرض أنواع الرهانات")
+        return bet
+
+    async def route(self, update, context, user_data, bet_amount, bet) -> bool:
+        # في المجموعات: الرهان يُضاف إلى طاولة مشتركة تدور مرة واحدة لكل اللاعبين
+        if update.effective_chat.type in ('group', 'supergroup') and context.job_queue is not None:
+            await place_table_bet(update, context, user_data, bet_amount, bet)
+            return True
+        return False
+
+    def resolve(self, bet: RouletteBet, rng) -> GameRound:
+        winning_number = spin_roulette(rng)
+        if winning_number in bet.pockets:
+            # نقاط متغيرة حسب المضاعف
+            return GameRound(bet.multiplier + 1, min(10 + (bet.multiplier // 5), 50), winning_number, number=winning_number)
+        return GameRound(0, 3, winning_number, number=winning_number)
+
+    def describe_outcome(self, outcome: int) -> str:
+        return f"{outcome} {roulette_color(outcome)}"
+
+    def render(self, result, bet, bet_amount, net, balance) -> str:
+        number = result.details['number']
+        if result.won:
+            return f"""
+🎉 <b>مبروك! فزت في الروليت!</b>
+
+🎲 <b>النتيجة:</b> {number} {roulette_color(number)}
+🎯 <b>رهانك:</b> {bet.label} ({bet_amount:,} كوين)
+✅ <b>الفوز:</b> {bet.label}
+💰 <b>المضاعف:</b> {bet.multiplier}:1
+💵 <b>الربح:</b> {net:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
+"""
+        return f"""
+😔 <b>للأسف! لم تفز هذه المرة</b>
+
+🎲 <b>النتيجة:</b> {number} {roulette_color(number)}
+🎯 <b>رهانك:</b> {bet.label} ({bet_amount:,} كوين)
+❌ <b>خسارة:</b> -{bet_amount:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 """
-        await update.message.reply_text(help_text, parse_mode='HTML')
+
+game_registry.register("roulette", RouletteGame)
+
+@maintenance_check
+@ban_check
+@hot_path("game:lottery")
+async def lottery_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """اليانصيب اليومي - شراء التذاكر وعرض السحب الحالي"""
+    user_id = update.effective_user.id
+    draw = lottery.current
+    args = context.args[1:] if context.args and context.args[0].lower() == "buy" else context.args
+
+    if not args:
+        last = lottery.last_result
+        last_text = ""
+        if last:
+            winners = "\n".join(
+                f"{w['rank']}. {w['user_id']} - {w['prize']:,} كوين (تذكرة #{w['ticket']})" for w in last['winners']
+            ) or "لا توجد تذاكر"
+            last_text = (
+                f"\n\n🏁 <b>السحب السابق #{last['draw_id']}:</b>\n{winners}\n"
+                f"🔑 <b>البذرة:</b> <code>{last['seed']}</code>"
+            )
+        await update.message.reply_text(
+            f"🎫 <b>اليانصيب اليومي - السحب #{draw.draw_id}</b>\n\n"
+            f"⏰ <b>موعد السحب:</b> {datetime.fromtimestamp(draw.draw_at).strftime('%Y-%m-%d %H:%M')}\n"
+            f"💵 <b>سعر التذكرة:</b> {draw.price:,} كوين\n"
+            f"🎟️ <b>التذاكر المباعة:</b> {draw.total:,}\n"
+            f"💰 <b>الجائزة:</b> {draw.total * draw.price:,} كوين\n"
+            f"🙋 <b>تذاكرك:</b> {draw.per_user.get(user_id, 0):,}\n\n"
+            f"🔒 <b>التزام السحب (SHA-256):</b>\n<code>{draw.commitment}</code>\n"
+            f"تُكشف البذرة بعد السحب للتحقق من النتيجة\n\n"
+            f"📝 <b>الشراء:</b> /lottery <عدد التذاكر>"
+            f"{last_text}",
+            parse_mode='HTML'
+        )
         return
-    
+
+    try:
+        count = int(args[0])
+    except ValueError:
+        await update.message.reply_text("❌ عدد التذاكر يجب أن يكون رقماً!")
+        return
+
+    owned = draw.per_user.get(user_id, 0)
+    max_tickets = game_bot.settings['lottery_max_tickets']
+    if count <= 0 or owned + count > max_tickets:
+        await update.message.reply_text(f"❌ الحد الأقصى {max_tickets:,} تذكرة لكل سحب! لديك {owned:,} تذكرة")
+        return
+
+    user_data = game_bot.get_user_data(user_id)
+    cost = count * draw.price
+    if cost > user_data['balance']:
+        await update.message.reply_text(f"❌ رصيدك غير كافي! التكلفة: {cost:,} كوين، رصيدك: {user_data['balance']:,} كوين")
+        return
+
+    if not game_bot.adjust_balance(user_id, user_data, -cost, f"lottery:{draw.draw_id}",
+                                   LOTTERY_ACCOUNT, key=f"lottery:{update.update_id}"):
+        await update.message.reply_text("⚠️ تمت معالجة هذا الشراء مسبقاً")
+        return
+    draw.add(user_id, count)
+    game_bot.analytics.record_game(user_id, 'lottery', cost, -cost)
+    game_bot.save_data()
+    metrics.inc("lottery.tickets", count)
+
+    await update.message.reply_text(
+        f"✅ <b>تم شراء {count:,} تذكرة!</b>\n\n"
+        f"🎟️ <b>تذاكرك في السحب #{draw.draw_id}:</b> {owned + count:,}\n"
+        f"📈 <b>فرصة الفوز بالمركز الأول:</b> {(owned + count) / draw.total * 100:.2f}%\n"
+        f"💳 <b>رصيدك:</b> {user_data['balance']:,} كوين",
+        parse_mode='HTML'
+    )
+
+BLACKJACK_OUTCOMES = {
+    "blackjack": "🃏 <b>بلاك جاك!</b>",
+    "win": "🎉 <b>فزت!</b>",
+    "push": "🤝 <b>تعادل - استرددت رهانك</b>",
+    "lose": "😔 <b>خسرت</b>",
+    "bust": "💥 <b>تجاوزت 21!</b>",
+}
+
+def blackjack_keyboard(session: BlackjackSession, balance: int) -> InlineKeyboardMarkup:
+    row = [InlineKeyboardButton("➕ سحب", callback_data="bj_hit"),
+           InlineKeyboardButton("✋ وقوف", callback_data="bj_stand")]
+    if len(session.player.cards) == 2 and balance >= session.bet:
+        row.append(InlineKeyboardButton("✖️2 مضاعفة", callback_data="bj_double"))
+    return InlineKeyboardMarkup([row])
+
+def blackjack_table(session: BlackjackSession, reveal: bool) -> str:
+    return (
+        f"🃏 <b>البلاك جاك</b> - الرهان: {session.bet:,} كوين\n\n"
+        f"🎩 <b>الموزع:</b> {session.dealer.render(hide_second=not reveal)}\n"
+        f"🙋 <b>يدك:</b> {session.player.render()}\n"
+    )
+
+def finish_blackjack(session: BlackjackSession) -> str:
+    """كشف يد الموزع وتسوية الضمان وتحديث الإحصائيات - تُستدعى بعد إخراج الجلسة من المخزن"""
+    user_id = session.user_id
+    user_data = game_bot.get_user_data(user_id)
+    if session.player.total <= 21 and not session.player.is_blackjack:
+        session.play_dealer(blackjack_shoe)
+    payout, outcome = session.payout()
+    game_bot.settle_escrow(user_id, user_data, session.bet, payout, "game:blackjack")
+    record_game_result(user_id, 'blackjack', session.bet, payout - session.bet)
+    # الأوراق من الصندوق المشترك فلا nonce للجولة - النتيجة مجموع اللاعب × 100 + مجموع الموزع
+    game_bot.audit.append(user_id, 'blackjack', session.bet, payout - session.bet, 0,
+                          session.player.total * 100 + session.dealer.total)
+
+    user_data['games_played'] += 1
+    user_data['total_wagered'] += session.bet
+    user_data['favorite_game'] = 'blackjack'
+    game_field = count_game_round(user_data, 'blackjack')
+    profit = payout - session.bet
+    if profit > 0:
+        user_data['wins'] += 1
+        user_data['total_won'] += profit
+        user_data['exp'] += 12
+    elif profit < 0:
+        user_data['losses'] += 1
+        user_data['total_lost'] += -profit
+        user_data['exp'] += 4
+
+    result_text = blackjack_table(session, reveal=True) + (
+        f"\n{BLACKJACK_OUTCOMES[outcome]}\n"
+        f"💰 <b>النتيجة:</b> {profit:+,} كوين\n"
+        f"💳 <b>رصيدك:</b> {user_data['balance']:,} كوين"
+    )
+
+    old_level, new_level, level_bonus = game_bot.apply_level_ups(user_id, user_data)
+    if new_level > old_level:
+        result_text += f"\n🆙 <b>مستوى جديد! {old_level} → {new_level}</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
+
+    achievement_msg = game_bot.check_achievements(user_id, user_data, GAME_ROUND_FIELDS + (game_field,))
+    if achievement_msg:
+        result_text += f"\n{achievement_msg}"
+
+    game_bot.update_user_data(user_id, user_data)
+    metrics.inc(f"blackjack.{outcome}")
+    return result_text
+
+BLACKJACK_REPLAY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🃏 جولة جديدة", callback_data="game_blackjack"),
+     InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")]
+])
+
+async def close_abandoned_blackjack(bot, sessions: list):
+    """حسم الجولات المتروكة بالوقوف على اليد الحالية وتحديث رسالتها"""
+    for session in sessions:
+        text = finish_blackjack(session) + "\n\n⏰ انتهت مهلة الجولة - تم الوقوف تلقائياً"
+        metrics.inc("blackjack.abandoned")
+        try:
+            await bot.edit_message_text(text, chat_id=session.user_id, message_id=session.message_id,
+                                        reply_markup=BLACKJACK_REPLAY_KEYBOARD, parse_mode='HTML')
+        except TelegramError:
+            outbox.enqueue(session.user_id, text, parse_mode='HTML')
+
+@maintenance_check
+@ban_check
+@hot_path("game:blackjack")
+async def blackjack_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """لعبة البلاك جاك - توزيع الجولة وحجز الرهان"""
+    user_id = update.effective_user.id
+    user_data = game_bot.get_user_data(user_id)
+
+    session = blackjack_sessions.get(user_id)
+    if session is not None:
+        message = await update.message.reply_text(
+            blackjack_table(session, reveal=False) + "\n⚠️ لديك جولة قائمة، أكملها أولاً",
+            reply_markup=blackjack_keyboard(session, user_data['balance']), parse_mode='HTML'
+        )
+        # الجولة تنتقل إلى الرسالة الجديدة، وأزرار القديمة تُزال حتى لا تبقى معطلة
+        previous_message_id, session.message_id = session.message_id, message.message_id
+        try:
+            await context.bot.edit_message_reply_markup(chat_id=update.effective_chat.id,
+                                                        message_id=previous_message_id, reply_markup=None)
+        except TelegramError:
+            pass
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            f"🃏 <b>البلاك جاك</b>\n\n"
+            f"📝 <b>الاستخدام:</b> /blackjack <المبلغ>\n\n"
+            f"🎯 اقترب من 21 دون تجاوزها وتغلب على الموزع\n"
+            f"• الفوز: x2\n• البلاك جاك: x2.5\n• التعادل: استرداد الرهان\n"
+            f"• الموزع يقف عند 17\n\n"
+            f"💰 <b>حدود الرهان:</b> {game_bot.settings['min_bet']} - {game_bot.settings['max_bet']:,} كوين",
+            parse_mode='HTML'
+        )
+        return
+
     try:
         bet_amount = int(context.args[0])
-        bet_type = ' '.join(context.args[1:]).lower().strip()
     except ValueError:
         await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
         return
-    
-    # التحقق من صحة الرهان
+
     if bet_amount < game_bot.settings['min_bet']:
         await update.message.reply_text(f"❌ الحد الأدنى للرهان {game_bot.settings['min_bet']} كوين!")
         return
-    
+
     if bet_amount > game_bot.settings['max_bet']:
         await update.message.reply_text(f"❌ الحد الأقصى للرهان {game_bot.settings['max_bet']:,} كوين!")
         return
-    
+
     if bet_amount > user_data['balance']:
         await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين")
         return
-    
-    # دوران الروليت
-    winning_number = random.randint(0, 36)
-    red_numbers = {1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36}
-    
-    is_red = winning_number in red_numbers
-    is_black = winning_number != 0 and not is_red
-    is_even = winning_number != 0 and winning_number % 2 == 0
-    is_odd = winning_number != 0 and winning_number % 2 == 1
-    
-    # تحديد اللون
-    if winning_number == 0:
-        color = "🟢 أخضر"
-    elif is_red:
-        color = "🔴 أحمر"
-    else:
-        color = "⚫ أسود"
-    
-    # التحقق من الفوز وحساب المضاعف
-    won = False
-    multiplier = 0
-    win_description = ""
-    
-    # رقم مباشر
-    if bet_type.isdigit():
-        bet_number = int(bet_type)
-        if 0 <= bet_number <= 36 and bet_number == winning_number:
-            won = True
-            multiplier = 35
-            win_description = f"رقم مباشر ({bet_number})"
-    
-    # الألوان
-    elif bet_type in ["أحمر", "red"] and is_red:
-        won = True
-        multiplier = 1
-        win_description = "أحمر"
-    elif bet_type in ["أسود", "black"] and is_black:
-        won = True
-        multiplier = 1  
-        win_description = "أسود"
-    
-    # زوجي/فردي
-    elif bet_type in ["زوجي", "even"] and is_even:
-        won = True
-        multiplier = 1
-        win_description = "زوجي"
-    elif bet_type in ["فردي", "odd"] and is_odd:
-        won = True
-        multiplier = 1
-        win_description = "فردي"
-    
-    # الصفوف
-    elif bet_type in ["صف أول", "1st", "1-12"] and 1 <= winning_number <= 12:
-        won = True
-        multiplier = 2
-        win_description = "الصف الأول (1-12)"
-    elif bet_type in ["صف ثاني", "2nd", "13-24"] and 13 <= winning_number <= 24:
-        won = True
-        multiplier = 2
-        win_description = "الصف الثاني (13-24)"
-    elif bet_type in ["صف ثالث", "3rd", "25-36"] and 25 <= winning_number <= 36:
-        won = True
-        multiplier = 2
-        win_description = "الصف الثالث (25-36)"
-    
-    # تحديث الإحصائيات
-    user_data['games_played'] += 1
-    user_data['total_wagered'] += bet_amount
-    user_data['favorite_game'] = 'roulette'
-    
-    # حساب النتيجة
-    if won:
-        winnings = bet_amount * (multiplier + 1)  # المبلغ + الربح
-        profit = bet_amount * multiplier
-        user_data['balance'] += profit
-        user_data['wins'] += 1
-        user_data['total_won'] += profit
-        user_data['exp'] += min(10 + (multiplier // 5), 50)  # نقاط متغيرة حسب المضاعف
-        
-        result_text = f"""
-🎉 <b>مبروك! فزت في الروليت!</b>
 
-🎲 <b>النتيجة:</b> {winning_number} {color}
-🎯 <b>رهانك:</b> {bet_type} ({bet_amount:,} كوين)
-✅ <b>الفوز:</b> {win_description}
-💰 <b>المضاعف:</b> {multiplier}:1
-💵 <b>الربح:</b> {profit:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
-"""
-    else:
-        user_data['balance'] -= bet_amount
-        user_data['losses'] += 1
-        user_data['total_lost'] += bet_amount
-        user_data['exp'] += 3
-        
-        result_text = f"""
-😔 <b>للأسف! لم تفز هذه المرة</b>
+    if not game_bot.adjust_balance(user_id, user_data, -bet_amount, "escrow:blackjack",
+                                   ESCROW_ACCOUNT, key=f"blackjack:{update.update_id}"):
+        return
+    game_bot.save_data()
 
-🎲 <b>النتيجة:</b> {winning_number} {color}
-🎯 <b>رهانك:</b> {bet_type} ({bet_amount:,} كوين)
-❌ <b>خسارة:</b> -{bet_amount:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
-"""
-    
-    # فحص رفع المستوى
-    next_level_exp = game_bot.calculate_level_up_exp(user_data['level'])
-    if user_data['exp'] >= next_level_exp:
-        old_level = user_data['level']
-        user_data['level'] += 1
-        level_bonus = game_bot.settings['level_up_bonus']
-        user_data['balance'] += level_bonus
-        result_text += f"\n🆙 <b>تهانينا! ارتقيت من المستوى {old_level} إلى {user_data['level']}!</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
-    
-    # فحص الإنجازات
-    achievement_msg = game_bot.check_achievements(user_id, user_data)
-    if achievement_msg:
-        result_text += f"\n{achievement_msg}"
-    
-    game_bot.update_user_data(user_id, user_data)
-    
-    # إضافة أزرار للعب مرة أخرى
-    keyboard = [
-        [InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data="game_roulette"),
-         InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")],
-        [InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-         InlineKeyboardButton("💰 الرصيد", callback_data="show_balance")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
+    session = BlackjackSession(user_id, bet_amount)
+    session.deal(blackjack_shoe)
+    if session.player.is_blackjack:
+        await update.message.reply_text(finish_blackjack(session), reply_markup=BLACKJACK_REPLAY_KEYBOARD,
+                                        parse_mode='HTML')
+        return
+
+    message = await update.message.reply_text(
+        blackjack_table(session, reveal=False),
+        reply_markup=blackjack_keyboard(session, user_data['balance']), parse_mode='HTML'
+    )
+    session.message_id = message.message_id
+    await close_abandoned_blackjack(context.bot, blackjack_sessions.put(user_id, session))
+
+async def blackjack_action(query, action: str):
+    """سحب / وقوف / مضاعفة - كل إجراء بحث واحد في مخزن الجلسات"""
+    user_id = query.from_user.id
+    session = blackjack_sessions.get(user_id)
+    if session is None or session.message_id != query.message.message_id:
+        await query.edit_message_text("⌛ انتهت هذه الجولة", reply_markup=BLACKJACK_REPLAY_KEYBOARD)
+        return
+
+    user_data = game_bot.get_user_data(user_id)
+    if action == "double":
+        if len(session.player.cards) != 2 or user_data['balance'] < session.bet:
+            return
+        game_bot.adjust_balance(user_id, user_data, -session.bet, "escrow:blackjack", ESCROW_ACCOUNT)
+        session.bet *= 2
+        session.player.add(blackjack_shoe.draw())
+    elif action == "hit":
+        session.player.add(blackjack_shoe.draw())
+        if session.player.total < 21:
+            await query.edit_message_text(
+                blackjack_table(session, reveal=False),
+                reply_markup=blackjack_keyboard(session, user_data['balance']), parse_mode='HTML'
+            )
+            return
+    elif action != "stand":
+        return
+
+    blackjack_sessions.pop(user_id)
+    await query.edit_message_text(finish_blackjack(session), reply_markup=BLACKJACK_REPLAY_KEYBOARD,
+                                  parse_mode='HTML')
 
 # ===== معالجة الأزرار المحسنة =====
 
+@hot_path("callbacks")
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج الأزرار المحسن"""
     query = update.callback_query
@@ -945,6 +6105,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         user_data = game_bot.get_user_data(user_id)
+        if game_bot.lift_expired_ban(user_data):
+            game_bot.save_data()
         if user_data.get('is_banned', False):
             await query.edit_message_text(
                 f"🚫 تم حظرك من استخدام البوت!\nالسبب: {user_data.get('ban_reason', 'غير محدد')}"
@@ -967,13 +6129,21 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await show_achievements(query)
         elif data == "referral_info":
             await show_referral_info(query)
+        elif data == "investment_menu":
+            await show_investment_menu(query)
             
         # أزرار الألعاب
+        elif data.startswith("bj_"):
+            await blackjack_action(query, data[3:])
         elif data.startswith("game_"):
-            game_type = data.split("_")[1]
+            game_type = data[5:]
             await show_game_info(query, game_type)
             
         # أزرار الإدمن
+        elif data.startswith("search_page_") and is_admin(user_id):
+            await show_search_page(query, context, int(data.rsplit("_", 1)[1]))
+        elif data == "admin_reports" and is_admin(user_id):
+            await show_admin_reports(query)
         elif data.startswith("admin_") and is_admin(user_id):
             await handle_admin_buttons(query, data, context)
             
@@ -1011,6 +6181,43 @@ async def show_balance_inline(query):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(balance_text, reply_markup=reply_markup, parse_mode='HTML')
 
+async def show_achievements(query):
+    """عرض الإنجازات المحققة والمتبقية"""
+    user_data = game_bot.get_user_data(query.from_user.id)
+    earned = user_data.get('achievements', [])
+    engine = game_bot.achievements
+
+    lines = [f"✅ {engine.names.get(a, a)}" for a in earned]
+    lines += [f"🔒 {name}" for rule_id, name in engine.names.items() if rule_id not in earned]
+
+    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="main_menu")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        f"🎖️ <b>إنجازاتك ({len(earned)}/{len(engine.names)}):</b>\n\n" + "\n".join(lines),
+        reply_markup=reply_markup, parse_mode='HTML'
+    )
+
+async def show_admin_reports(query):
+    """تقرير الإدارة من زر لوحة التحكم"""
+    text, chart = await build_analytics_report()
+    await query.edit_message_text(text, parse_mode='HTML')
+    if chart:
+        await query.message.reply_photo(photo=chart, caption="📈 النشاط وربح الكازينو اليومي")
+
+async def show_referral_info(query):
+    """عرض نظام الإحالة كزر"""
+    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="main_menu")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        referral_overview(query.from_user.id, query.get_bot().username), reply_markup=reply_markup, parse_mode='HTML'
+    )
+
+async def show_investment_menu(query):
+    """عرض الاستثمارات كزر"""
+    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="main_menu")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(investment_overview(query.from_user.id), reply_markup=reply_markup, parse_mode='HTML')
+
 async def show_game_info(query, game_type):
     """عرض معلومات اللعبة"""
     game_info = {
@@ -1037,62 +6244,722 @@ async def show_game_info(query, game_type):
             "description": "اختر صورة أو كتابة واقلب العملة!",
             "command": "/coinflip <المبلغ> <صورة/كتابة>",
             "example": "/coinflip 200 صورة"
+        },
+        "blackjack": {
+            "name": "🃏 البلاك جاك",
+            "description": "اقترب من 21 دون تجاوزها وتغلب على الموزع! اسحب أو قف أو ضاعف رهانك من الأزرار",
+            "command": "/blackjack <المبلغ>",
+            "example": "/blackjack 100"
+        },
+        "lottery": {
+            "name": "🎫 اليانصيب اليومي",
+            "description": f"اشترِ تذاكر بسعر {game_bot.settings['lottery_ticket_price']} كوين - كلما زادت تذاكرك زادت فرصتك في السحب اليومي!",
+            "command": "/lottery <عدد التذاكر>",
+            "example": "/lottery 5"
         }
     }
     
+    keyboard = [
+        [InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu"),
+         InlineKeyboardButton("💰 رصيدي", callback_data="show_balance")]
+    ]
+    
     if game_type not in game_info:
-        await query.edit_message_text("❌ لعبة غير متوفرة")
+        if game_type not in game_registry:
+            await query.edit_message_text("❌ لعبة غير متوفرة")
+            return
+        # لعبة إضافية: تعليماتها من الإضافة نفسها
+        help_text = game_registry.get(game_type).help_text(game_bot.settings)
+        await query.edit_message_text(help_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
         return
     
     game = game_info[game_type]
     info_text = f"""
 {game['name']}
 
-📝 <b>الوصف:</b>
-{game['description']}
+📝 <b>الوصف:</b>
+{game['description']}
+
+🎮 <b>كيفية اللعب:</b>
+<code>{game['command']}</code>
+
+💡 <b>مثال:</b>
+<code>{game['example']}</code>
+
+💰 <b>حدود الرهان:</b>
+الحد الأدنى: {game_bot.settings['min_bet']} كوين
+الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
+"""
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
+
+# ===== الوضع المضمّن والمتصدرون =====
+
+class ResultCache:
+    """نتائج جاهزة بمدة صلاحية لكل مفتاح وترتيب LRU - تُبنى عند أول طلب بعد انتهاء الصلاحية فقط"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()   # المفتاح -> (ينتهي عند، القيمة)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_build(self, key, ttl: float, builder) -> Tuple[Any, bool]:
+        """القيمة المخزنة إن كانت صالحة وإلا بناؤها - يعيد (القيمة، هل كانت إصابة)"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[1], True
+        value = builder()
+        self._entries[key] = (now + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value, False
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+result_cache = ResultCache(INLINE_CACHE_MAX_ENTRIES)
+
+def build_leaderboard_text() -> str:
+    """أغنى اللاعبين - nlargest يمر على المستخدمين مرة واحدة دون فرز الكل"""
+    if isinstance(game_bot.users_data, TieredUserStore):
+        leaders = game_bot.users_data.top_balances(LEADERBOARD_SIZE)
+    else:
+        leaders = heapq.nlargest(
+            LEADERBOARD_SIZE,
+            ((user_id, data.get('balance', 0), data.get('level', 1))
+             for user_id, data in game_bot.users_data.items() if not data.get('is_banned')),
+            key=lambda row: row[1]
+        )
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"{medals.get(rank, f'{rank}.')} {html.escape(game_bot.directory.display_name(user_id))} - "
+             f"{balance:,} كوين (مستوى {level})"
+             for rank, (user_id, balance, level) in enumerate(leaders, 1)]
+    return "🏆 <b>المتصدرون</b>\n\n" + ("\n".join(lines) or "لا يوجد لاعبون بعد")
+
+def leaderboard_text() -> Tuple[str, bool]:
+    return result_cache.get_or_build((current_tenant.get().name, "leaderboard"), INLINE_CACHE_POLICY["top"][0], build_leaderboard_text)
+
+async def show_leaderboard(query):
+    """لوحة المتصدرين كزر - من نفس النص المخزن للوضع المضمّن"""
+    keyboard = [[InlineKeyboardButton("🔙 العودة", callback_data="main_menu")]]
+    await query.edit_message_text(leaderboard_text()[0], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+@maintenance_check
+@ban_check
+async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """لوحة المتصدرين"""
+    await update.message.reply_text(leaderboard_text()[0], parse_mode='HTML')
+
+def inline_article(result_id: str, title: str, description: str, text: str) -> InlineQueryResultArticle:
+    return InlineQueryResultArticle(
+        id=result_id, title=title, description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode='HTML')
+    )
+
+def build_inline_balance(user_id: int) -> list:
+    user_data = game_bot.users_data.get(str(user_id))
+    if user_data is None:
+        return [inline_article("balance", "💰 رصيدي", "ابدأ البوت أولاً", "🎮 ابدأ البوت بالأمر /start لتحصل على رصيدك!")]
+    text = (f"💰 <b>رصيدي:</b> {user_data['balance']:,} كوين\n"
+            f"🎯 <b>المستوى:</b> {user_data['level']}\n"
+            f"🏆 <b>الانتصارات:</b> {user_data['wins']:,}")
+    return [inline_article("balance", "💰 رصيدي", f"{user_data['balance']:,} كوين - المستوى {user_data['level']}", text)]
+
+def build_inline_top() -> list:
+    return [inline_article("top", "🏆 المتصدرون", f"أغنى {LEADERBOARD_SIZE} لاعبين", leaderboard_text()[0])]
+
+def build_inline_roulette() -> list:
+    bets = sorted({bet for bet in ROULETTE_BETS.values() if bet.multiplier < 35}, key=lambda bet: bet.key)
+    lines = "\n".join(f"• {bet.label}: {bet.multiplier}:1" for bet in bets)
+    text = (f"🎲 <b>الروليت الأوروبي</b>\n\n• رقم مباشر (0-36): 35:1\n{lines}\n\n"
+            f"📝 العب: /roulette <المبلغ> <الرهان>\n"
+            f"👥 في المجموعات: طاولة مشتركة تدور كل {ROULETTE_TABLE_WINDOW} ثانية")
+    return [inline_article("roulette", "🎲 الروليت", "أنواع الرهانات والمضاعفات", text)]
+
+# نوع الاستعلام -> الأسماء المقبولة
+INLINE_QUERY_ALIASES = {
+    "balance": ("balance", "رصيد", "رصيدي"),
+    "top": ("top", "leaderboard", "المتصدرون"),
+    "roulette": ("roulette", "روليت", "الروليت"),
+}
+
+def inline_query_kinds(text: str) -> list:
+    """الأنواع المطابقة لبادئة الاستعلام - الاستعلام الفارغ أو غير المعروف يعرض الكل"""
+    text = text.strip().lower()
+    kinds = [kind for kind, aliases in INLINE_QUERY_ALIASES.items()
+             if text and any(alias.startswith(text) for alias in aliases)]
+    return kinds or list(INLINE_QUERY_ALIASES)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """الوضع المضمّن: @bot balance | top | roulette من نتائج مخزنة"""
+    query = update.inline_query
+    user_id = query.from_user.id
+    kinds = inline_query_kinds(query.query)
+    if "balance" in kinds:
+        user_data = game_bot.users_data.get(str(user_id))
+        if user_data is not None and user_data.get('is_banned') and not is_admin(user_id):
+            await query.answer([], cache_time=INLINE_CACHE_POLICY["balance"][1], is_personal=True)
+            return
+
+    builders = {
+        # الرصيد والمتصدرون من بيانات هذا البوت، وشرح الروليت مشترك بين كل البوتات
+        "balance": ((current_tenant.get().name, "balance", user_id), lambda: build_inline_balance(user_id)),
+        "top": ((current_tenant.get().name, "top"), build_inline_top),
+        "roulette": (("roulette",), build_inline_roulette),
+    }
+    results = []
+    for kind in kinds:
+        key, builder = builders[kind]
+        articles, hit = result_cache.get_or_build(key, INLINE_CACHE_POLICY[kind][0], builder)
+        metrics.inc(f"inline.{'hits' if hit else 'misses'}")
+        metrics.inc(f"inline.queries.{kind}")
+        results.extend(articles)
+
+    hits, misses = metrics.counters["inline.hits"], metrics.counters["inline.misses"]
+    metrics.set("inline.hit_rate", hits / (hits + misses))
+    # مدة تخزين تيليجرام: أقصرها بين الأنواع المعروضة، وشخصية إذا تضمنت الرصيد
+    await query.answer(
+        results,
+        cache_time=min(INLINE_CACHE_POLICY[kind][1] for kind in kinds),
+        is_personal=any(INLINE_CACHE_POLICY[kind][2] for kind in kinds)
+    )
+
+# ===== المهام الدورية =====
+
+def process_due_task(kind: str, user_id: str, stamp: str, overdue: float, reminders: list) -> bool:
+    """تنفيذ مهمة مستحقة واحدة - تُتجاهل المهام التي تغير حقلها منذ جدولتها"""
+    user_data = game_bot.users_data.get(user_id)
+    if not user_data or user_data.get('is_banned'):
+        return False
+
+    if kind == RewardScheduler.DAILY_READY:
+        # لا نذكّر بمكافأة فات وقتها (مثلاً بعد توقف البوت طويلاً)
+        if (user_data.get('last_daily') == stamp and overdue < 86400
+                and game_bot.settings.get('daily_reminders', True)):
+            reminders.append((user_id, "🎁 مكافأتك اليومية جاهزة! استخدم /daily للحصول عليها 🔥"))
+        return False
+
+    if kind == RewardScheduler.STREAK_RESET:
+        if user_data.get('last_daily') == stamp and user_data.get('daily_streak'):
+            user_data['daily_streak'] = 0
+            return True
+        return False
+
+    if kind == RewardScheduler.VIP_EXPIRY:
+        if user_data.get('vip_expires') == stamp and user_data.get('vip_status'):
+            user_data['vip_status'] = False
+            user_data['vip_expires'] = None
+            reminders.append((user_id, "⭐ انتهت عضوية VIP الخاصة بك. شكراً لدعمك!"))
+            return True
+    return False
+
+@tenant_job
+async def scheduler_tick(context: ContextTypes.DEFAULT_TYPE):
+    """نبضة المجدول: معالجة المهام المستحقة على دفعات ضمن ميزانية زمنية"""
+    started = time.monotonic()
+    now = time.time()
+    reminders = []
+    changed = False
+
+    while time.monotonic() - started < SCHEDULER_TICK_BUDGET:
+        batch = reward_scheduler.pop_due(now, SCHEDULER_BATCH_SIZE)
+        if not batch:
+            break
+        for due, kind, user_id, stamp in batch:
+            try:
+                changed = process_due_task(kind, user_id, stamp, now - due, reminders) or changed
+            except Exception as e:
+                logger.error(f"خطأ في تنفيذ المهمة {kind} للمستخدم {user_id}: {e}")
+        await asyncio.sleep(0)
+
+    if changed:
+        game_bot.save_data()
+    reward_scheduler.save()
+
+    for user_id, text in reminders:
+        outbox.enqueue(int(user_id), text)
+
+@admin_only
+async def set_vip(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """منح عضوية VIP لمدة محددة أو إلغاؤها"""
+    if len(context.args) < 2:
+        await update.message.reply_text("📝 <b>الاستخدام:</b> /vip <المعرف> <الأيام|off>", parse_mode='HTML')
+        return
+
+    user_id = context.args[0]
+    if user_id not in game_bot.users_data:
+        await update.message.reply_text("❌ المستخدم غير موجود!")
+        return
+    user_data = game_bot.users_data[user_id]
+
+    if context.args[1].lower() in ['off', '0', 'لا']:
+        user_data['vip_status'] = False
+        user_data['vip_expires'] = None
+        game_bot.update_user_data(user_id, user_data)
+        await update.message.reply_text(f"✅ تم إلغاء VIP للمستخدم {user_id}")
+        return
+
+    try:
+        days = int(context.args[1])
+    except ValueError:
+        await update.message.reply_text("❌ عدد الأيام يجب أن يكون رقماً!")
+        return
+    if not 1 <= days <= VIP_MAX_DAYS:
+        await update.message.reply_text(f"❌ عدد الأيام يجب أن يكون بين 1 و{VIP_MAX_DAYS}!")
+        return
+
+    expires = datetime.now() + timedelta(days=days)
+    user_data['vip_status'] = True
+    user_data['vip_expires'] = expires.isoformat()
+    game_bot.update_user_data(user_id, user_data)
+    reward_scheduler.schedule_user(user_id, user_data)
+    await update.message.reply_text(
+        f"🌟 تم منح VIP للمستخدم {user_id} حتى {expires.strftime('%Y-%m-%d %H:%M')}"
+    )
+
+async def run_reconciliation(fix: bool = False) -> Dict[str, Any]:
+    """مطابقة أرصدة الدفتر مع أرصدة المستخدمين على دفعات لا تحجب حلقة الأحداث"""
+    started = time.monotonic()
+    checked = mismatched = drift = 0
+    samples = []
+
+    for user_id, stored_balance in iter_user_balances():
+        ledger_balance = game_bot.ledger.balance(user_account(user_id))
+        if ledger_balance != stored_balance:
+            mismatched += 1
+            drift += stored_balance - ledger_balance
+            if len(samples) < 10:
+                samples.append((user_id, ledger_balance, stored_balance))
+            if fix:
+                # السجل الكامل يُحمَّل للمستخدمين غير المتطابقين فقط
+                user_data = game_bot.users_data[user_id]
+                user_data['balance'] = ledger_balance
+                game_bot.users_data[user_id] = user_data
+        checked += 1
+        if checked % 5000 == 0:
+            await asyncio.sleep(0)
+
+    if fix and mismatched:
+        game_bot.save_data()
+    game_bot.ledger.checkpoint()
+
+    metrics.set("ledger.mismatched_users", 0 if fix else mismatched)
+    return {
+        'checked': checked,
+        'mismatched': mismatched,
+        'drift': drift,
+        'samples': samples,
+        'house': game_bot.ledger.balance(HOUSE_ACCOUNT),
+        'fees': game_bot.ledger.balance(FEES_ACCOUNT),
+        'elapsed': time.monotonic() - started,
+    }
+
+def format_reconciliation(report: Dict[str, Any]) -> str:
+    samples = "\n".join(
+        f"• {user_id}: الدفتر {ledger:,} / المخزن {stored:,}" for user_id, ledger, stored in report['samples']
+    )
+    return (
+        f"🧾 <b>مطابقة الدفتر</b>\n\n"
+        f"👥 تم فحص: {report['checked']:,} مستخدم\n"
+        f"⚠️ غير متطابق: {report['mismatched']:,}\n"
+        f"📉 الفرق الإجمالي: {report['drift']:+,} كوين\n"
+        f"🏦 رصيد الكازينو: {report['house']:+,} كوين\n"
+        f"🧾 الرسوم المحصلة: {report['fees']:,} كوين\n"
+        f"⏱️ المدة: {report['elapsed']:.2f} ثانية\n\n{samples}"
+    )
+
+@tenant_job
+async def reconciliation_job(context: ContextTypes.DEFAULT_TYPE):
+    """مهمة دورية لمطابقة الدفتر وتنبيه المشرفين عند وجود فروقات"""
+    report = await run_reconciliation()
+    if report['mismatched']:
+        logger.warning(f"مطابقة الدفتر: {report['mismatched']} مستخدم غير متطابق")
+        for admin_id in current_tenant.get().admins:
+            outbox.enqueue(admin_id, format_reconciliation(report), parse_mode='HTML')
+
+@admin_only
+async def reconcile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """مطابقة الدفتر يدوياً (fix لتصحيح الأرصدة من الدفتر)"""
+    fix = bool(context.args) and context.args[0].lower() == "fix"
+    report = await run_reconciliation(fix)
+    await update.message.reply_text(format_reconciliation(report), parse_mode='HTML')
+
+def describe_audit_outcome(game: str, outcome: int) -> str:
+    if game == "blackjack":
+        return f"{outcome // 100} مقابل الموزع {outcome % 100}"
+    if game == "lottery":
+        return f"التذكرة الفائزة {outcome:,}"
+    if game in game_registry:
+        return game_registry.get(game).describe_outcome(outcome)
+    return str(outcome)
+
+@admin_only
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """جولات مستخدم من سجل التدقيق لحسم الاعتراضات، أو verify للتحقق من سلسلة التجزئة"""
+    args = context.args or []
+    if args and args[0].lower() == "verify":
+        ok, text = await asyncio.to_thread(game_bot.audit.verify, game_bot.audit.head())
+        metrics.inc("audit.verify_ok" if ok else "audit.verify_failed")
+        await update.message.reply_text(f"{'✅' if ok else '🚨'} {text}")
+        return
+    try:
+        user_id = int(args[0])
+        limit = min(int(args[1]), AUDIT_MAX_ROUNDS_SHOWN) if len(args) > 1 else 10
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "📝 <b>الاستخدام:</b>\n/audit <معرف المستخدم> [العدد] - آخر جولاته\n/audit verify - التحقق من سلامة السجل",
+            parse_mode='HTML'
+        )
+        return
+
+    rounds = await asyncio.to_thread(game_bot.audit.user_rounds, user_id, limit)
+    if not rounds:
+        await update.message.reply_text(f"📭 لا توجد جولات مسجلة للمستخدم {user_id}")
+        return
+    lines = [
+        f"🕐 {datetime.fromtimestamp(timestamp).strftime('%m-%d %H:%M:%S')} - {game} - "
+        f"{bet:,} ← {net:+,}\n   🎯 {html.escape(describe_audit_outcome(game, outcome))} - 🔑 <code>{nonce:016x}</code>"
+        for timestamp, _, game, bet, net, nonce, outcome in rounds
+    ]
+    await update.message.reply_text(
+        f"🧾 <b>آخر {len(rounds)} جولة للمستخدم {user_id}:</b>\n\n" + "\n".join(lines) +
+        "\n\n💡 النتيجة = random.Random(nonce) كما سحبتها اللعبة - عدا البلاك جاك (صندوق مشترك، nonce صفر) "
+        "واليانصيب (nonce رقم السحب، والتحقق عبر verify-lottery)",
+        parse_mode='HTML'
+    )
+
+async def settle_lottery(result: Dict[str, Any]):
+    """دفع الجوائز بقيود لها مفاتيح (آمنة لإعادة التنفيذ) ثم إبلاغ المشاركين على دفعات"""
+    draw_id = result['draw_id']
+    game_bot.ledger.post("lottery:house_cut", [
+        (LOTTERY_ACCOUNT, -result['house_cut']), (HOUSE_ACCOUNT, result['house_cut'])
+    ], key=f"lottery:{draw_id}:house_cut")
+
+    winners = {}
+    for winner in result['winners']:
+        user_id = winner['user_id']
+        user_data = game_bot.users_data.get(str(user_id))
+        if user_data is None:
+            logger.error(f"فائز غير موجود في السحب #{draw_id}: {user_id}")
+            continue
+        winners[user_id] = winner
+        # إعادة التسوية بعد انقطاع لا تكرر الجائزة ولا سجلها
+        if not game_bot.adjust_balance(user_id, user_data, winner['prize'], f"lottery:{draw_id}",
+                                       LOTTERY_ACCOUNT, key=f"lottery:{draw_id}:prize:{winner['rank']}"):
+            continue
+        game_bot.analytics.record(ANALYTICS_PAYOUT, user_id, ANALYTICS_GAMES.index('lottery') + 1, net=winner['prize'])
+        # التذاكر دُفعت عند الشراء فالرهان صفر - النتيجة مشتقة من بذرة السحب المكشوفة لا من nonce
+        game_bot.audit.append(user_id, 'lottery', 0, winner['prize'], draw_id, winner['ticket'])
+    game_bot.save_data()
+
+    # إبلاغ المشاركين بقراءة ملف التذاكر تسلسلياً مع احترام سعة طابور الإرسال
+    notified = set()
+    path = os.path.join(lottery.folder, result['tickets_file'])
+    for user_id, _ in (iter_lottery_tickets(path) if os.path.exists(path) else ()):
+        if user_id in notified:
+            continue
+        notified.add(user_id)
+        if user_id in winners:
+            winner = winners[user_id]
+            text = f"🎉 مبروك! فزت بالمركز {winner['rank']} في اليانصيب #{draw_id} وربحت {winner['prize']:,} كوين!"
+        else:
+            text = f"🎫 انتهى سحب اليانصيب #{draw_id}. حظاً أوفر في السحب القادم!"
+        outbox.enqueue(user_id, text)
+        if len(notified) % LOTTERY_PAYOUT_BATCH == 0:
+            while outbox.pending > OUTBOX_MAX_SIZE // 2:
+                await asyncio.sleep(1)
+            await asyncio.sleep(0)
+
+    result['paid'] = True
+    lottery.write_result(result)
+    metrics.inc("lottery.draws")
+    logger.info(f"تمت تسوية اليانصيب #{draw_id}: {result['total_tickets']:,} تذكرة، {len(notified):,} مشارك")
+
+@tenant_job
+async def lottery_job(context: ContextTypes.DEFAULT_TYPE):
+    """إجراء السحب عند حلول موعده وتسوية أي سحب لم تكتمل تسويته"""
+    if lottery.is_due(time.time()):
+        result = lottery.draw(game_bot.settings)
+        logger.info(f"سحب اليانصيب #{result['draw_id']}: {len(result['winners'])} فائز")
+    while lottery.pending:
+        await settle_lottery(lottery.pending[0])
+        lottery.pending.pop(0)
+
+def settle_tournament(tournament: Tournament):
+    """صرف جوائز البطولة المنتهية بقيد واحد ثم إغلاقها - آمن لإعادة التنفيذ بعد انقطاع"""
+    awards, house = tournament.prizes()
+    postings = [(user_account(user_id), prize) for user_id, _, prize in awards]
+    posted = game_bot.ledger.post("tournament:prizes", postings + [
+        (TOURNAMENT_ACCOUNT, -tournament.pot), (HOUSE_ACCOUNT, house)
+    ], key=f"tournament:{tournament.tournament_id}:prizes")
+    if posted is not None:
+        for user_id, _, prize in awards:
+            game_bot.get_user_data(user_id, touch=False)['balance'] += prize
+        game_bot.save_data()
 
-🎮 <b>كيفية اللعب:</b>
-<code>{game['command']}</code>
+    tournament.results = [{'rank': rank, 'user_id': user_id, 'score': score, 'prize': prize}
+                          for rank, (user_id, score, prize) in enumerate(awards, 1)]
+    tournaments.close(tournament)
+    tournaments.save()
+    for entry in tournament.results:
+        outbox.enqueue(entry['user_id'],
+                       f"🏆 مبروك! حصلت على المركز {entry['rank']} في البطولة #{tournament.tournament_id} "
+                       f"وربحت {entry['prize']:,} كوين!")
+    metrics.inc("tournaments.closed")
+    logger.info(f"انتهت البطولة #{tournament.tournament_id}: {len(tournament.scores):,} مشترك، "
+                f"جائزة {tournament.pot:,} كوين")
 
-💡 <b>مثال:</b>
-<code>{game['example']}</code>
+def refund_tournament(tournament: Tournament):
+    """إعادة رسوم الدخول بقيود مجمعة لكل دفعة من المشتركين"""
+    participants = list(tournament.scores)
+    fee = tournament.entry_fee
+    for start in range(0, len(participants), LEDGER_OPENING_BATCH):
+        batch = participants[start:start + LEDGER_OPENING_BATCH]
+        posted = game_bot.ledger.post("tournament:refund", [(user_account(user_id), fee) for user_id in batch] + [
+            (TOURNAMENT_ACCOUNT, -fee * len(batch))
+        ], key=f"tournament:{tournament.tournament_id}:refund:{start}")
+        if posted is not None:
+            for user_id in batch:
+                game_bot.get_user_data(user_id, touch=False)['balance'] += fee
+    game_bot.save_data()
+    tournaments.close(tournament, "cancelled")
+    tournaments.save()
 
-💰 <b>حدود الرهان:</b>
-الحد الأدنى: {game_bot.settings['min_bet']} كوين
-الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
-"""
-    
-    keyboard = [
-        [InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu"),
-         InlineKeyboardButton("💰 رصيدي", callback_data="show_balance")]
+@tenant_job
+async def tournament_job(context: ContextTypes.DEFAULT_TYPE):
+    """تفريغ طابور نتائج البطولات وإغلاق المنتهية منها"""
+    drained = tournaments.drain()
+    if drained:
+        metrics.inc("tournaments.scores", drained)
+    now = time.time()
+    for tournament in tournaments.due(now):
+        # الجولات المحسومة قبل نهاية البطولة تُحتسب قبل الترتيب النهائي
+        while tournaments.drain():
+            await asyncio.sleep(0)
+        settle_tournament(tournament)
+    if now - context.job.data['saved_at'] >= TOURNAMENT_SAVE_SECONDS:
+        tournaments.save()
+        context.job.data['saved_at'] = now
+    metrics.set("tournaments.queue", len(tournaments.queue))
+
+@tenant_job
+async def blackjack_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    """حسم جولات البلاك جاك المتروكة"""
+    expired = blackjack_sessions.pop_expired(time.monotonic())
+    if expired:
+        await close_abandoned_blackjack(context.bot, expired)
+    metrics.set("blackjack.open_sessions", len(blackjack_sessions))
+
+def refund_open_sessions():
+    """إعادة رهانات الجولات المفتوحة عند الإيقاف لأن الجلسات لا تُحفظ على القرص"""
+    sessions = blackjack_sessions.values()
+    for session in sessions:
+        blackjack_sessions.pop(session.user_id)
+        user_data = game_bot.get_user_data(session.user_id, touch=False)
+        game_bot.settle_escrow(session.user_id, user_data, session.bet, session.bet, "escrow:refund")
+    tables = list(roulette_tables.values())
+    roulette_tables.clear()
+    for table in tables:
+        stakes = table.stakes()
+        game_bot.settle_escrow_batch(
+            [(user_id, game_bot.get_user_data(user_id, touch=False), stake, stake) for user_id, stake in stakes.items()],
+            "escrow:refund", key=f"roulette_table:{table.chat_id}:{table.table_id}"
+        )
+    if sessions or tables:
+        game_bot.save_data()
+        logger.info(f"تمت إعادة رهانات {len(sessions)} جولة مفتوحة و{len(tables)} طاولة روليت")
+
+@tenant_job
+async def investment_job(context: ContextTypes.DEFAULT_TYPE):
+    """صرف الاستثمارات المستحقة على دفعات - لا يُقرأ أي مركز لم يحن موعده"""
+    started = time.monotonic()
+    settled = 0
+    while time.monotonic() - started < SCHEDULER_TICK_BUDGET:
+        matured = investments.pop_matured(time.time(), SCHEDULER_BATCH_SIZE)
+        if not matured:
+            break
+        for position in matured:
+            user_data = game_bot.users_data.get(str(position.user_id))
+            if user_data is None:
+                logger.error(f"استثمار #{position.position_id} لمستخدم غير موجود: {position.user_id}")
+                continue
+            payout = position.value_at(position.matures_at)
+            if game_bot.settle_escrow(position.user_id, user_data, position.principal, payout, "invest:mature",
+                                      account=INVESTMENT_ACCOUNT, key=f"invest:{position.position_id}:mature"):
+                outbox.enqueue(
+                    position.user_id,
+                    f"📈 استحق استثمارك #{position.position_id}: +{payout:,} كوين "
+                    f"(ربح {payout - position.principal:,} كوين)"
+                )
+        settled += len(matured)
+        # حفظ واحد لكل دفعة بدلاً من حفظ لكل مستخدم
+        game_bot.save_data()
+        investments.save()
+        await asyncio.sleep(0)
+
+    if settled:
+        metrics.inc("investments.settled", settled)
+        logger.info(f"تم صرف {settled:,} استثمار مستحق")
+    metrics.set("investments.open", len(investments))
+
+@tenant_job
+async def referral_analysis_job(context: ContextTypes.DEFAULT_TYPE):
+    """تحليل شبكة الإحالات في خيط منفصل وتنبيه المشرفين بالحلقات وتجمعات الحسابات الوهمية"""
+    activity = {}
+    for count, user_id in enumerate(list(referral_graph.referrer), 1):
+        user_data = game_bot.users_data.get(user_id)
+        if user_data is not None:
+            activity[user_id] = (user_data.get('games_played', 0), datetime.fromisoformat(user_data['join_date']).timestamp())
+        if count % 5000 == 0:
+            await asyncio.sleep(0)
+
+    report = await asyncio.to_thread(analyze_referrals, dict(referral_graph.referrer), activity)
+    referral_graph.subtree_sizes = report['sizes']
+    metrics.set("referrals.rings", len(report['rings']))
+    metrics.set("referrals.suspect_clusters", len(report['clusters']))
+
+    # التنبيه فقط عند ظهور نتائج جديدة حتى لا يتكرر نفس التقرير كل دورة
+    suspects = report['rings'] + [cluster['members'] for cluster in report['clusters']]
+    if not suspects or suspects == referral_graph.suspects:
+        referral_graph.suspects = suspects
+        return
+    referral_graph.suspects = suspects
+
+    lines = [f"🔁 حلقة: {' → '.join(ring)}" for ring in report['rings'][:5]]
+    lines += [
+        f"🕸️ تجمع: {', '.join(cluster['members'][:10])} ({cluster['referees']:,} مدعو)"
+        for cluster in report['clusters'][:5]
     ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
+    text = (
+        f"🚨 <b>تحليل الإحالات</b>\n\n"
+        f"🔁 الحلقات: {len(report['rings'])}\n"
+        f"🕸️ التجمعات المشبوهة: {len(report['clusters'])}\n\n" + "\n".join(lines)
+    )
+    for admin_id in current_tenant.get().admins:
+        outbox.enqueue(admin_id, text, parse_mode='HTML')
 
-def main():
-    """تشغيل البوت المحسن"""
+@tenant_job
+async def search_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """حذف الرسائل الأقدم من مدة الاحتفاظ من فهرس البحث"""
+    deleted = game_bot.search_index.prune(int(time.time()) - SEARCH_RETENTION_DAYS * 86400)
+    if deleted:
+        logger.info(f"تم حذف {deleted:,} رسالة قديمة من فهرس البحث")
+
+@tenant_job
+async def analytics_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    """إلحاق أحداث التحليلات المخزنة بملفات الأعمدة"""
+    game_bot.analytics.flush()
+
+@tenant_job
+async def audit_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """فهرسة أيام سجل التدقيق المغلقة وضغط ما تجاوز AUDIT_PLAIN_DAYS"""
+    indexed, compressed = await asyncio.to_thread(game_bot.audit.maintain, time.time())
+    if indexed or compressed:
+        logger.info(f"سجل التدقيق: فهرسة {indexed} يوم وضغط {compressed} يوم")
+
+@tenant_job
+async def directory_save_job(context: ContextTypes.DEFAULT_TYPE):
+    """حفظ دليل المستخدمين إذا تغير اسم أو انضم مستخدم جديد"""
+    game_bot.directory.save()
+
+@tenant_job
+async def users_save_job(context: ContextTypes.DEFAULT_TYPE):
+    """حفظ المستخدمين مرة واحدة لكل دفعة جولات بدلاً من حفظ الملف كاملاً بعد كل جولة"""
+    game_bot.flush_users()
+
+@tenant_job
+async def settings_reload_job(context: ContextTypes.DEFAULT_TYPE):
+    """التقاط تعديلات الإعدادات التي كتبتها عملية أخرى على نفس الملف"""
+    if game_bot.settings_store.reload_if_changed():
+        metrics.inc("settings.reloads")
+    metrics.set("settings.version", game_bot.settings.version)
+
+@tenant_job
+async def tiering_job(context: ContextTypes.DEFAULT_TYPE):
+    """نقل المستخدمين الخاملين إلى الأرشيف المضغوط على دفعات"""
+    store = game_bot.users_data
+    cutoff = (datetime.now() - timedelta(days=USER_COLD_AFTER_DAYS)).isoformat()
+    evicted = 0
+    while True:
+        moved = store.evict(cutoff, USER_HOT_MAX, USER_EVICT_PROTECT_SECONDS, USER_EVICT_BATCH)
+        evicted += moved
+        if moved < USER_EVICT_BATCH:
+            break
+        await asyncio.sleep(0)
+    if evicted:
+        # الملف الرئيسي يجب ألا يحتفظ بنسخة أقدم من المنقولين
+        game_bot.save_data()
+        metrics.inc("users.evicted", evicted)
+    metrics.set("users.hot", len(store.hot))
+    metrics.set("users.cold", store.cold_count)
+
+def build_application(tenant: Tenant) -> Application:
+    """تطبيق تيليجرام لبوت واحد - نفس المعالجات لكل البوتات، والحالة من سياق البوت"""
+    context_token = current_tenant.set(tenant)
+    try:
+        return setup_application(tenant)
+    finally:
+        current_tenant.reset(context_token)
+
+def setup_application(tenant: Tenant) -> Application:
+    """تسجيل المعالجات والمهام وتحميل محركات البوت - يُستدعى داخل سياقه"""
     # إنشاء التطبيق
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = Application.builder().token(tenant.token).build()
+    app.bot_data['tenant'] = tenant
     
     # إضافة معالج الأخطاء
     app.add_error_handler(error_handler)
     
+    # تحديد البوت ثم الحماية من الإغراق بحدوده قبل أي معالج آخر
+    app.add_handler(TypeHandler(Update, enter_tenant), group=-2)
+    app.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    
     # إضافة معالج تسجيل الرسائل
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, log_all_messages), group=1)
+    app.add_handler(TypeHandler(Update, track_user), group=2)
     
     # الأوامر الأساسية
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("balance", balance))
     app.add_handler(CommandHandler("daily", daily_reward))
+    app.add_handler(CommandHandler("transfer", transfer))
+    app.add_handler(CommandHandler("invest", invest))
+    app.add_handler(CommandHandler("referral", referral))
+    app.add_handler(CommandHandler("tournament", tournament_command))
+    app.add_handler(CommandHandler("leaderboard", leaderboard))
+    app.add_handler(InlineQueryHandler(inline_query))
     
     # أوامر الإدمن
     app.add_handler(CommandHandler("admin", admin_panel))
     app.add_handler(CommandHandler("settings", bot_settings))
     app.add_handler(CommandHandler("userinfo", user_info))
+    app.add_handler(CommandHandler("usermessages", user_messages))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("vip", set_vip))
+    app.add_handler(CommandHandler("backfill_achievements", backfill_achievements))
+    app.add_handler(CommandHandler("metrics", show_metrics))
+    app.add_handler(CommandHandler("addmoney", add_money))
+    app.add_handler(CommandHandler("removemoney", remove_money))
+    app.add_handler(CommandHandler("bulk", bulk_command))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/bulk(@\w+)?\b"), bulk_caption))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("reconcile", reconcile))
+    app.add_handler(CommandHandler("audit", audit_command))
+    app.add_handler(CommandHandler("search", search_messages))
+    app.add_handler(CommandHandler("find", find_user))
+    app.add_handler(CommandHandler("stats_admin", stats_admin))
     
     # أوامر الألعاب
-    app.add_handler(CommandHandler("roulette", roulette_game))
+    for name in game_registry.names():
+        app.add_handler(CommandHandler(name, game_command(name)))
+    app.add_handler(CommandHandler("blackjack", blackjack_game))
+    app.add_handler(CommandHandler("lottery", lottery_game))
     
     # معالج الأزرار
     app.add_handler(CallbackQueryHandler(button_callback))
@@ -1106,59 +6973,179 @@ def main():
         BotCommand("slots", "آلة القمار"),
         BotCommand("dice", "لعبة النرد"),
         BotCommand("coinflip", "قلب العملة"),
+        BotCommand("blackjack", "البلاك جاك"),
+        BotCommand("lottery", "اليانصيب اليومي"),
         BotCommand("stats", "الإحصائيات"),
         BotCommand("transfer", "تحويل الأموال"),
+        BotCommand("invest", "الاستثمار"),
+        BotCommand("referral", "نظام الإحالة"),
+        BotCommand("tournament", "البطولات"),
+        BotCommand("leaderboard", "لوحة المتصدرين"),
     ]
+    # الألعاب المكتشفة من GAME_PLUGINS_FOLDER تظهر بأسمائها دون تحميلها
+    listed = {command.command for command in commands}
+    commands += [BotCommand(name, name) for name in game_registry.names() if name not in listed]
     
     # إضافة أوامر الإدمن للمشرفين
     admin_commands = [
         BotCommand("admin", "لوحة تحكم المشرف"),
         BotCommand("settings", "إعدادات البوت"),
         BotCommand("userinfo", "معلومات مستخدم"),
+        BotCommand("usermessages", "رسائل مستخدم"),
         BotCommand("broadcast", "رسالة جماعية"),
-        BotCommand("backup", "نسخة احتياطية")
+        BotCommand("backup", "نسخة احتياطية"),
+        BotCommand("profile", "محلل الأداء"),
+        BotCommand("vip", "إدارة عضوية VIP"),
+        BotCommand("metrics", "مقاييس التشغيل"),
+        BotCommand("reconcile", "مطابقة دفتر القيود"),
+        BotCommand("audit", "سجل تدقيق الجولات"),
+        BotCommand("bulk", "عمليات جماعية"),
+        BotCommand("export", "تصدير البيانات"),
+        BotCommand("search", "البحث في الرسائل"),
+        BotCommand("find", "البحث عن مستخدم"),
+        BotCommand("stats_admin", "إحصائيات تفصيلية")
     ]
     
+    # المهام الدورية
+    metrics.set("settings.version", game_bot.settings.version)
+    reward_scheduler.load(game_bot.users_data)
+    lottery.load(game_bot.settings)
+    investments.load()
+    tournaments.load()
+    referral_graph.build(game_bot.users_data)
+    if not len(game_bot.search_index):
+        indexed = game_bot.search_index.backfill(game_bot.messages_log)
+        logger.info(f"تمت فهرسة {indexed:,} رسالة للبحث")
+    if app.job_queue is None:
+        logger.warning("JobQueue غير متوفر - ثبّت python-telegram-bot[job-queue] لتفعيل المهام المجدولة")
+    else:
+        app.job_queue.run_repeating(scheduler_tick, interval=SCHEDULER_TICK_SECONDS, first=10)
+        app.job_queue.run_repeating(reconciliation_job, interval=RECONCILE_INTERVAL_SECONDS, first=RECONCILE_INTERVAL_SECONDS)
+        app.job_queue.run_repeating(lottery_job, interval=LOTTERY_CHECK_SECONDS, first=30)
+        app.job_queue.run_repeating(investment_job, interval=SCHEDULER_TICK_SECONDS, first=20)
+        app.job_queue.run_repeating(tournament_job, interval=TOURNAMENT_TICK_SECONDS, first=TOURNAMENT_TICK_SECONDS,
+                                    data={'saved_at': time.time()})
+        app.job_queue.run_repeating(referral_analysis_job, interval=REFERRAL_ANALYSIS_SECONDS, first=300)
+        app.job_queue.run_repeating(search_maintenance_job, interval=86400, first=3600)
+        app.job_queue.run_repeating(analytics_flush_job, interval=ANALYTICS_FLUSH_SECONDS, first=ANALYTICS_FLUSH_SECONDS)
+        app.job_queue.run_repeating(directory_save_job, interval=DIRECTORY_SAVE_SECONDS, first=DIRECTORY_SAVE_SECONDS)
+        app.job_queue.run_repeating(users_save_job, interval=USERS_SAVE_SECONDS, first=USERS_SAVE_SECONDS)
+        app.job_queue.run_repeating(audit_maintenance_job, interval=AUDIT_MAINTENANCE_SECONDS, first=120)
+        app.job_queue.run_repeating(blackjack_sweep_job, interval=BLACKJACK_SWEEP_SECONDS, first=BLACKJACK_SWEEP_SECONDS)
+        app.job_queue.run_repeating(settings_reload_job, interval=SETTINGS_POLL_SECONDS, first=SETTINGS_POLL_SECONDS)
+        if isinstance(game_bot.users_data, TieredUserStore):
+            app.job_queue.run_repeating(tiering_job, interval=USER_TIERING_SECONDS, first=60)
+    
     async def post_init(app):
         """إعدادات ما بعد التهيئة"""
+        outbox.start(app)
         try:
             await app.bot.set_my_commands(commands)
             logger.info("تم تعيين قائمة الأوامر بنجاح")
         except Exception as e:
             logger.error(f"فشل في تعيين الأوامر: {e}")
     
+    async def post_shutdown(app):
+        """تسوية الحالة غير المحفوظة قبل الخروج"""
+        refund_open_sessions()
+        game_bot.search_index.close()
+        game_bot.directory.save()
+        game_bot.analytics.flush()
+        while tournaments.drain():
+            pass
+        tournaments.save()
+        game_bot.flush_users()
+        game_bot.audit.close()
+    
     # تعيين callback للتهيئة
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
+    return app
+
+async def serve_application(app: Application, stop: asyncio.Event):
+    """دورة حياة تطبيق واحد - كل المهام التي ينشئها ترث سياق بوته من هذه المهمة"""
+    tenant = app.bot_data['tenant']
+    current_tenant.set(tenant)
+    try:
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        await app.start()
+    except Exception as e:
+        # فشل بوت واحد (رمز خاطئ مثلاً) لا يوقف البقية
+        logger.critical(f"تعذر تشغيل البوت {tenant.name}: {e}")
+        return
+    await stop.wait()
+    try:
+        await app.updater.stop()
+        await app.stop()
+    finally:
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+async def run_applications(apps: list):
+    """تشغيل كل البوتات في حلقة أحداث واحدة حتى إشارة الإيقاف"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await asyncio.gather(*(serve_application(app, stop) for app in apps))
+
+def main():
+    """تشغيل البوت المحسن وأي بوتات إضافية من TENANTS_FILE في نفس العملية"""
+    discovered = game_registry.discover(GAME_PLUGINS_FOLDER)
+    apps = [build_application(tenant) for tenant in [main_tenant] + load_tenants()]
     
     print("🤖 البوت المطور يعمل الآن...")
     print(f"📱 الإصدار: {BOT_VERSION}")
     print(f"👑 المشرفين: {ADMIN_IDS}")
     print(f"🔧 وضع الصيانة: {'مفعل' if game_bot.is_maintenance_mode() else 'معطل'}")
+    print(f"🤖 البوتات: {', '.join(tenants)}")
+    if discovered:
+        print(f"🧩 ألعاب إضافية: {', '.join(discovered)}")
     print("🎮 الألعاب المتاحة: الروليت، القمار، النرد، قلب العملة")
     print("📊 النظام: تسجيل الرسائل، إدارة المستخدمين، النسخ الاحتياطية")
     print("\n✅ البوت جاهز لاستقبال الرسائل!")
     
     # تشغيل البوت
-    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if len(apps) == 1:
+        apps[0].run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    else:
+        asyncio.run(run_applications(apps))
 
 # ===== باقي الألعاب المحسنة =====
 
-@maintenance_check
-@ban_check
-async def slots_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """لعبة آلة القمار المحسنة"""
-    user_id = update.effective_user.id
-    user_data = game_bot.get_user_data(user_id)
-    
-    if not context.args:
-        help_text = f"""
+class SlotsGame(GamePlugin):
+    """آلة القمار: ثلاث بكرات برموز موزونة"""
+
+    name = "slots"
+    min_args = 1
+    # الرمز، الوزن، مضاعف الثلاثة المتطابقة، عنوان الفوز
+    SYMBOLS = (
+        ("🍋", 30, 4, "🍋 WIN!"), ("🍊", 25, 5, "🍊 NICE!"), ("🍇", 20, 6, "🍇 GOOD!"), ("🍒", 15, 8, "🍒 GREAT!"),
+        ("⭐", 8, 10, "⭐ BIG WIN!"), ("7️⃣", 5, 15, "🎰 SUPER WIN!"), ("💎", 2, 20, "💎 JACKPOT! 💎"),
+    )
+
+    def __init__(self):
+        # القائمة الموزونة تُبنى مرة واحدة عند تحميل اللعبة بدلاً من كل جولة
+        self.reel = [symbol for symbol, weight, _, _ in self.SYMBOLS for _ in range(weight)]
+        self.triples = {symbol: (multiplier, title) for symbol, _, multiplier, title in self.SYMBOLS}
+        self.positions = {entry[0]: position for position, entry in enumerate(self.SYMBOLS)}
+
+    def help_text(self, settings) -> str:
+        return f"""
 🎰 <b>آلة القمار المتطورة</b>
 
 📝 <b>الاستخدام:</b> /slots <المبلغ>
 
 💰 <b>حدود الرهان:</b>
-الحد الأدنى: {game_bot.settings['min_bet']} كوين
-الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
+الحد الأدنى: {settings['min_bet']} كوين
+الحد الأقصى: {settings['max_bet']:,} كوين
 
 🎯 <b>الرموز والمضاعفات:</b>
 💎💎💎 - مضاعف x20
@@ -1172,152 +7159,74 @@ async def slots_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 مثال: /slots 100
 """
-        await update.message.reply_text(help_text, parse_mode='HTML')
-        return
-    
-    try:
-        bet_amount = int(context.args[0])
-    except ValueError:
-        await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
-        return
-    
-    # التحقق من صحة الرهان
-    if bet_amount < game_bot.settings['min_bet']:
-        await update.message.reply_text(f"❌ الحد الأدنى للرهان {game_bot.settings['min_bet']} كوين!")
-        return
-    
-    if bet_amount > game_bot.settings['max_bet']:
-        await update.message.reply_text(f"❌ الحد الأقصى للرهان {game_bot.settings['max_bet']:,} كوين!")
-        return
-    
-    if bet_amount > user_data['balance']:
-        await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين")
-        return
-    
-    # رموز آلة القمار مع أوزان مختلفة
-    symbols = [
-        ("🍋", 30), ("🍊", 25), ("🍇", 20), ("🍒", 15),
-        ("⭐", 8), ("7️⃣", 5), ("💎", 2)
-    ]
-    
-    # إنشاء قائمة موزونة
-    weighted_symbols = []
-    for symbol, weight in symbols:
-        weighted_symbols.extend([symbol] * weight)
-    
-    # دوران البكرات
-    result = [random.choice(weighted_symbols) for _ in range(3)]
-    
-    # حساب المضاعف
-    multiplier = 0
-    win_type = ""
-    
-    if result[0] == result[1] == result[2]:  # ثلاثة متطابقة
-        symbol = result[0]
-        if symbol == "💎":
-            multiplier = 20
-            win_type = "💎 JACKPOT! 💎"
-        elif symbol == "7️⃣":
-            multiplier = 15
-            win_type = "🎰 SUPER WIN!"
-        elif symbol == "⭐":
-            multiplier = 10
-            win_type = "⭐ BIG WIN!"
-        elif symbol == "🍒":
-            multiplier = 8
-            win_type = "🍒 GREAT!"
-        elif symbol == "🍇":
-            multiplier = 6
-            win_type = "🍇 GOOD!"
-        elif symbol == "🍊":
-            multiplier = 5
-            win_type = "🍊 NICE!"
-        elif symbol == "🍋":
-            multiplier = 4
-            win_type = "🍋 WIN!"
-            
-    elif len(set(result)) == 2:  # اثنان متطابقان
-        multiplier = 2
-        win_type = "✨ PAIR!"
-    
-    # تحديث الإحصائيات
-    user_data['games_played'] += 1
-    user_data['total_wagered'] += bet_amount
-    user_data['favorite_game'] = 'slots'
-    
-    if multiplier > 0:
-        winnings = bet_amount * multiplier
-        profit = winnings - bet_amount
-        user_data['balance'] += profit
-        user_data['wins'] += 1
-        user_data['total_won'] += profit
-        user_data['exp'] += min(5 + (multiplier * 2), 50)
-        
-        # رسالة الفوز مع تأثيرات بصرية
-        result_text = f"""
-{win_type}
 
-🎰 {'│'.join(result)} 🎰
+    def resolve(self, choice, rng) -> GameRound:
+        reels = [rng.choice(self.reel) for _ in range(3)]
+        # النتيجة: ترتيب رمز كل بكرة في SYMBOLS بثلاث خانات ثمانية
+        outcome = 0
+        for symbol in reels:
+            outcome = outcome * 8 + self.positions[symbol]
+        if reels[0] == reels[1] == reels[2]:
+            multiplier, title = self.triples[reels[0]]
+        elif len(set(reels)) == 2:
+            multiplier, title = 2, "✨ PAIR!"
+        else:
+            return GameRound(0, 2, outcome, reels=reels)
+        return GameRound(multiplier, min(5 + (multiplier * 2), 50), outcome, reels=reels, title=title)
+
+    def describe_outcome(self, outcome: int) -> str:
+        return '│'.join(self.SYMBOLS[(outcome >> shift) & 7][0] for shift in (6, 3, 0))
+
+    def render(self, result, choice, bet_amount, net, balance) -> str:
+        reels = '│'.join(result.details['reels'])
+        if result.won:
+            celebration = '🎊' * (result.multiplier // 5)
+            return f"""
+{result.details['title']}
+
+🎰 {reels} 🎰
 
-🎉 <b>فزت بـ {winnings:,} كوين!</b>
-💰 <b>الربح:</b> +{profit:,} كوين
-🎯 <b>المضاعف:</b> x{multiplier}
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+🎉 <b>فزت بـ {bet_amount + net:,} كوين!</b>
+💰 <b>الربح:</b> +{net:,} كوين
+🎯 <b>المضاعف:</b> x{result.multiplier}
+💳 <b>رصيدك:</b> {balance:,} كوين
 
-{'🎊' * (multiplier // 5)} تهانينا! {'🎊' * (multiplier // 5)}
+{celebration} تهانينا! {celebration}
 """
-    else:
-        user_data['balance'] -= bet_amount
-        user_data['losses'] += 1
-        user_data['total_lost'] += bet_amount
-        user_data['exp'] += 2
-        
-        result_text = f"""
-🎰 {'│'.join(result)} 🎰
+        return f"""
+🎰 {reels} 🎰
 
 😔 <b>لم تفز هذه المرة</b>
 💸 <b>الخسارة:</b> -{bet_amount:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 
 حاول مرة أخرى! 🍀
 """
-    
-    # فحص رفع المستوى
-    next_level_exp = game_bot.calculate_level_up_exp(user_data['level'])
-    if user_data['exp'] >= next_level_exp:
-        old_level = user_data['level']
-        user_data['level'] += 1
-        level_bonus = game_bot.settings['level_up_bonus']
-        user_data['balance'] += level_bonus
-        result_text += f"\n🆙 <b>مستوى جديد! {old_level} → {user_data['level']}</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
-    
-    # فحص الإنجازات
-    achievement_msg = game_bot.check_achievements(user_id, user_data)
-    if achievement_msg:
-        result_text += f"\n{achievement_msg}"
-    
-    game_bot.update_user_data(user_id, user_data)
-    
-    # أزرار التفاعل
-    keyboard = [
-        [InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data="game_slots"),
-         InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")],
-        [InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-         InlineKeyboardButton("💰 الرصيد", callback_data="show_balance")]
+
+def build_dice_bets() -> Dict[str, tuple]:
+    """جدول رهانات النرد: الاسم -> (الوصف، الأوجه الرابحة، المضاعف)، والأسماء البديلة تشير إلى نفس الرهان"""
+    bets = {str(face): (f"رقم مباشر ({face})", {face}, 5) for face in range(1, 7)}
+    outside = [
+        (("زوجي", "even"), ("زوجي", {2, 4, 6}, 2)),
+        (("فردي", "odd"), ("فردي", {1, 3, 5}, 2)),
+        (("صغير", "small", "low"), ("صغير (1-3)", {1, 2, 3}, 2)),
+        (("كبير", "big", "high"), ("كبير (4-6)", {4, 5, 6}, 2)),
     ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
+    for aliases, bet in outside:
+        for alias in aliases:
+            bets[alias] = bet
+    return bets
 
-@maintenance_check
-@ban_check
-async def dice_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """لعبة النرد المحسنة"""
-    user_id = update.effective_user.id
-    user_data = game_bot.get_user_data(user_id)
-    
-    if not context.args or len(context.args) < 2:
-        help_text = f"""
+class DiceGame(GamePlugin):
+    """النرد: رقم مباشر أو زوجي/فردي أو صغير/كبير"""
+
+    name = "dice"
+    replay_label = "🎲 لعب مرة أخرى"
+    FACES = ["", "⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
+    BETS = build_dice_bets()
+
+    def help_text(self, settings) -> str:
+        return f"""
 🎯 <b>لعبة النرد المتطورة</b>
 
 📝 <b>الاستخدام:</b> /dice <المبلغ> <التخمين>
@@ -1330,145 +7239,67 @@ async def dice_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • كبير (4,5,6): ربح x2
 
 💰 <b>حدود الرهان:</b>
-الحد الأدنى: {game_bot.settings['min_bet']} كوين
-الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
+الحد الأدنى: {settings['min_bet']} كوين
+الحد الأقصى: {settings['max_bet']:,} كوين
 
 💡 <b>أمثلة:</b>
 /dice 100 4 (رقم محدد)
 /dice 200 زوجي
 /dice 150 كبير
 """
-        await update.message.reply_text(help_text, parse_mode='HTML')
-        return
-    
-    try:
-        bet_amount = int(context.args[0])
-        bet_type = context.args[1].lower().strip()
-    except ValueError:
-        await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
-        return
-    
-    # التحقق من صحة الرهان
-    if bet_amount < game_bot.settings['min_bet']:
-        await update.message.reply_text(f"❌ الحد الأدنى للرهان {game_bot.settings['min_bet']} كوين!")
-        return
-    
-    if bet_amount > game_bot.settings['max_bet']:
-        await update.message.reply_text(f"❌ الحد الأقصى للرهان {game_bot.settings['max_bet']:,} كوين!")
-        return
-    
-    if bet_amount > user_data['balance']:
-        await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين")
-        return
-    
-    # رمي النرد
-    dice_result = random.randint(1, 6)
-    dice_emoji = ["", "⚀", "⚁", "⚂", "⚃", "⚄", "⚅"][dice_result]
-    
-    # تحديد نوع الرهان والفوز
-    won = False
-    multiplier = 0
-    win_description = ""
-    
-    if bet_type.isdigit():
-        guess = int(bet_type)
-        if 1 <= guess <= 6 and guess == dice_result:
-            won = True
-            multiplier = 5
-            win_description = f"رقم مباشر ({guess})"
-    elif bet_type in ["زوجي", "even"] and dice_result % 2 == 0:
-        won = True
-        multiplier = 2
-        win_description = "زوجي"
-    elif bet_type in ["فردي", "odd"] and dice_result % 2 == 1:
-        won = True
-        multiplier = 2
-        win_description = "فردي"
-    elif bet_type in ["صغير", "small", "low"] and dice_result <= 3:
-        won = True
-        multiplier = 2
-        win_description = "صغير (1-3)"
-    elif bet_type in ["كبير", "big", "high"] and dice_result >= 4:
-        won = True
-        multiplier = 2
-        win_description = "كبير (4-6)"
-    
-    # تحديث الإحصائيات
-    user_data['games_played'] += 1
-    user_data['total_wagered'] += bet_amount
-    user_data['favorite_game'] = 'dice'
-    
-    if won:
-        winnings = bet_amount * multiplier
-        profit = winnings - bet_amount
-        user_data['balance'] += profit
-        user_data['wins'] += 1
-        user_data['total_won'] += profit
-        user_data['exp'] += 5 + (multiplier * 3)
-        
-        result_text = f"""
+
+    def parse(self, args):
+        bet = self.BETS.get(args[0].lower().strip())
+        if bet is None:
+            raise ValueError("❌ تخمين غير معروف! اختر رقماً من 1 إلى 6 أو زوجي/فردي/صغير/كبير")
+        return bet
+
+    def resolve(self, bet, rng) -> GameRound:
+        roll = rng.randint(1, 6)
+        _, faces, multiplier = bet
+        if roll in faces:
+            return GameRound(multiplier, 5 + (multiplier * 3), roll, roll=roll)
+        return GameRound(0, 3, roll, roll=roll)
+
+    def describe_outcome(self, outcome: int) -> str:
+        return f"{outcome} {self.FACES[outcome]}" if 1 <= outcome <= 6 else str(outcome)
+
+    def render(self, result, bet, bet_amount, net, balance) -> str:
+        roll = result.details['roll']
+        label = bet[0]
+        if result.won:
+            return f"""
 🎯 <b>تخمين رائع! فزت!</b>
 
-🎲 <b>نتيجة النرد:</b> {dice_result} {dice_emoji}
-🎯 <b>رهانك:</b> {bet_type} ({bet_amount:,} كوين)
-✅ <b>الفوز:</b> {win_description}
-💰 <b>المضاعف:</b> x{multiplier}
-💵 <b>الربح:</b> {profit:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+🎲 <b>نتيجة النرد:</b> {roll} {self.FACES[roll]}
+🎯 <b>رهانك:</b> {label} ({bet_amount:,} كوين)
+✅ <b>الفوز:</b> {label}
+💰 <b>المضاعف:</b> x{result.multiplier}
+💵 <b>الربح:</b> {net:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 
 🎉 أحسنت! استمر في اللعب!
 """
-    else:
-        user_data['balance'] -= bet_amount
-        user_data['losses'] += 1
-        user_data['total_lost'] += bet_amount
-        user_data['exp'] += 3
-        
-        result_text = f"""
+        return f"""
 🎯 <b>للأسف لم تصب هذه المرة</b>
 
-🎲 <b>نتيجة النرد:</b> {dice_result} {dice_emoji}
-🎯 <b>رهانك:</b> {bet_type} ({bet_amount:,} كوين)
+🎲 <b>نتيجة النرد:</b> {roll} {self.FACES[roll]}
+🎯 <b>رهانك:</b> {label} ({bet_amount:,} كوين)
 ❌ <b>الخسارة:</b> -{bet_amount:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 
 🍀 حظ أوفر في المرة القادمة!
 """
-    
-    # فحص رفع المستوى والإنجازات
-    next_level_exp = game_bot.calculate_level_up_exp(user_data['level'])
-    if user_data['exp'] >= next_level_exp:
-        old_level = user_data['level']
-        user_data['level'] += 1
-        level_bonus = game_bot.settings['level_up_bonus']
-        user_data['balance'] += level_bonus
-        result_text += f"\n🆙 <b>مستوى جديد! {old_level} → {user_data['level']}</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
-    
-    achievement_msg = game_bot.check_achievements(user_id, user_data)
-    if achievement_msg:
-        result_text += f"\n{achievement_msg}"
-    
-    game_bot.update_user_data(user_id, user_data)
-    
-    keyboard = [
-        [InlineKeyboardButton("🎲 لعب مرة أخرى", callback_data="game_dice"),
-         InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")],
-        [InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-         InlineKeyboardButton("💰 الرصيد", callback_data="show_balance")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
 
-@maintenance_check
-@ban_check
-async def coinflip_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """لعبة قلب العملة المحسنة"""
-    user_id = update.effective_user.id
-    user_data = game_bot.get_user_data(user_id)
-    
-    if not context.args or len(context.args) < 2:
-        help_text = f"""
+class CoinflipGame(GamePlugin):
+    """قلب العملة: صورة أو كتابة بمضاعف x2"""
+
+    name = "coinflip"
+    replay_label = "🪙 قلب مرة أخرى"
+    CHOICES = {"صورة": "صورة", "heads": "صورة", "كتابة": "كتابة", "tails": "كتابة"}
+
+    def help_text(self, settings) -> str:
+        return f"""
 🪙 <b>لعبة قلب العملة</b>
 
 📝 <b>الاستخدام:</b> /coinflip <المبلغ> <الاختيار>
@@ -1479,121 +7310,204 @@ async def coinflip_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • المضاعف: x2 عند الفوز
 
 💰 <b>حدود الرهان:</b>
-الحد الأدنى: {game_bot.settings['min_bet']} كوين
-الحد الأقصى: {game_bot.settings['max_bet']:,} كوين
+الحد الأدنى: {settings['min_bet']} كوين
+الحد الأقصى: {settings['max_bet']:,} كوين
 
 💡 <b>مثال:</b>
 /coinflip 100 صورة
 /coinflip 250 كتابة
 """
-        await update.message.reply_text(help_text, parse_mode='HTML')
-        return
-    
-    try:
-        bet_amount = int(context.args[0])
-        choice = ' '.join(context.args[1:]).lower().strip()
-    except ValueError:
-        await update.message.reply_text("❌ المبلغ يجب أن يكون رقماً!")
-        return
-    
-    # التحقق من صحة الرهان
-    if bet_amount < game_bot.settings['min_bet']:
-        await update.message.reply_text(f"❌ الحد الأدنى للرهان {game_bot.settings['min_bet']} كوين!")
-        return
-    
-    if bet_amount > game_bot.settings['max_bet']:
-        await update.message.reply_text(f"❌ الحد الأقصى للرهان {game_bot.settings['max_bet']:,} كوين!")
-        return
-    
-    if bet_amount > user_data['balance']:
-        await update.message.reply_text(f"❌ رصيدك غير كافي! رصيدك: {user_data['balance']:,} كوين")
-        return
-    
-    # التحقق من صحة الاختيار
-    if choice not in ["صورة", "كتابة", "heads", "tails"]:
-        await update.message.reply_text("❌ اختر 'صورة' أو 'كتابة' فقط!")
-        return
-    
-    # تطبيع الاختيار
-    if choice in ["heads", "صورة"]:
-        choice = "صورة"
-    else:
-        choice = "كتابة"
-    
-    # قلب العملة مع تأثير بصري
-    flip_animation = ["🪙", "🌀", "💫", "⭐"]
-    result = random.choice(["صورة", "كتابة"])
-    result_emoji = "🟡" if result == "صورة" else "⚪"
-    
-    # تحديد الفوز
-    won = result == choice
-    
-    # تحديث الإحصائيات
-    user_data['games_played'] += 1
-    user_data['total_wagered'] += bet_amount
-    user_data['favorite_game'] = 'coinflip'
-    
-    if won:
-        winnings = bet_amount * 2
-        profit = bet_amount  # الربح = المبلغ الأصلي
-        user_data['balance'] += profit
-        user_data['wins'] += 1
-        user_data['total_won'] += profit
-        user_data['exp'] += 8
-        
-        result_text = f"""
+
+    def parse(self, args) -> str:
+        choice = self.CHOICES.get(' '.join(args).lower().strip())
+        if choice is None:
+            raise ValueError("❌ اختر 'صورة' أو 'كتابة' فقط!")
+        return choice
+
+    SIDES = ("صورة", "كتابة")
+
+    def resolve(self, choice: str, rng) -> GameRound:
+        outcome = rng.randrange(2)
+        side = self.SIDES[outcome]
+        return GameRound(2, 8, outcome, side=side) if side == choice else GameRound(0, 3, outcome, side=side)
+
+    def describe_outcome(self, outcome: int) -> str:
+        return self.SIDES[outcome] if outcome < 2 else str(outcome)
+
+    def render(self, result, choice, bet_amount, net, balance) -> str:
+        side = result.details['side']
+        emoji = "🟡" if side == "صورة" else "⚪"
+        if result.won:
+            return f"""
 🎉 <b>رائع! توقعت بشكل صحيح!</b>
 
-🪙 <b>نتيجة العملة:</b> {result} {result_emoji}
+🪙 <b>نتيجة العملة:</b> {side} {emoji}
 🎯 <b>اختيارك:</b> {choice}
 ✅ <b>صحيح!</b>
-💰 <b>الربح:</b> +{profit:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+💰 <b>الربح:</b> +{net:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 
 🏆 حدس ممتاز! 
 """
-    else:
-        user_data['balance'] -= bet_amount
-        user_data['losses'] += 1
-        user_data['total_lost'] += bet_amount
-        user_data['exp'] += 3
-        
-        result_text = f"""
+        return f"""
 😔 <b>أوه! لم يكن هذا توقعك</b>
 
-🪙 <b>نتيجة العملة:</b> {result} {result_emoji}
+🪙 <b>نتيجة العملة:</b> {side} {emoji}
 🎯 <b>اختيارك:</b> {choice}
 ❌ <b>خطأ</b>
 💸 <b>الخسارة:</b> -{bet_amount:,} كوين
-💳 <b>رصيدك:</b> {user_data['balance']:,} كوين
+💳 <b>رصيدك:</b> {balance:,} كوين
 
 🍀 المرة القادمة ستكون أفضل!
 """
-    
-    # فحص رفع المستوى والإنجازات
-    next_level_exp = game_bot.calculate_level_up_exp(user_data['level'])
-    if user_data['exp'] >= next_level_exp:
-        old_level = user_data['level']
-        user_data['level'] += 1
-        level_bonus = game_bot.settings['level_up_bonus']
-        user_data['balance'] += level_bonus
-        result_text += f"\n🆙 <b>مستوى جديد! {old_level} → {user_data['level']}</b>\n💰 <b>مكافأة:</b> +{level_bonus:,} كوين"
-    
-    achievement_msg = game_bot.check_achievements(user_id, user_data)
-    if achievement_msg:
-        result_text += f"\n{achievement_msg}"
-    
-    game_bot.update_user_data(user_id, user_data)
-    
-    keyboard = [
-        [InlineKeyboardButton("🪙 قلب مرة أخرى", callback_data="game_coinflip"),
-         InlineKeyboardButton("🎮 ألعاب أخرى", callback_data="main_menu")],
-        [InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-         InlineKeyboardButton("💰 الرصيد", callback_data="show_balance")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
+
+game_registry.register("slots", SlotsGame)
+game_registry.register("dice", DiceGame)
+game_registry.register("coinflip", CoinflipGame)
+
+# ===== أدوات سطر الأوامر =====
+
+def convert_state_file(source: str, destination: str, codec_name: str, kind: str = "users") -> int:
+    """تحويل ملف حالة إلى مرمز آخر مع ترحيله إلى إصدار المخطط الحالي"""
+    with open(source, 'rb') as f:
+        data, version = load_state(f.read())
+    if kind == "users":
+        migrate_users(data, version, game_bot.settings)
+
+    write_file_atomic(destination, dump_state(data, codec_name))
+    return len(data)
+
+def synthetic_users(count: int, seed: int = 42) -> Dict[str, Any]:
+    """بيانات مستخدمين تجريبية بأحجام وقيم واقعية لاختبارات الأداء"""
+    rng = random.Random(seed)
+    achievement_ids = ['games_100', 'wins_50', 'rich_10k', 'level_10']
+    games = ['roulette', 'slots', 'dice', 'coinflip', None]
+    users = {}
+    for i in range(count):
+        user = new_user_record(DEFAULT_SETTINGS)
+        played = rng.randint(0, 2000)
+        wins = rng.randint(0, played)
+        user.update({
+            'balance': rng.randint(0, 500000),
+            'wins': wins,
+            'losses': played - wins,
+            'games_played': played,
+            'level': rng.randint(1, 40),
+            'exp': rng.randint(0, 20000),
+            'achievements': rng.sample(achievement_ids, rng.randint(0, len(achievement_ids))),
+            'total_wagered': rng.randint(0, 10 ** 7),
+            'total_won': rng.randint(0, 10 ** 6),
+            'total_lost': rng.randint(0, 10 ** 6),
+            'favorite_game': rng.choice(games),
+            'daily_streak': rng.randint(0, 60),
+            'last_daily': user['join_date'] if rng.random() < 0.7 else None,
+        })
+        users[str(100000000 + i)] = user
+    return users
+
+def benchmark_codecs(users_count: int, rounds: int = 3):
+    """قياس سرعة الترميز وفك الترميز وحجم الملف لكل مرمز متاح"""
+    users = synthetic_users(users_count)
+    candidates = [(
+        "json-indent2",
+        lambda data: json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'),
+        json.loads,
+    )]
+    candidates += [(codec.name, codec.encode, codec.decode) for codec in STATE_CODECS.values()]
+
+    print(f"📊 {users_count:,} مستخدم - أفضل نتيجة من {rounds} محاولات")
+    print(f"{'codec':<14}{'size MB':>10}{'encode MB/s':>14}{'decode MB/s':>14}{'encode s':>10}{'decode s':>10}")
+    for name, encode, decode in candidates:
+        encode_time = decode_time = float('inf')
+        payload = b""
+        for _ in range(rounds):
+            started = time.perf_counter()
+            payload = encode(users)
+            encode_time = min(encode_time, time.perf_counter() - started)
+            started = time.perf_counter()
+            decode(payload)
+            decode_time = min(decode_time, time.perf_counter() - started)
+        size_mb = len(payload) / 1e6
+        print(f"{name:<14}{size_mb:>10.2f}{size_mb / encode_time:>14.1f}{size_mb / decode_time:>14.1f}"
+              f"{encode_time:>10.3f}{decode_time:>10.3f}")
+
+def benchmark_recovery(users_count: int, budget: float, codec_name: str = STATE_CODEC) -> bool:
+    """محاكاة انهيار أثناء الحفظ: ملف مقطوع ونسخة احتياطية سليمة، وقياس زمن الإقلاع حتى الاستعادة"""
+    folder = tempfile.mkdtemp(prefix="recovery_bench_")
+    path = os.path.join(folder, "users_data.json")
+    prefix = os.path.join(folder, "users_backup_")
+    try:
+        users = synthetic_users(users_count)
+        started = time.perf_counter()
+        write_file_atomic(path, dump_state(users, codec_name))
+        write_time = time.perf_counter() - started
+        backup_state_file(path, prefix)
+
+        started = time.perf_counter()
+        load_state_with_fallback(path, prefix)
+        clean_time = time.perf_counter() - started
+
+        # حفظ لاحق وصل إلى القرص ناقصاً (نصف المحتوى فقط) - ملف جديد لأن النسخة الاحتياطية رابط صلب للقديم
+        users[str(100000000)]['balance'] += 1
+        payload = dump_state(users, codec_name)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(payload[:len(payload) // 2])
+        os.replace(path + ".tmp", path)
+        del users, payload
+
+        started = time.perf_counter()
+        recovered, _, source = load_state_with_fallback(path, prefix)
+        recovery_time = time.perf_counter() - started
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    ok = source != path and len(recovered) == users_count and recovery_time <= budget
+    print(f"📊 {users_count:,} مستخدم - المرمز {get_codec(codec_name).name}")
+    print(f"💾 حفظ ذري (fsync + rename): {write_time:.2f} ث")
+    print(f"📂 تحميل سليم مع التحقق من المجموع: {clean_time:.2f} ث")
+    print(f"🛟 كشف التلف والاستعادة من {os.path.basename(source)}: {recovery_time:.2f} ث (الحد {budget:g} ث)")
+    print(("✅" if ok else "❌") + f" {len(recovered):,} مستخدم مستعاد")
+    return ok
+
+def run_cli(argv) -> int:
+    """أوامر الصيانة من سطر الأوامر (بدون تشغيل البوت)"""
+    parser = argparse.ArgumentParser(prog="bot22.py", description="أدوات صيانة بيانات البوت")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="تحويل ملف حالة إلى مرمز آخر")
+    convert.add_argument("source")
+    convert.add_argument("destination")
+    convert.add_argument("--codec", default=STATE_CODEC, choices=sorted(STATE_CODECS))
+    convert.add_argument("--kind", default="users", choices=["users", "messages"])
+
+    bench = commands.add_parser("bench-codecs", help="قياس أداء المرمزات")
+    bench.add_argument("--users", type=int, default=100000)
+    bench.add_argument("--rounds", type=int, default=3)
+
+    recovery = commands.add_parser("bench-recovery", help="قياس زمن الاستعادة بعد انهيار أثناء الحفظ")
+    recovery.add_argument("--users", type=int, default=1000000)
+    recovery.add_argument("--budget", type=float, default=RECOVERY_BUDGET_SECONDS)
+    recovery.add_argument("--codec", default=STATE_CODEC, choices=sorted(STATE_CODECS))
+
+    verify = commands.add_parser("verify-lottery", help="التحقق من نزاهة سحب يانصيب")
+    verify.add_argument("draw_id", type=int)
+    verify.add_argument("--folder", default=LOTTERY_FOLDER)
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        count = convert_state_file(args.source, args.destination, args.codec, args.kind)
+        print(f"✅ تم تحويل {count:,} سجل إلى {args.codec}: {args.destination}")
+    elif args.command == "bench-codecs":
+        benchmark_codecs(args.users, args.rounds)
+    elif args.command == "bench-recovery":
+        return 0 if benchmark_recovery(args.users, args.budget, args.codec) else 1
+    elif args.command == "verify-lottery":
+        ok, message = verify_lottery_draw(args.folder, args.draw_id)
+        print(("✅ " if ok else "❌ ") + message)
+        return 0 if ok else 1
+    return 0
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()